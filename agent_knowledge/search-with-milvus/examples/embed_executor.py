@@ -0,0 +1,205 @@
+"""
+Concurrent embedding with adaptive batch sizes for index-with-milvus.py.
+
+EmbeddingExecutor sends up to EMBED_CONCURRENCY batches to embed_documents at once and returns
+the vectors in input order. Both the batch size and the number of requests in flight follow the
+service. The batch size grows by EMBED_BATCH_STEP while batches come back within
+EMBED_TARGET_LATENCY_SECONDS. It shrinks in proportion when they take longer and is halved on
+errors other than throttling.
+When the service throttles (HTTP 429/503), the requests in flight are halved and then grow by
+one again after a run of successful batches. All workers also pause until the backoff, or the
+Retry-After the service asked for, has passed. Failed batches are retried up to
+EMBED_MAX_RETRIES times with exponential backoff.
+
+Compare it with fixed batches of 100 sent one after another, against a local fake service:
+
+    python3 embed_executor.py --texts 5000
+"""
+import os, time, random, logging, argparse, threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+EMBED_CONCURRENCY = int(os.environ.get("EMBED_CONCURRENCY", "4"))
+EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", "100"))
+EMBED_MIN_BATCH_SIZE = int(os.environ.get("EMBED_MIN_BATCH_SIZE", "8"))
+EMBED_MAX_BATCH_SIZE = int(os.environ.get("EMBED_MAX_BATCH_SIZE", "500"))
+EMBED_TARGET_LATENCY_SECONDS = float(os.environ.get("EMBED_TARGET_LATENCY_SECONDS", "2"))
+EMBED_MAX_RETRIES = int(os.environ.get("EMBED_MAX_RETRIES", "6"))
+EMBED_BATCH_STEP = 16
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 30
+THROTTLING_STATUS_CODES = (429, 503)
+
+logger = logging.getLogger(__name__)
+
+
+def _status_code(error):
+    """
+    The HTTP status of a failed embedding request, read from the status_code of the error or of its
+    response (requests, httpx and watsonx.ai errors carry one of the two). None when neither has one.
+    """
+    for source in (error, getattr(error, "response", None)):
+        code = getattr(source, "status_code", None)
+        if isinstance(code, int):
+            return code
+    return None
+
+
+def _retry_after(error):
+    headers = getattr(getattr(error, "response", None), "headers", None) or getattr(error, "headers", None)
+    try:
+        return float(headers.get("Retry-After")) if headers else None
+    except (TypeError, ValueError):
+        return None
+
+
+class EmbeddingExecutor:
+    def __init__(self, embeddings, concurrency=EMBED_CONCURRENCY, batch_size=EMBED_BATCH_SIZE,
+                 min_batch_size=EMBED_MIN_BATCH_SIZE, max_batch_size=EMBED_MAX_BATCH_SIZE,
+                 target_latency=EMBED_TARGET_LATENCY_SECONDS, max_retries=EMBED_MAX_RETRIES):
+        self.embeddings = embeddings
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.target_latency = target_latency
+        self.max_retries = max_retries
+        self.limit = concurrency
+        self.counters = {'batches': 0, 'texts': 0, 'retries': 0, 'throttled': 0, 'seconds': 0.0}
+        self._lock = threading.Lock()
+        self._slots = threading.Condition(self._lock)
+        self._active = 0
+        self._successes = 0
+        self._resume_at = 0.0
+
+    def _acquire(self):
+        with self._slots:
+            while self._active >= self.limit:
+                self._slots.wait()
+            self._active += 1
+
+    def _release(self):
+        with self._slots:
+            self._active -= 1
+            self._slots.notify()
+
+    def _on_success(self, texts, latency):
+        with self._lock:
+            self.counters['batches'] += 1
+            self.counters['texts'] += texts
+            self.counters['seconds'] += latency
+            # Only a full batch says anything about whether a larger one would still be fast enough
+            if latency > self.target_latency:
+                self.batch_size = max(self.min_batch_size, int(self.batch_size * self.target_latency / latency))
+            elif texts >= self.batch_size:
+                self.batch_size = min(self.max_batch_size, self.batch_size + EMBED_BATCH_STEP)
+            self._successes += 1
+            if self.limit < self.concurrency and self._successes >= self.limit:
+                self.limit += 1
+                self._successes = 0
+                self._slots.notify()
+
+    def _on_error(self, error, attempt):
+        status = _status_code(error)
+        delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempt - 1)) * random.uniform(0.5, 1)
+        with self._lock:
+            self.counters['retries'] += 1
+            self._successes = 0
+            if status in THROTTLING_STATUS_CODES:
+                # Smaller batches would only mean more requests, send fewer at once instead
+                self.counters['throttled'] += 1
+                self.limit = max(1, self.limit // 2)
+                delay = max(delay, _retry_after(error) or 0)
+                # Every worker waits, a throttled service is not helped by the other batches either
+                self._resume_at = max(self._resume_at, time.monotonic() + delay)
+            else:
+                self.batch_size = max(self.min_batch_size, self.batch_size // 2)
+        logger.warning(f"Embedding batch failed (attempt {attempt}, status {status}): {str(error)}, "
+                       f"retrying in {delay:.1f}s with {self.limit} requests in flight and batches of {self.batch_size}")
+        return delay
+
+    def _embed_batch(self, texts):
+        attempt = 0
+        while True:
+            wait = self._resume_at - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self._acquire()
+            started = time.perf_counter()
+            try:
+                vectors = self.embeddings.embed_documents(texts)
+            except Exception as e:
+                self._release()
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                time.sleep(self._on_error(e, attempt))
+                # The batch may be too large for the service, continue with the smaller size
+                if len(texts) > self.batch_size:
+                    size = self.batch_size
+                    return [vector for start in range(0, len(texts), size)
+                            for vector in self._embed_batch(texts[start:start + size])]
+                continue
+            self._release()
+            if len(vectors) != len(texts):
+                raise ValueError(f"Got {len(vectors)} embeddings for {len(texts)} texts")
+            self._on_success(len(texts), time.perf_counter() - started)
+            return vectors
+
+    def embed_batches(self, items, text=lambda item: item):
+        """
+        Yields (batch, vectors) for consecutive batches of items in their original order, where
+        text(item) is the string to embed. At most twice concurrency batches are in flight.
+        """
+        items = iter(items)
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="embed") as executor:
+            in_flight = deque()
+            while True:
+                batch = [item for _, item in zip(range(self.batch_size), items)]
+                if batch:
+                    in_flight.append((batch, executor.submit(self._embed_batch, [text(item) for item in batch])))
+                if in_flight and (not batch or len(in_flight) >= 2 * self.concurrency):
+                    batch_done, future = in_flight.popleft()
+                    yield batch_done, future.result()
+                elif not batch:
+                    return
+
+    def embed_documents(self, texts):
+        return [vector for _, vectors in self.embed_batches(texts) for vector in vectors]
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, batch_size=self.batch_size, in_flight_limit=self.limit)
+
+
+def main():
+    import fake_embedding_server
+
+    parser = argparse.ArgumentParser(description="Compare serial fixed batches with EmbeddingExecutor on a fake service")
+    parser.add_argument("--texts", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=EMBED_CONCURRENCY)
+    fake_embedding_server.add_arguments(parser)
+    args = parser.parse_args()
+    server = fake_embedding_server.start(args)
+    embeddings = fake_embedding_server.HttpEmbeddings(f"http://127.0.0.1:{server.server_port}")
+    texts = [f"Chunk {i} of the annual report about revenue and margins" for i in range(args.texts)]
+    try:
+        # The baseline gets the same retries, so throttling does not fail it
+        baseline = EmbeddingExecutor(embeddings, concurrency=1, batch_size=100, min_batch_size=100, max_batch_size=100)
+        started = time.perf_counter()
+        serial = baseline.embed_documents(texts)
+        serial_seconds = time.perf_counter() - started
+        print(f"serial, batches of 100: {serial_seconds:.2f}s, {len(texts) / serial_seconds:.0f} texts/s, {baseline.stats()}")
+        executor = EmbeddingExecutor(embeddings, concurrency=args.concurrency)
+        started = time.perf_counter()
+        vectors = executor.embed_documents(texts)
+        seconds = time.perf_counter() - started
+        print(f"executor, {args.concurrency} in flight: {seconds:.2f}s, {len(texts) / seconds:.0f} texts/s, {executor.stats()}")
+        if vectors != serial:
+            raise SystemExit("EmbeddingExecutor returned different vectors than serial batches")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
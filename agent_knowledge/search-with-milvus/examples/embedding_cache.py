@@ -0,0 +1,235 @@
+"""
+Persistent embedding cache for the ingestion pipeline of index-with-milvus.py.
+
+Vectors are stored per embedding model under EMBEDDING_CACHE_DIR/<model id>, keyed by the sha256
+of the chunk text, so rebuilding a collection or building a second one from the same documents
+only embeds the chunks that were never embedded with that model. Each model directory holds
+- vectors.bin, a memory-mapped (capacity, dimensions) array of EMBEDDING_CACHE_DTYPE values,
+  float32 or float16 for half the disk space,
+- index.bin, a memory-mapped array with the text hash and a last-used counter per slot,
+- meta.json with the model id, dimensions, dtype and capacity.
+The files grow by doubling up to EMBEDDING_CACHE_MAX_ENTRIES. After that the least recently used
+tenth of the entries is evicted to make room. A directory should only be used by one process at a time.
+
+Milvus stores float32 vectors, so a cached float32 vector indexes exactly like a fresh one.
+
+The cache is off unless EMBEDDING_CACHE_DIR is set. Compare a cold and a warm run against the local fake service:
+
+    python3 embedding_cache.py --texts 5000
+"""
+import os, re, json, time, shutil, hashlib, logging, argparse, tempfile, threading
+
+import numpy as np
+
+EMBEDDING_CACHE_DIR = os.environ.get("EMBEDDING_CACHE_DIR", "")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", "1000000"))
+EMBEDDING_CACHE_DTYPE = os.environ.get("EMBEDDING_CACHE_DTYPE", "float32")
+INITIAL_CAPACITY = 1024
+EVICT_FRACTION = 0.1
+CACHE_VERSION = 1
+
+# A slot is free while its last-used counter is 0
+_SLOT = np.dtype([('digest', np.uint8, (32,)), ('used', '<u8')])
+
+logger = logging.getLogger(__name__)
+
+
+def text_digest(text):
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    def __init__(self, directory, model_id, max_entries=EMBEDDING_CACHE_MAX_ENTRIES, dtype=EMBEDDING_CACHE_DTYPE):
+        self.model_id = model_id
+        self.directory = os.path.join(directory, re.sub(r"[^A-Za-z0-9._-]", "_", model_id))
+        self.max_entries = max_entries
+        self.dtype = np.dtype(dtype)
+        self.dimensions = None
+        self.capacity = 0
+        self.counters = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+        self._lock = threading.Lock()
+        self._vectors = None
+        self._slots = None
+        self._index = {}
+        self._free = []
+        self._clock = 1
+        self._open()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _open(self):
+        try:
+            with open(self._path("meta.json")) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return
+        if (meta.get('version'), meta.get('model_id'), meta.get('dtype')) != (CACHE_VERSION, self.model_id, self.dtype.name):
+            # Created on the first store instead
+            logger.warning(f"Discarding embedding cache {self.directory} built with {meta}")
+            return
+        self.dimensions = meta['dimensions']
+        self._map(meta['capacity'])
+        used = self._slots['used']
+        digests = self._slots['digest']
+        self._index = {digests[slot].tobytes(): int(slot) for slot in np.flatnonzero(used)}
+        self._free = np.flatnonzero(used == 0)[::-1].tolist()
+        self._clock = int(used.max()) + 1 if self.capacity else 1
+        logger.info(f"Opened embedding cache {self.directory} with {len(self._index)} entries")
+
+    def _create(self, dimensions):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(self.directory)
+        self.dimensions = dimensions
+        self._map(min(INITIAL_CAPACITY, self.max_entries))
+
+    def _map(self, capacity):
+        """Maps both files with room for capacity entries, extending them in place when they are shorter."""
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._slots.flush()
+        self._vectors = self._slots = None
+        for name, row_bytes in (("vectors.bin", self.dimensions * self.dtype.itemsize), ("index.bin", _SLOT.itemsize)):
+            with open(self._path(name), 'ab') as f:
+                if f.tell() < capacity * row_bytes:
+                    f.truncate(capacity * row_bytes)
+        self._vectors = np.memmap(self._path("vectors.bin"), dtype=self.dtype, mode='r+', shape=(capacity, self.dimensions))
+        self._slots = np.memmap(self._path("index.bin"), dtype=_SLOT, mode='r+', shape=(capacity,))
+        self._free = list(range(capacity - 1, self.capacity - 1, -1)) + self._free
+        self.capacity = capacity
+        meta = {'version': CACHE_VERSION, 'model_id': self.model_id, 'dtype': self.dtype.name,
+                'dimensions': self.dimensions, 'capacity': capacity}
+        with open(self._path("meta.json"), 'w') as f:
+            json.dump(meta, f)
+
+    def _evict(self):
+        count = max(1, int(self.capacity * EVICT_FRACTION))
+        victims = np.argpartition(self._slots['used'], count - 1)[:count]
+        for slot in victims.tolist():
+            del self._index[self._slots['digest'][slot].tobytes()]
+            self._slots['used'][slot] = 0
+            self._free.append(slot)
+        self.counters['evictions'] += count
+
+    def _allocate(self):
+        if not self._free:
+            if self.capacity < self.max_entries:
+                self._map(min(self.max_entries, self.capacity * 2))
+            else:
+                self._evict()
+        return self._free.pop()
+
+    def lookup(self, digests):
+        """Returns the cached vector of every digest as a list of floats, or None where there is none."""
+        with self._lock:
+            slots = [self._index.get(digest) for digest in digests]
+            found = [slot for slot in slots if slot is not None]
+            self.counters['hits'] += len(found)
+            self.counters['misses'] += len(slots) - len(found)
+            if not found:
+                return [None] * len(slots)
+            self._slots['used'][found] = self._clock
+            self._clock += 1
+            vectors = iter(self._vectors[found].astype(np.float32).tolist())
+        return [next(vectors) if slot is not None else None for slot in slots]
+
+    def store(self, digests, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            if self.dimensions is None:
+                self._create(vectors.shape[1])
+            elif vectors.shape[1] != self.dimensions:
+                logger.warning(f"Not caching {vectors.shape[1]} dimensional embeddings in a {self.dimensions} dimensional cache")
+                return
+            for digest, vector in zip(digests, vectors):
+                if digest in self._index:
+                    continue
+                slot = self._allocate()
+                # The vector is written before the key, so a slot never points to a vector that is not there
+                self._vectors[slot] = vector
+                self._slots['digest'][slot] = np.frombuffer(digest, dtype=np.uint8)
+                self._slots['used'][slot] = self._clock
+                self._index[digest] = slot
+                self.counters['stores'] += 1
+            self._clock += 1
+
+    def flush(self):
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors.flush()
+                self._slots.flush()
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, entries=len(self._index), capacity=self.capacity)
+
+
+class CachedEmbeddings:
+    """The embed_documents/embed_query interface of the wrapped embeddings, with embed_documents served from an EmbeddingCache."""
+
+    def __init__(self, embeddings, cache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts):
+        digests = [text_digest(text) for text in texts]
+        vectors = self.cache.lookup(digests)
+        # Identical chunks in one batch are embedded once
+        missing = {digest: text for digest, text, vector in zip(digests, texts, vectors) if vector is None}
+        if not missing:
+            return vectors
+        computed = self.embeddings.embed_documents(list(missing.values()))
+        if len(computed) != len(missing):
+            raise ValueError(f"Got {len(computed)} embeddings for {len(missing)} texts")
+        self.cache.store(list(missing), computed)
+        computed = dict(zip(missing, computed))
+        return [vector if vector is not None else computed[digest] for digest, vector in zip(digests, vectors)]
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
+
+    def __getattr__(self, name):
+        return getattr(self.embeddings, name)
+
+
+def cached_embeddings(embeddings, directory=EMBEDDING_CACHE_DIR):
+    """Wraps embeddings in CachedEmbeddings when directory is set, keyed by their model_id."""
+    if not directory:
+        return embeddings
+    model_id = getattr(embeddings, "model_id", None) or type(embeddings).__name__
+    return CachedEmbeddings(embeddings, EmbeddingCache(directory, model_id))
+
+
+def main():
+    import fake_embedding_server
+    from embed_executor import EmbeddingExecutor
+
+    parser = argparse.ArgumentParser(description="Compare cold and warm embedding through EmbeddingCache on a fake service")
+    parser.add_argument("--texts", type=int, default=5000)
+    parser.add_argument("--dtype", default=EMBEDDING_CACHE_DTYPE)
+    fake_embedding_server.add_arguments(parser)
+    args = parser.parse_args()
+    server = fake_embedding_server.start(args)
+    embeddings = fake_embedding_server.HttpEmbeddings(f"http://127.0.0.1:{server.server_port}")
+    texts = [f"Chunk {i} of the annual report about revenue and margins" for i in range(args.texts)]
+    directory = tempfile.mkdtemp(prefix="embedding-cache-")
+    try:
+        uncached = EmbeddingExecutor(embeddings).embed_documents(texts)
+        for run in ("cold", "warm"):
+            # A new cache object each time, so the warm run reads what the cold run left on disk
+            cache = EmbeddingCache(directory, "fake", dtype=args.dtype)
+            started = time.perf_counter()
+            vectors = EmbeddingExecutor(CachedEmbeddings(embeddings, cache)).embed_documents(texts)
+            seconds = time.perf_counter() - started
+            cache.flush()
+            print(f"{run}: {seconds:.2f}s, {len(texts) / seconds:.0f} texts/s, {cache.stats()}")
+            error = float(np.max(np.abs(np.asarray(vectors) - np.asarray(uncached))))
+            if error > (1e-3 if cache.dtype.itemsize < 4 else 1e-6):
+                raise SystemExit(f"Cached vectors differ from fresh ones by up to {error}")
+    finally:
+        server.shutdown()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
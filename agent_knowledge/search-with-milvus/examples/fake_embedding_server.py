@@ -0,0 +1,125 @@
+"""
+A local stand-in for the watsonx.ai text embeddings API, for testing embed_executor.py and the
+ingestion pipeline without a watsonx.ai instance. Standard library only.
+
+POST /ml/v1/text/embeddings with {"inputs": [...]} returns {"results": [{"embedding": [...]}]}.
+Embeddings are derived from a hash of each text, so the same text always gets the same vector.
+Latency grows with the batch size, more than --max-concurrent requests at once get HTTP 429 with
+a Retry-After header and batches over --max-batch get HTTP 413, like a throttling service would.
+
+    python3 fake_embedding_server.py --port 8089 --latency-ms 200 --max-concurrent 4
+"""
+import json, time, random, hashlib, argparse, threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EMBEDDINGS_PATH = "/ml/v1/text/embeddings"
+
+
+def fake_embedding(text, dimensions):
+    digest = hashlib.sha256(text.encode("utf-8")).digest()
+    return [round(digest[i % len(digest)] / 255 - 0.5, 6) for i in range(dimensions)]
+
+
+class HttpEmbeddings:
+    """The embed_documents/embed_query interface of WatsonxEmbeddings, backed by this server."""
+
+    def __init__(self, url, timeout=60):
+        self.url = url.rstrip("/") + EMBEDDINGS_PATH
+        self.timeout = timeout
+
+    def embed_documents(self, texts):
+        request = urllib.request.Request(self.url, data=json.dumps({"inputs": texts}).encode("utf-8"),
+                                         headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return [result["embedding"] for result in json.load(response)["results"]]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def make_handler(args):
+    state = {'in_flight': 0, 'requests': 0, 'throttled': 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *log_args):
+            pass
+
+        def _reply(self, status, body, headers=None):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/health":
+                with lock:
+                    self._reply(200, dict(state))
+            else:
+                self._reply(404, {"error": "not found"})
+
+        def do_POST(self):
+            if not self.path.startswith(EMBEDDINGS_PATH):
+                self._reply(404, {"error": "not found"})
+                return
+            inputs = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))["inputs"]
+            if len(inputs) > args.max_batch:
+                self._reply(413, {"error": f"at most {args.max_batch} inputs per request"})
+                return
+            with lock:
+                state['requests'] += 1
+                throttled = (args.max_concurrent and state['in_flight'] >= args.max_concurrent) or \
+                    random.random() < args.throttle_rate
+                if throttled:
+                    state['throttled'] += 1
+                else:
+                    state['in_flight'] += 1
+            if throttled:
+                self._reply(429, {"error": "too many requests"}, {"Retry-After": str(args.retry_after)})
+                return
+            try:
+                time.sleep((args.latency_ms + args.per_text_ms * len(inputs)) / 1000)
+                results = [{"embedding": fake_embedding(text, args.dimensions)} for text in inputs]
+                self._reply(200, {"model_id": "fake", "results": results, "input_token_count": len(inputs)})
+            finally:
+                with lock:
+                    state['in_flight'] -= 1
+
+    return Handler
+
+
+def add_arguments(parser):
+    parser.add_argument("--latency-ms", type=float, default=150, help="fixed latency per request (default 150)")
+    parser.add_argument("--per-text-ms", type=float, default=2, help="added latency per input text (default 2)")
+    parser.add_argument("--max-concurrent", type=int, default=8, help="requests in progress before 429 (default 8, 0 for no limit)")
+    parser.add_argument("--max-batch", type=int, default=1000, help="inputs per request before 413 (default 1000)")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--retry-after", type=float, default=1, help="Retry-After seconds sent with 429 (default 1)")
+    parser.add_argument("--dimensions", type=int, default=384)
+
+
+def start(args, port=0):
+    """Starts the server on a background thread and returns it, server.server_port is the port it listens on."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(args))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake watsonx.ai text embeddings service")
+    parser.add_argument("--port", type=int, default=8089)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(args))
+    print(f"Fake embedding service on http://127.0.0.1:{args.port}{EMBEDDINGS_PATH}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
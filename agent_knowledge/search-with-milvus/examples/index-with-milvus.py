@@ -1,12 +1,15 @@
-import os, PyPDF2, logging
+import os, logging
 
 from langchain_milvus import Milvus
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_ibm import WatsonxEmbeddings
 from ibm_watsonx_ai.foundation_models.utils.enums import EmbeddingTypes
 from pymilvus import connections, utility
+from ingest_pipeline import ingestion_pipeline
+from index_manifest import IndexManifest, delete_chunks
 
-# If this is true, then we regenerate the index even if it already exists
+# If this is true, then we regenerate the index even if it already exists. Otherwise only new,
+# changed and removed files are indexed again, as recorded in the manifest at INDEX_MANIFEST_PATH
 FORCE_INDEXING=False
 
 SOURCE_FILES=["./sample-documents/IBM_Annual_Report_2023.pdf"]
@@ -14,6 +17,7 @@ SOURCE_URLS=["https://www.ibm.com/annualreport/assets/downloads/IBM_Annual_Repor
 SOURCE_TITLES=["IBM Annual Report 2023"]
 
 COLLECTION_NAME=os.environ.get("MILVUS_COLLECTION_NAME")
+INDEX_MANIFEST_PATH=os.environ.get("INDEX_MANIFEST_PATH", f"./{COLLECTION_NAME}-manifest.json")
 
 EMBED = WatsonxEmbeddings(
         model_id="ibm/slate-30m-english-rtrvr",
@@ -40,6 +44,10 @@ handler.setLevel(logging.INFO)
 handler.setFormatter(formatter)
 logger.addHandler(handler)
 logger.info("Logger initialized")
+# The extraction and ingestion modules report their throughput on their own loggers
+for name in ("pdf_extract", "ingest_pipeline", "embed_executor", "index_manifest", "embedding_cache"):
+    logging.getLogger(name).addHandler(handler)
+    logging.getLogger(name).setLevel(logging.INFO)
 
 def connect(connection_info):
     collection = Milvus(
@@ -51,46 +59,53 @@ def connect(connection_info):
     return collection
 
 
-def index(connection_info, filenames, urls, titles):
-    texts, metadata = load_docs_pdf(filenames, urls, titles)
+def index_settings():
+    # Anything that changes every chunk or vector, the manifest is only reused with the same settings
+    return {"collection": COLLECTION_NAME, "embedding_model": EMBED.model_id,
+            "chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP}
+
+
+def index(connection_info, filenames, urls, titles, manifest=None):
+    """
+    Brings the collection up to date with the files. With the manifest of the previous run only new
+    and changed files are extracted and only their new chunks embedded, otherwise the collection is rebuilt.
+    """
     text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
-    split_texts = text_splitter.create_documents(texts, metadata)
-    logging.info(f"Documents chunked.  Sending to Milvus.")
-    collection = Milvus.from_documents(
-        documents=split_texts[:1], # Initialize the collection with one document
-        embedding=EMBED,
+    rebuild = manifest is None
+    if rebuild:
+        # Saved before the collection is dropped, an interrupted rebuild must not look up to date
+        manifest = IndexManifest(INDEX_MANIFEST_PATH, index_settings())
+        manifest.save()
+    # A new collection is created by the first batch the pipeline inserts
+    collection = Milvus(
+        embedding_function=EMBED,
         connection_args=connection_info,
         collection_name=COLLECTION_NAME,
-        drop_old=True,
-        auto_id=True,
+        drop_old=rebuild,
+        auto_id=False,
         )
-    collection.add_documents(split_texts[1:], batch_size=100) # Add the rest of the documents to the collection
+    changed, removed = manifest.plan(filenames, urls, titles)
+    logger.info(f"{len(changed)} new or changed and {len(removed)} removed of {len(filenames)} files")
+    if changed:
+        keys = [filenames[i] for i, _ in changed]
+        logging.info(f"Streaming documents to Milvus.")
+        pipeline = ingestion_pipeline(keys, [entry["url"] for _, entry in changed], [entry["title"] for _, entry in changed],
+                                      text_splitter, EMBED, collection, known_ids=[manifest.chunk_ids(key) for key in keys],
+                                      rebuild=rebuild)
+        pipeline.run()
+        for key, (_, entry), chunk_ids in zip(keys, changed, pipeline.chunk_ids):
+            stale = manifest.chunk_ids(key) - set(chunk_ids)
+            delete_chunks(collection, stale)
+            manifest.record(key, entry, chunk_ids)
+            logger.info(f"Indexed {key}: {len(chunk_ids)} chunks, {len(stale)} removed")
+    for key in removed:
+        delete_chunks(collection, manifest.chunk_ids(key))
+        manifest.remove(key)
+        logger.info(f"Removed {key} from the index")
+    manifest.save()
     return collection
 
 
-def load_docs_pdf(filenames, urls, titles):
-    texts = []
-    metadata = []
-    i = 0
-    for filename in filenames:
-        if len(urls) > i:
-            url = urls[i]
-        else:
-            url = ""
-        if len(titles) > i:
-            title = titles[i]
-        else:
-            title = ""
-        with open(filename, 'rb') as f:
-            pdf_reader = PyPDF2.PdfReader(f)
-            for page in pdf_reader.pages:
-                text = page.extract_text()
-                texts.append(text)
-                metadata.append({'url': url, 'title': title})
-        i += 1
-    return texts, metadata
-
-
 def run(force_indexing=False):
     print(MILVUS_CONNECTION)
     connections.connect(
@@ -105,12 +120,16 @@ def run(force_indexing=False):
     print(f"Does collection {COLLECTION_NAME} exist in Milvus: {has}")
 
     logger.setLevel(logging.INFO)
-    if has and not force_indexing:
+    manifest = IndexManifest.load(INDEX_MANIFEST_PATH)
+    if has and manifest is None and not force_indexing:
+        # Not indexed by this script, or before it kept a manifest
         logging.info(f"Connecting to {MILVUS_CONNECTION}")
         collection = connect(MILVUS_CONNECTION)
     else:
         logging.info(f"Indexing at {MILVUS_CONNECTION}")
-        collection = index(MILVUS_CONNECTION, SOURCE_FILES, SOURCE_URLS, SOURCE_TITLES)
+        if force_indexing or not has or not manifest.matches(index_settings()):
+            manifest = None
+        collection = index(MILVUS_CONNECTION, SOURCE_FILES, SOURCE_URLS, SOURCE_TITLES, manifest)
     
     # Test out a query to Milvus & print results
     query = "What were earnings in 2023?"
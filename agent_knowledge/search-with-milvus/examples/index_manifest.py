@@ -0,0 +1,102 @@
+"""
+Incremental indexing state for index-with-milvus.py.
+
+The manifest is a JSON file next to the collection that records, for every indexed file, the
+sha256 of its content, its url and title and the ids of its chunks in Milvus. Chunk ids are
+derived from the chunk itself (file, url, title, text and how many identical chunks came before
+it in the file), so an unchanged chunk keeps its id when other parts of its file change.
+
+A re-index then only has to
+- skip files whose hash, url and title are unchanged, without extracting them,
+- embed and insert the chunks of changed files whose ids are not in the collection yet,
+- delete the chunks that changed files no longer produce and all chunks of removed files.
+
+The chunking settings and the embedding model are stored too. When they change every chunk
+would change, so the manifest no longer matches and the collection has to be rebuilt.
+"""
+import os, json, hashlib, logging
+
+MANIFEST_VERSION = 1
+HASH_BLOCK_SIZE = 1 << 20
+DELETE_BATCH_SIZE = 1000
+
+logger = logging.getLogger(__name__)
+
+
+def file_hash(filename):
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_id(key, metadata, text, occurrence):
+    """The Milvus primary key of a chunk, the same for the same chunk of the same file on every run."""
+    content = json.dumps([key, metadata.get('url', ""), metadata.get('title', ""), text, occurrence])
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class IndexManifest:
+    def __init__(self, path, settings, documents=None, version=MANIFEST_VERSION):
+        self.path = path
+        self.settings = settings
+        self.documents = documents or {}
+        self.version = version
+
+    @classmethod
+    def load(cls, path):
+        """Returns the manifest stored at path, or None when there is none."""
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        return cls(path, data.get('settings'), data.get('documents'), data.get('version'))
+
+    def matches(self, settings):
+        if self.version != MANIFEST_VERSION or self.settings != settings:
+            logger.warning(f"Index manifest {self.path} was built with {self.settings}, not {settings}")
+            return False
+        return True
+
+    def plan(self, filenames, urls, titles):
+        """
+        Compares the files with the manifest. Returns (changed, removed): the indexes in filenames
+        of new or changed files, with their new manifest entry, and the keys of files no longer in filenames.
+        """
+        changed = []
+        listed = set(filenames)
+        for i, filename in enumerate(filenames):
+            entry = {'sha256': file_hash(filename), 'url': urls[i] if len(urls) > i else "",
+                     'title': titles[i] if len(titles) > i else ""}
+            previous = self.documents.get(filename)
+            if previous is None or any(previous[name] != value for name, value in entry.items()):
+                changed.append((i, entry))
+        removed = [key for key in self.documents if key not in listed]
+        return changed, removed
+
+    def chunk_ids(self, key):
+        return set(self.documents.get(key, {}).get('chunks', ()))
+
+    def record(self, key, entry, chunk_ids):
+        self.documents[key] = dict(entry, chunks=chunk_ids)
+
+    def remove(self, key):
+        self.documents.pop(key, None)
+
+    def save(self):
+        # Written to a temporary file first so an interrupted run never leaves a truncated manifest
+        temporary = f"{self.path}.tmp"
+        with open(temporary, 'w') as f:
+            json.dump({'version': self.version, 'settings': self.settings, 'documents': self.documents}, f)
+        os.replace(temporary, self.path)
+
+
+def delete_chunks(collection, ids):
+    """Deletes chunks from a langchain_milvus collection by id, in batches that keep the filter expression small."""
+    ids = sorted(ids)
+    if not ids or collection.col is None:
+        return
+    for start in range(0, len(ids), DELETE_BATCH_SIZE):
+        collection.delete(ids=ids[start:start + DELETE_BATCH_SIZE])
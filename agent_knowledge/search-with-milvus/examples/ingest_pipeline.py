@@ -0,0 +1,219 @@
+"""
+Streaming ingestion for index-with-milvus.py: extract -> chunk -> embed -> insert.
+
+Every stage runs in its own thread and hands its output to the next one through a bounded
+queue, so extraction, chunking, embedding and insertion overlap and at most INGEST_QUEUE_SIZE
+items wait between two stages whatever the size of the corpus. Each stage counts what it
+produced and the time it spent waiting for input and for room in the next queue; the counters
+are logged every PROGRESS_INTERVAL_SECONDS and when the pipeline finishes.
+"""
+import os, time, queue, logging, threading
+
+from pdf_extract import iter_indexed_pages
+from embed_executor import EmbeddingExecutor
+from embedding_cache import CachedEmbeddings, cached_embeddings
+from index_manifest import chunk_id, delete_chunks
+
+INGEST_QUEUE_SIZE = int(os.environ.get("INGEST_QUEUE_SIZE", "8"))
+PROGRESS_INTERVAL_SECONDS = 10
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class _Stopped(Exception):
+    """Raised inside a stage when another stage failed."""
+
+
+class StageStats:
+    def __init__(self, name, unit):
+        self.name = name
+        self.unit = unit
+        self.items = 0
+        self.wait_input_seconds = 0.0
+        self.wait_output_seconds = 0.0
+        self.started = None
+        self.finished = None
+
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.perf_counter()) - self.started
+
+    def rate(self):
+        elapsed = self.elapsed()
+        return self.items / elapsed if elapsed else 0.0
+
+    def as_dict(self):
+        return {'items': self.items, 'unit': self.unit, 'per_second': self.rate(), 'elapsed': self.elapsed(),
+                'wait_input_seconds': self.wait_input_seconds, 'wait_output_seconds': self.wait_output_seconds}
+
+    def __str__(self):
+        busy = self.elapsed() - self.wait_input_seconds - self.wait_output_seconds
+        return (f"{self.name}: {self.items} {self.unit} ({self.rate():.1f}/s), busy {busy:.1f}s, "
+                f"waiting for input {self.wait_input_seconds:.1f}s, for output {self.wait_output_seconds:.1f}s")
+
+
+class Stage:
+    """
+    A step of the pipeline. transform takes an iterator over the outputs of the previous stage
+    (empty for the first stage) and yields this stage's outputs. size(output) is what an output
+    adds to the counter, 1 by default.
+    """
+
+    def __init__(self, name, transform, unit="items", size=None):
+        self.name = name
+        self.transform = transform
+        self.size = size
+        self.stats = StageStats(name, unit)
+
+
+class Pipeline:
+    def __init__(self, stages, queue_size=INGEST_QUEUE_SIZE):
+        self.stages = stages
+        self.queue_size = queue_size
+        self._stop = threading.Event()
+        self._errors = []
+
+    def stats(self):
+        return {stage.name: stage.stats.as_dict() for stage in self.stages}
+
+    def _inputs(self, stage, inbox):
+        while True:
+            started = time.perf_counter()
+            while True:
+                if self._stop.is_set():
+                    raise _Stopped()
+                try:
+                    item = inbox.get(timeout=0.1)
+                    break
+                except queue.Empty:
+                    pass
+            stage.stats.wait_input_seconds += time.perf_counter() - started
+            if item is _DONE:
+                return
+            yield item
+
+    def _put(self, stage, outbox, item):
+        started = time.perf_counter()
+        while True:
+            if self._stop.is_set():
+                raise _Stopped()
+            try:
+                outbox.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        stage.stats.wait_output_seconds += time.perf_counter() - started
+
+    def _run_stage(self, stage, inbox, outbox):
+        stage.stats.started = time.perf_counter()
+        outputs = stage.transform(self._inputs(stage, inbox) if inbox else iter(()))
+        try:
+            for output in outputs:
+                stage.stats.items += stage.size(output) if stage.size else 1
+                if outbox is not None:
+                    self._put(stage, outbox, output)
+            if outbox is not None:
+                self._put(stage, outbox, _DONE)
+        except _Stopped:
+            pass
+        except BaseException as e:
+            logger.error(f"Ingestion stage {stage.name} failed: {str(e)}")
+            self._errors.append(e)
+            self._stop.set()
+        finally:
+            close = getattr(outputs, 'close', None)
+            if close:
+                close()
+            stage.stats.finished = time.perf_counter()
+
+    def run(self):
+        """Runs all stages to completion and re-raises the first error of any stage."""
+        queues = [queue.Queue(self.queue_size) for _ in self.stages[1:]]
+        threads = []
+        for i, stage in enumerate(self.stages):
+            inbox = queues[i - 1] if i > 0 else None
+            outbox = queues[i] if i < len(queues) else None
+            thread = threading.Thread(target=self._run_stage, args=(stage, inbox, outbox),
+                                      name=f"ingest-{stage.name}", daemon=True)
+            thread.start()
+            threads.append(thread)
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(PROGRESS_INTERVAL_SECONDS)
+                    if thread.is_alive():
+                        logger.info("Ingestion progress: " + "; ".join(str(stage.stats) for stage in self.stages))
+        except KeyboardInterrupt:
+            self._stop.set()
+            raise
+        for stage in self.stages:
+            logger.info(f"Ingestion finished {stage.stats}")
+        if self._errors:
+            raise self._errors[0]
+        return self.stats()
+
+
+def ingestion_pipeline(filenames, urls, titles, text_splitter, embeddings, collection, known_ids=None,
+                       rebuild=False, queue_size=INGEST_QUEUE_SIZE):
+    """
+    Builds the pipeline that indexes PDF files into a langchain_milvus collection: pages from
+    pdf_extract, chunks from text_splitter, vectors from embeddings.embed_documents through an
+    EmbeddingExecutor and Milvus.add_embeddings for each batch, so every chunk is embedded exactly once.
+    When EMBEDDING_CACHE_DIR is set, chunks embedded by an earlier run come from the embedding cache.
+
+    With known_ids, a set of chunk ids already in the collection for every file, chunks are
+    inserted with the ids of index_manifest.chunk_id and only those not in the set are embedded.
+    pipeline.chunk_ids then holds the ids of all chunks of every file once the pipeline has run.
+    Before a batch is inserted, chunks with its ids are deleted, in case an interrupted run inserted
+    them without recording them. With rebuild the collection was just created, so that is skipped.
+    """
+    embeddings = cached_embeddings(embeddings)
+    executor = EmbeddingExecutor(embeddings)
+    chunk_ids = [[] for _ in filenames]
+
+    def extract(_):
+        return iter_indexed_pages(filenames, urls, titles)
+
+    def chunk(pages):
+        occurrences = {}
+        for index, text, metadata in pages:
+            for document in text_splitter.create_documents([text], [metadata]):
+                if known_ids is None:
+                    yield None, document
+                    continue
+                # Identical chunks of one file, like repeated headers, are told apart by their position
+                occurrence = occurrences.get((index, document.page_content), 0)
+                occurrences[(index, document.page_content)] = occurrence + 1
+                pk = chunk_id(filenames[index], document.metadata, document.page_content, occurrence)
+                chunk_ids[index].append(pk)
+                if pk not in known_ids[index]:
+                    yield pk, document
+
+    def embed(chunks):
+        yield from executor.embed_batches(chunks, text=lambda item: item[1].page_content)
+        logger.info(f"Embedding finished: {executor.stats()}")
+        if isinstance(embeddings, CachedEmbeddings):
+            embeddings.cache.flush()
+            logger.info(f"Embedding cache: {embeddings.cache.stats()}")
+
+    def insert(batches):
+        for batch, vectors in batches:
+            ids = [pk for pk, _ in batch] if known_ids is not None else None
+            if ids and not rebuild:
+                # Chunks a failed run inserted without recording them would be duplicated otherwise
+                delete_chunks(collection, ids)
+            collection.add_embeddings([d.page_content for _, d in batch], vectors, metadatas=[d.metadata for _, d in batch],
+                                      ids=ids)
+            yield batch
+
+    pipeline = Pipeline([
+        Stage("extract", extract, unit="pages"),
+        Stage("chunk", chunk, unit="chunks"),
+        Stage("embed", embed, unit="chunks", size=lambda output: len(output[0])),
+        Stage("insert", insert, unit="chunks", size=len),
+    ], queue_size=queue_size)
+    pipeline.chunk_ids = chunk_ids
+    return pipeline
@@ -0,0 +1,295 @@
+# Kept identical in every example that uses it, see SHARED_MODULES in external_agent/examples/shared_modules.py
+import os
+import math
+import time
+import asyncio
+import hashlib
+import logging
+import importlib
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from typing import Optional
+from fastapi.responses import StreamingResponse
+
+logger = logging.getLogger()
+
+# memory keeps limits per worker, none disables admission control, module:Class loads a custom AdmissionBackend
+ADMISSION_BACKEND = os.getenv("ADMISSION_BACKEND", "memory")
+# credential limits each API key or bearer token, thread limits each X-IBM-THREAD-ID (falling back to the credential)
+ADMISSION_KEY = os.getenv("ADMISSION_KEY", "credential")
+# Requests per second and burst size per key. 0 disables rate limiting.
+ADMISSION_RATE_PER_SECOND = float(os.getenv("ADMISSION_RATE_PER_SECOND", "0"))
+ADMISSION_BURST = int(os.getenv("ADMISSION_BURST", "0")) or max(
+    1, math.ceil(2 * ADMISSION_RATE_PER_SECOND)
+)
+# Runs in progress (or queued) per key, and runs in progress on the worker. 0 means unlimited.
+ADMISSION_MAX_CONCURRENT_PER_KEY = int(
+    os.getenv("ADMISSION_MAX_CONCURRENT_PER_KEY", "0")
+)
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "0"))
+# How long a request may wait for a worker slot before it is rejected. 0 rejects at once.
+ADMISSION_MAX_QUEUE_SECONDS = float(os.getenv("ADMISSION_MAX_QUEUE_SECONDS", "5"))
+# Idle rate limit buckets are dropped once more keys than this are tracked
+ADMISSION_MAX_KEYS = int(os.getenv("ADMISSION_MAX_KEYS", "10000"))
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is not admitted. retry_after is in seconds, for the Retry-After header."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(
+            f"Request rejected ({reason}), retry after {retry_after:.1f} seconds"
+        )
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class Lease:
+    """An admitted request. release() must be called once the run is done, calling it again is a no-op."""
+
+    __slots__ = ("_release",)
+
+    def __init__(self, release=None):
+        self._release = release
+
+    def release(self):
+        release, self._release = self._release, None
+        if release is not None:
+            release()
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: int, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = now
+
+    def refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now: float) -> float:
+        """Takes a token and returns 0, or returns the seconds until a token is available."""
+        self.refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionBackend(ABC):
+    """
+    Decides whether a request may start.
+
+    Implement this to share limits between workers (for example in Redis) and select the
+    class with ADMISSION_BACKEND=module:Class. It is constructed without arguments.
+    """
+
+    @abstractmethod
+    async def acquire(self, key: str) -> Lease:
+        """Returns a Lease for a request of key that may start, or raises AdmissionRejected."""
+
+    def stats(self) -> dict:
+        return {}
+
+
+class NoAdmissionControl(AdmissionBackend):
+    async def acquire(self, key: str) -> Lease:
+        return Lease()
+
+
+class InMemoryAdmissionBackend(AdmissionBackend):
+    """
+    Per-worker token buckets and concurrency limits.
+
+    A key over its rate or its concurrency limit is rejected at once, so a misbehaving client
+    cannot fill the queue. When the worker is at max_concurrent, requests wait for a slot and
+    slots are handed out round robin across keys, so a key with many queued requests does not
+    delay the others. All state is only touched from the event loop.
+    """
+
+    def __init__(
+        self,
+        rate: float = ADMISSION_RATE_PER_SECOND,
+        burst: int = ADMISSION_BURST,
+        max_concurrent_per_key: int = ADMISSION_MAX_CONCURRENT_PER_KEY,
+        max_concurrent: int = ADMISSION_MAX_CONCURRENT,
+        max_queue_seconds: float = ADMISSION_MAX_QUEUE_SECONDS,
+        max_keys: int = ADMISSION_MAX_KEYS,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrent_per_key = max_concurrent_per_key
+        self.max_concurrent = max_concurrent
+        self.max_queue_seconds = max_queue_seconds
+        self.max_keys = max_keys
+        self.active = 0
+        self._buckets = {}
+        self._active_per_key = {}
+        # key -> waiting futures. Slots go to the first key, which then moves to the end.
+        self._waiters = OrderedDict()
+        self.rejections = {"rate": 0, "key_concurrency": 0, "queue_timeout": 0}
+
+    def _reject(self, reason: str, retry_after: float):
+        self.rejections[reason] += 1
+        raise AdmissionRejected(reason, retry_after)
+
+    def _queued(self, key: str) -> int:
+        waiters = self._waiters.get(key)
+        return len(waiters) if waiters else 0
+
+    def _check_rate(self, key: str, now: float):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                self._prune_buckets(now)
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst, now)
+        wait = bucket.take(now)
+        if wait:
+            self._reject("rate", wait)
+
+    def _prune_buckets(self, now: float):
+        for key, bucket in list(self._buckets.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.burst:
+                del self._buckets[key]
+
+    async def acquire(self, key: str) -> Lease:
+        # Checked before the rate, so a request rejected here does not use up the rate budget of its key
+        if (
+            self.max_concurrent_per_key
+            and self._active_per_key.get(key, 0) + self._queued(key)
+            >= self.max_concurrent_per_key
+        ):
+            self._reject("key_concurrency", 1)
+        if self.rate > 0:
+            self._check_rate(key, time.monotonic())
+        if not self.max_concurrent or (
+            self.active < self.max_concurrent and not self._waiters
+        ):
+            return self._grant(key)
+        if self.max_queue_seconds <= 0:
+            self._reject("queue_timeout", 1)
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(key, deque()).append(future)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.max_queue_seconds)
+        except asyncio.TimeoutError:
+            if not future.done():
+                self._remove_waiter(key, future)
+                future.cancel()
+                self._reject("queue_timeout", self.max_queue_seconds)
+        except asyncio.CancelledError:
+            # The client went away while waiting. Give back a slot it was granted in the meantime.
+            if future.done() and not future.cancelled():
+                self._release(key)
+            else:
+                self._remove_waiter(key, future)
+                future.cancel()
+            raise
+        return Lease(lambda: self._release(key))
+
+    def _grant(self, key: str) -> Lease:
+        self.active += 1
+        self._active_per_key[key] = self._active_per_key.get(key, 0) + 1
+        return Lease(lambda: self._release(key))
+
+    def _remove_waiter(self, key: str, future):
+        waiters = self._waiters.get(key)
+        if waiters and future in waiters:
+            waiters.remove(future)
+            if not waiters:
+                del self._waiters[key]
+
+    def _release(self, key: str):
+        self.active -= 1
+        remaining = self._active_per_key.get(key, 1) - 1
+        if remaining:
+            self._active_per_key[key] = remaining
+        else:
+            self._active_per_key.pop(key, None)
+        while self._waiters and self.active < self.max_concurrent:
+            next_key, waiters = next(iter(self._waiters.items()))
+            future = waiters.popleft()
+            if waiters:
+                self._waiters.move_to_end(next_key)
+            else:
+                del self._waiters[next_key]
+            if future.done():
+                continue
+            self.active += 1
+            self._active_per_key[next_key] = self._active_per_key.get(next_key, 0) + 1
+            future.set_result(None)
+
+    def stats(self) -> dict:
+        return dict(
+            self.rejections,
+            active=self.active,
+            active_keys=len(self._active_per_key),
+            queued=sum(len(waiters) for waiters in self._waiters.values()),
+        )
+
+
+def admission_key(current_user: dict, thread_id: str) -> str:
+    """
+    Groups requests by verified subject or credential (or by thread with ADMISSION_KEY=thread).
+    Credentials are only kept as a hash.
+    """
+    if ADMISSION_KEY == "thread" and thread_id:
+        return "thread:" + thread_id
+    # A verified subject outlives the tokens issued to it
+    subject = (current_user.get("claims") or {}).get("sub")
+    if subject:
+        return "subject:" + subject
+    credential = current_user.get("api_key") or current_user.get("token")
+    if credential:
+        return (
+            "credential:" + hashlib.sha256(credential.encode("utf-8")).hexdigest()[:16]
+        )
+    return "anonymous"
+
+
+class LeasedStreamingResponse(StreamingResponse):
+    """
+    A StreamingResponse that releases lease once the response is over: when the stream ends or
+    fails, when the client disconnects, and also when the response is cancelled before the
+    stream was first iterated.
+    """
+
+    def __init__(self, content, lease: Optional[Lease], **kwargs):
+        super().__init__(content, **kwargs)
+        self.lease = lease or Lease()
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.lease.release()
+
+
+def create_admission_backend(kind: str = ADMISSION_BACKEND) -> AdmissionBackend:
+    if kind == "none":
+        return NoAdmissionControl()
+    if kind == "memory":
+        if not (
+            ADMISSION_RATE_PER_SECOND
+            or ADMISSION_MAX_CONCURRENT_PER_KEY
+            or ADMISSION_MAX_CONCURRENT
+        ):
+            return NoAdmissionControl()
+        return InMemoryAdmissionBackend()
+    if ":" in kind:
+        module_name, class_name = kind.split(":", 1)
+        return getattr(importlib.import_module(module_name), class_name)()
+    logger.error(f"Unknown ADMISSION_BACKEND {kind}, admission control disabled")
+    return NoAdmissionControl()
+
+
+admission = create_admission_backend()
@@ -2,8 +2,9 @@ import logging
 import uuid
 import time
 from typing import Optional, Dict, Any
-from fastapi import FastAPI, Header, Depends
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi import FastAPI, Header, Depends, Request
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 
 from models import (
     ChatCompletionRequest,
@@ -12,23 +13,54 @@ from models import (
     MessageResponse,
 )
 from security import get_current_user
-from utils import get_llm_sync, get_llm_stream
+from utils import get_llm_sync, get_llm_stream, WATSONX_DEPLOYMENT_ID
+from concurrency import sync_limiter, run_blocking
+from metrics import REQUEST_LATENCY, ERRORS, ADMISSION_REJECTIONS
+from stats_metrics import register_stats
+from auth import credential_verifier
+from admission import (
+    admission,
+    admission_key,
+    LeasedStreamingResponse,
+    AdmissionRejected,
+)
+from response_cache import response_cache, cache_scope
+from stream_replay import stream_replay, replay_key, request_fingerprint
+from log_utils import configure_logging, Preview
 
+configure_logging()
 logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.DEBUG)
-formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-console_handler.setFormatter(formatter)
-logger.addHandler(console_handler)
 
 
 app = FastAPI()
 
+register_stats(
+    "sync_limiter",
+    lambda: {
+        "active": sync_limiter.active,
+        "queue_depth": sync_limiter.queue_depth,
+        "limit": sync_limiter.limit,
+    },
+)
+register_stats(
+    "admission",
+    admission.stats,
+    counters=("rate", "key_concurrency", "queue_timeout"),
+)
+register_stats("auth", credential_verifier.stats, counters=credential_verifier.counters)
+register_stats("response_cache", response_cache.stats, counters=response_cache.counters)
+register_stats("stream_replay", stream_replay.stats, counters=stream_replay.counters)
+
+
+@app.get("/metrics")
+async def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 
 @app.post("/chat/completions")
 async def chat_completions(
     request: ChatCompletionRequest,
+    raw_request: Request,
     X_IBM_THREAD_ID: Optional[str] = Header(
         None,
         alias="X-IBM-THREAD-ID",
@@ -37,23 +69,99 @@ async def chat_completions(
     current_user: Dict[str, Any] = Depends(get_current_user),
 ):
     logger.info(
-        f"Received POST /chat/completions ChatCompletionRequest: {request.json()}"
+        "Received POST /chat/completions with %d messages, stream %s",
+        len(request.messages),
+        request.stream,
     )
+    logger.debug("ChatCompletionRequest: %s", Preview(request.model_dump_json))
 
     thread_id = ""
     if X_IBM_THREAD_ID:
         thread_id = X_IBM_THREAD_ID
     if request.extra_body and request.extra_body.thread_id:
         thread_id = request.extra_body.thread_id
-    logger.info("thread_id: " + thread_id)
+    logger.info("thread_id: %s", thread_id)
+
+    if request.stream and thread_id:
+        # a reconnect continues the run of this thread instead of starting it again.
+        # that starts no work, so it does not go through admission control.
+        fingerprint = request_fingerprint(WATSONX_DEPLOYMENT_ID, request.messages)
+        stream, replay_status = stream_replay.join(
+            replay_key(admission_key(current_user, ""), thread_id),
+            fingerprint,
+            raw_request.headers.get("last-event-id"),
+        )
+        if stream is not None:
+            logger.info("Stream replay %s for thread %s", replay_status, thread_id)
+            return StreamingResponse(
+                stream,
+                media_type="text/event-stream",
+                headers={"X-Stream-Replay": replay_status},
+            )
+
+    try:
+        lease = await admission.acquire(admission_key(current_user, thread_id))
+    except AdmissionRejected as e:
+        logger.warning("Rejected request for thread %s: %s", thread_id, e)
+        ADMISSION_REJECTIONS.labels(e.reason).inc()
+        return JSONResponse(
+            status_code=429,
+            content={"error": {"message": str(e), "type": e.reason}},
+            headers={"Retry-After": e.retry_after_header},
+        )
 
     if request.stream:
-        return StreamingResponse(
-            get_llm_stream(request.messages, thread_id), media_type="text/event-stream"
+
+        def make_stream():
+            return get_llm_stream(request.messages, thread_id, raw_request.headers)
+
+        if thread_id:
+            # a tracked run keeps the lease until it ends, even after its clients disconnected,
+            # so reconnecting with other messages cannot start more runs than admission allows
+            stream, replay_status = stream_replay.start(
+                replay_key(admission_key(current_user, ""), thread_id),
+                fingerprint,
+                make_stream,
+                lease,
+            )
+        else:
+            stream, replay_status = make_stream(), None
+        headers = None
+        if replay_status:
+            logger.info("Stream replay %s for thread %s", replay_status, thread_id)
+            headers = {"X-Stream-Replay": replay_status}
+        # otherwise the response releases the lease, also when it is cancelled before streaming
+        return LeasedStreamingResponse(
+            stream,
+            None if replay_status else lease,
+            media_type="text/event-stream",
+            headers=headers,
         )
     else:
 
-        all_messages = get_llm_sync(request.messages)
+        async def run():
+            async with sync_limiter:
+                all_messages = await run_blocking(
+                    get_llm_sync, request.messages, thread_id, raw_request.headers
+                )
+            return all_messages[-1].content
+
+        with REQUEST_LATENCY.labels("sync").time():
+            try:
+                content, cache_status = await response_cache.get_or_compute(
+                    cache_scope(admission_key(current_user, "")),
+                    WATSONX_DEPLOYMENT_ID,
+                    [],
+                    request.messages,
+                    run,
+                    raw_request.headers.get("cache-control"),
+                    lease=lease,
+                )
+            except Exception:
+                ERRORS.labels("sync").inc()
+                raise
+        if cache_status:
+            logger.info("Response cache %s for thread %s", cache_status, thread_id)
         response = ChatCompletionResponse(
             id=str(uuid.uuid4()),
             object="chat.completion",
@@ -62,14 +170,13 @@ async def chat_completions(
             choices=[
                 Choice(
                     index=0,
-                    message=MessageResponse(
-                        role="assistant", content=all_messages[-1].content
-                    ),
+                    message=MessageResponse(role="assistant", content=content),
                     finish_reason="stop",
                 )
             ],
         )
-        return JSONResponse(content=response.dict())
+        headers = {"X-Response-Cache": cache_status} if cache_status else None
+        return JSONResponse(content=response.dict(), headers=headers)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,78 @@
+# Kept identical in every example that uses it, see SHARED_MODULES in external_agent/examples/shared_modules.py
+"""
+Micro-benchmark for SSE event encoding on the streaming hot path.
+
+Compares the per-event dict + uuid4 + json.dumps construction that get_llm_stream used
+before with SSEEncoder. Run with: python bench_sse.py [events]
+"""
+
+import sys
+import json
+import time
+import uuid
+from sse import SSEEncoder
+
+THREAD_ID = "c91e2e38-7b42-43d7-b913-0273951350a9"
+MODEL = "meta-llama/llama-3-2-90b-vision-instruct"
+TOKEN = " token"
+STEP_DETAILS = {
+    "type": "tool_calls",
+    "tool_calls": [
+        {
+            "id": "run-1",
+            "name": "web_search_duckduckgo",
+            "args": {"search_phrase": "nasdaq today"},
+        }
+    ],
+}
+
+
+def legacy_message_delta(content):
+    struct = {
+        "id": str(uuid.uuid4()),
+        "object": "thread.message.delta",
+        "created": int(time.time()),
+        "thread_id": THREAD_ID,
+        "model": MODEL,
+        "choices": [{"delta": {"content": content, "role": "assistant"}}],
+    }
+    return "data: " + json.dumps(struct) + "\n\n"
+
+
+def legacy_step_delta(step_details):
+    struct = {
+        "id": str(uuid.uuid4()),
+        "object": "thread.run.step.delta",
+        "thread_id": THREAD_ID,
+        "model": MODEL,
+        "created": int(time.time()),
+        "choices": [{"delta": {"role": "assistant", "step_details": step_details}}],
+    }
+    return "data: " + json.dumps(struct) + "\n\n"
+
+
+def run(name, func, arg, events):
+    start = time.perf_counter()
+    for _ in range(events):
+        func(arg)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<32} {events / elapsed:>12,.0f} events/s")
+
+
+def main():
+    events = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    encoder = SSEEncoder(THREAD_ID, MODEL)
+    # Both encoders must produce the same event apart from id and created
+    assert (
+        json.loads(encoder.message_delta(TOKEN)[6:])["choices"]
+        == json.loads(legacy_message_delta(TOKEN)[6:])["choices"]
+    )
+    print(f"json backend: {'orjson' if 'orjson' in sys.modules else 'json'}")
+    run("legacy thread.message.delta", legacy_message_delta, TOKEN, events)
+    run("SSEEncoder.message_delta", encoder.message_delta, TOKEN, events)
+    run("legacy thread.run.step.delta", legacy_step_delta, STEP_DETAILS, events)
+    run("SSEEncoder.step_delta", encoder.step_delta, STEP_DETAILS, events)
+
+
+if __name__ == "__main__":
+    main()
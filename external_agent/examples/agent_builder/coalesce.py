@@ -0,0 +1,90 @@
+# Kept identical in every example that uses it, see SHARED_MODULES in external_agent/examples/shared_modules.py
+import os
+import asyncio
+from typing import NamedTuple
+
+# Coalescing is off unless at least one of these is set for the deployment
+STREAM_COALESCE_MS = float(os.getenv("STREAM_COALESCE_MS", "0"))
+STREAM_COALESCE_BYTES = int(os.getenv("STREAM_COALESCE_BYTES", "0"))
+COALESCE_QUEUE_SIZE = 256
+
+_DONE = object()
+
+
+class TextDelta(NamedTuple):
+    """Assistant text that may be merged with neighbouring deltas before it is encoded."""
+
+    content: str
+
+
+async def coalesce_deltas(
+    source,
+    encode,
+    max_delay_ms: float = STREAM_COALESCE_MS,
+    max_bytes: int = STREAM_COALESCE_BYTES,
+):
+    """
+    Yields SSE frames from source, which produces TextDelta items and already encoded frames.
+
+    With coalescing enabled, consecutive TextDelta items are buffered and sent as one frame
+    built by encode() once max_delay_ms has passed since the first buffered delta or the
+    buffer reaches max_bytes. Any other frame (tool calls, tool responses, errors) flushes
+    the buffer and is sent immediately, so step events are never delayed or reordered.
+    """
+    if max_delay_ms <= 0 and max_bytes <= 0:
+        async for item in source:
+            yield encode(item.content) if isinstance(item, TextDelta) else item
+        return
+
+    # The source is drained by a single task so it runs in one context from start to end,
+    # while this generator waits on the queue with a timeout to honour max_delay_ms
+    queue = asyncio.Queue(COALESCE_QUEUE_SIZE)
+
+    async def produce():
+        try:
+            async for item in source:
+                await queue.put(item)
+            await queue.put(_DONE)
+        except Exception as e:
+            await queue.put(e)
+
+    loop = asyncio.get_running_loop()
+    producer = asyncio.ensure_future(produce())
+    max_delay = max_delay_ms / 1000 if max_delay_ms > 0 else None
+    buffer = []
+    size = 0
+    deadline = None
+    try:
+        while True:
+            if buffer and deadline is not None:
+                try:
+                    item = await asyncio.wait_for(
+                        queue.get(), max(0, deadline - loop.time())
+                    )
+                except asyncio.TimeoutError:
+                    yield encode("".join(buffer))
+                    buffer, size, deadline = [], 0, None
+                    continue
+            else:
+                item = await queue.get()
+            if item is _DONE:
+                break
+            if isinstance(item, Exception):
+                raise item
+            if isinstance(item, TextDelta):
+                if not buffer and max_delay is not None:
+                    deadline = loop.time() + max_delay
+                buffer.append(item.content)
+                size += len(item.content.encode("utf-8"))
+                if max_bytes > 0 and size >= max_bytes:
+                    yield encode("".join(buffer))
+                    buffer, size, deadline = [], 0, None
+            else:
+                if buffer:
+                    yield encode("".join(buffer))
+                    buffer, size, deadline = [], 0, None
+                yield item
+        if buffer:
+            yield encode("".join(buffer))
+    finally:
+        producer.cancel()
@@ -0,0 +1,54 @@
+import os
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger()
+
+MAX_CONCURRENT_SYNC_REQUESTS = int(os.getenv("MAX_CONCURRENT_SYNC_REQUESTS", "16"))
+
+
+class ConcurrencyLimiter:
+    """
+
+    bounds how many non-streaming runs execute at once on this worker.
+    requests over the limit wait in FIFO order, active and queue_depth can be read
+    at any time for monitoring.
+
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self.queue_depth = 0
+        self._semaphore = asyncio.Semaphore(limit)
+
+    async def __aenter__(self):
+        if self._semaphore.locked():
+            logger.info(
+                f"Concurrency limit of {self.limit} reached, {self.queue_depth + 1} request(s) waiting"
+            )
+        self.queue_depth += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.queue_depth -= 1
+        self.active += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.active -= 1
+        self._semaphore.release()
+
+
+sync_limiter = ConcurrencyLimiter(MAX_CONCURRENT_SYNC_REQUESTS)
+
+# run_ai_service is blocking, so non-streaming calls run on this pool instead of the event loop
+_sync_executor = ThreadPoolExecutor(
+    max_workers=MAX_CONCURRENT_SYNC_REQUESTS, thread_name_prefix="wxai-sync"
+)
+
+
+async def run_blocking(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_sync_executor, func, *args)
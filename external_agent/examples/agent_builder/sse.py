@@ -0,0 +1,75 @@
+# Kept identical in every example that uses it, see SHARED_MODULES in external_agent/examples/shared_modules.py
+import json
+import time
+import uuid
+import itertools
+
+try:
+    import orjson
+
+    def dumps(obj) -> str:
+        return orjson.dumps(obj).decode("utf-8")
+
+except ImportError:
+
+    def dumps(obj) -> str:
+        return json.dumps(obj, separators=(",", ":"))
+
+
+class SSEEncoder:
+    """
+    Encodes the thread.message.delta and thread.run.step.delta events from spec.yaml for one stream.
+
+    The parts of an event that do not change within a stream (object, thread_id, model) are
+    serialized once up front. Event ids are a random per-stream prefix plus a counter instead
+    of a uuid4 per event.
+    """
+
+    def __init__(self, thread_id: str, model: str):
+        stream_id = uuid.uuid4().hex[:12]
+        self._counter = itertools.count()
+        self._common = ',"thread_id":' + dumps(thread_id) + ',"model":' + dumps(model)
+        self._prefixes = {}
+        self._message_prefix = self._prefix("thread.message.delta", "run-" + stream_id)
+        self._step_prefix = self._prefix("thread.run.step.delta", "step-" + stream_id)
+
+    def _prefix(self, object_type: str, id_prefix: str) -> str:
+        return (
+            'data: {"object":'
+            + dumps(object_type)
+            + self._common
+            + ',"id":"'
+            + id_prefix
+            + "-"
+        )
+
+    def _frame(self, prefix: str, delta_json: str) -> str:
+        return (
+            prefix
+            + str(next(self._counter))
+            + '","created":'
+            + str(int(time.time()))
+            + ',"choices":[{"delta":'
+            + delta_json
+            + "}]}\n\n"
+        )
+
+    def message_delta(self, content: str) -> str:
+        return self._frame(
+            self._message_prefix,
+            '{"content":' + dumps(content) + ',"role":"assistant"}',
+        )
+
+    def step_delta(self, step_details: dict) -> str:
+        return self._frame(
+            self._step_prefix,
+            '{"role":"assistant","step_details":' + dumps(step_details) + "}",
+        )
+
+    def event(self, object_type: str, delta: dict) -> str:
+        prefix = self._prefixes.get(object_type)
+        if prefix is None:
+            prefix = self._prefixes[object_type] = self._prefix(
+                object_type, "evt-" + uuid.uuid4().hex[:12]
+            )
+        return self._frame(prefix, dumps(delta))
@@ -0,0 +1,69 @@
+import os
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger()
+
+MAX_CONCURRENT_STREAMS = int(os.getenv("MAX_CONCURRENT_STREAMS", "64"))
+STREAM_BRIDGE_QUEUE_SIZE = int(os.getenv("STREAM_BRIDGE_QUEUE_SIZE", "64"))
+
+_stream_executor = ThreadPoolExecutor(
+    max_workers=MAX_CONCURRENT_STREAMS, thread_name_prefix="wxai-stream"
+)
+_DONE = object()
+
+
+async def iterate_in_thread(make_iterator, maxsize: int = STREAM_BRIDGE_QUEUE_SIZE):
+    """
+
+    runs a blocking iterator on a worker thread and yields its items on the event loop.
+    the queue between the two is bounded, so a slow client pauses the producer thread
+    instead of buffering the whole upstream response. when the consumer goes away the
+    producer stops at the next item and closes the upstream iterator.
+
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize)
+    stopped = threading.Event()
+
+    def put(item):
+        # blocks this worker thread until the event loop has room in the queue
+        asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+    def produce():
+        iterator = None
+        try:
+            iterator = make_iterator()
+            for item in iterator:
+                if stopped.is_set():
+                    break
+                put((item, None))
+            else:
+                put((_DONE, None))
+        except BaseException as e:
+            if not stopped.is_set():
+                try:
+                    put((_DONE, e))
+                except Exception:
+                    logger.exception("Could not hand stream error to the event loop")
+        finally:
+            close = getattr(iterator, "close", None)
+            if close:
+                close()
+
+    loop.run_in_executor(_stream_executor, produce)
+    try:
+        while True:
+            item, error = await queue.get()
+            if item is _DONE:
+                if error:
+                    raise error
+                break
+            yield item
+    finally:
+        stopped.set()
+        # free up room so a producer blocked on a full queue can observe the stop flag
+        while not queue.empty():
+            queue.get_nowait()
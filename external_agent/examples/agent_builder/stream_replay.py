@@ -0,0 +1,296 @@
+# Kept identical in every example that uses it, see SHARED_MODULES in external_agent/examples/shared_modules.py
+import os
+import uuid
+import asyncio
+import hashlib
+import logging
+import itertools
+from collections import OrderedDict, deque
+from typing import Optional
+import pydantic_core
+
+logger = logging.getLogger()
+
+# Events kept per stream for clients that reconnect. 0 (the default) disables resumable streams.
+STREAM_REPLAY_BUFFER_EVENTS = int(os.getenv("STREAM_REPLAY_BUFFER_EVENTS", "0"))
+# How long a finished stream can still be replayed
+STREAM_REPLAY_RETAIN_SECONDS = float(os.getenv("STREAM_REPLAY_RETAIN_SECONDS", "60"))
+# How long a run continues without any connected client before it is cancelled
+STREAM_REPLAY_ORPHAN_SECONDS = float(os.getenv("STREAM_REPLAY_ORPHAN_SECONDS", "30"))
+STREAM_REPLAY_MAX_STREAMS = int(os.getenv("STREAM_REPLAY_MAX_STREAMS", "256"))
+
+
+def replay_key(scope: str, thread_id: str) -> str:
+    return scope + "|" + thread_id
+
+
+def request_fingerprint(model: str, messages) -> str:
+    digest = hashlib.sha256(str(model).encode("utf-8"))
+    digest.update(pydantic_core.to_json(messages, exclude_none=True))
+    return digest.hexdigest()
+
+
+def parse_last_event_id(last_event_id: Optional[str]):
+    """Splits a Last-Event-ID header of the form <stream id>:<sequence> into its parts, or returns (None, -1)."""
+    if last_event_id and ":" in last_event_id:
+        stream_id, sequence = last_event_id.rsplit(":", 1)
+        if sequence.isdigit():
+            return stream_id, int(sequence)
+    return None, -1
+
+
+class ReplayableStream:
+    """
+    One run of get_llm_stream, drained by a background task into a ring buffer of SSE frames.
+
+    Clients follow the buffer from any sequence number it still holds, and every SSE event is sent
+    with an id: line so a reconnecting client can say where it stopped. The producer only overwrites
+    frames no client needs any more: when the buffer is full it waits for the slowest connected
+    client or, while none is connected, for the one that disconnected last to come back. A run
+    nobody follows for orphan_seconds is cancelled, so abandoned streams stop spending tokens.
+    """
+
+    def __init__(self, fingerprint: str, max_events: int, orphan_seconds: float):
+        self.stream_id = uuid.uuid4().hex[:12]
+        self.fingerprint = fingerprint
+        self.max_events = max_events
+        self.orphan_seconds = orphan_seconds
+        self.frames = deque(maxlen=max_events)
+        self.next_sequence = 0
+        self.done = False
+        self.failed = False
+        self.task = None
+        self._positions = {}
+        self._resume_position = 0
+        self._changed = asyncio.Event()
+        self._space = asyncio.Event()
+        self._orphan_timer = None
+        self._followers = itertools.count()
+
+    @property
+    def first_sequence(self) -> int:
+        return self.next_sequence - len(self.frames)
+
+    def can_serve(self, after: int) -> bool:
+        return after + 1 >= self.first_sequence
+
+    def start(self, source, on_done, lease):
+        """Starts draining source. The run holds lease until its task is done, however it ends."""
+        self.task = asyncio.ensure_future(self._produce(source, on_done))
+        self.task.add_done_callback(lambda task: lease.release())
+        # Covers a client that goes away before its response starts
+        self._arm_orphan_timer()
+
+    def _arm_orphan_timer(self):
+        self._orphan_timer = asyncio.get_running_loop().call_later(
+            self.orphan_seconds, self._abandon
+        )
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _needed(self) -> int:
+        return (
+            min(self._positions.values()) if self._positions else self._resume_position
+        )
+
+    async def _produce(self, source, on_done):
+        try:
+            async for frame in source:
+                while (
+                    len(self.frames) == self.max_events
+                    and self._needed() <= self.first_sequence
+                ):
+                    self._space.clear()
+                    await self._space.wait()
+                if frame.startswith("Error:"):
+                    self.failed = True
+                self.frames.append(frame)
+                self.next_sequence += 1
+                self._notify()
+        except asyncio.CancelledError:
+            self.failed = True
+            raise
+        except Exception as e:
+            logger.exception("Replayable stream %s failed", self.stream_id)
+            self.failed = True
+            self.frames.append(f"Error: {str(e)}\n")
+            self.next_sequence += 1
+        finally:
+            self.done = True
+            self._notify()
+            await source.aclose()
+            on_done(self)
+
+    async def follow(self, after: int = -1):
+        """Yields the frames after sequence number after, each with an id: line, until the run ends."""
+        follower = next(self._followers)
+        position = after + 1
+        self._positions[follower] = position
+        if self._orphan_timer is not None:
+            self._orphan_timer.cancel()
+            self._orphan_timer = None
+        try:
+            while True:
+                if position < self.first_sequence:
+                    logger.warning(
+                        "Client of stream %s fell behind the replay buffer",
+                        self.stream_id,
+                    )
+                    return
+                if position < self.next_sequence:
+                    for frame in list(
+                        itertools.islice(
+                            self.frames, position - self.first_sequence, None
+                        )
+                    ):
+                        yield self._with_id(frame, position)
+                        position += 1
+                        self._positions[follower] = position
+                        self._space.set()
+                    continue
+                if self.done:
+                    return
+                await self._changed.wait()
+        finally:
+            del self._positions[follower]
+            self._space.set()
+            if not self._positions:
+                self._resume_position = position
+                if not self.done:
+                    self._arm_orphan_timer()
+
+    def _with_id(self, frame: str, position: int) -> str:
+        # The plain text "Error: ..." line of a failed run is not an SSE event and has no blank line
+        # to end it, an id: field on it would run into the data of the next event
+        if not frame.endswith("\n\n"):
+            return frame
+        return f"id: {self.stream_id}:{position}\n{frame}"
+
+    def _abandon(self):
+        self._orphan_timer = None
+        if not self._positions and not self.done:
+            logger.info(
+                "Cancelling stream %s, no client for %.0f seconds",
+                self.stream_id,
+                self.orphan_seconds,
+            )
+            self.task.cancel()
+
+
+class StreamReplay:
+    """
+    Resumable streams by (caller, thread_id).
+
+    A request with a Last-Event-ID header from a stream of the same thread and the same messages
+    continues after that event. A retry without the header joins the run that is still going (or
+    finished less than retain_seconds ago) from its first event, as long as the buffer still holds
+    it. Anything else starts a new run. All state is only touched from the event loop.
+    """
+
+    def __init__(
+        self,
+        max_events: int = STREAM_REPLAY_BUFFER_EVENTS,
+        retain_seconds: float = STREAM_REPLAY_RETAIN_SECONDS,
+        orphan_seconds: float = STREAM_REPLAY_ORPHAN_SECONDS,
+        max_streams: int = STREAM_REPLAY_MAX_STREAMS,
+    ):
+        self.max_events = max_events
+        self.retain_seconds = retain_seconds
+        self.orphan_seconds = orphan_seconds
+        self.max_streams = max_streams
+        self._streams = OrderedDict()
+        self.counters = {
+            "started": 0,
+            "resumed": 0,
+            "attached": 0,
+            "not_resumable": 0,
+            "untracked": 0,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_events > 0
+
+    def join(self, key: str, fingerprint: str, last_event_id: Optional[str] = None):
+        """
+        Returns (frames, status) with status resumed or attached when the request continues the
+        run of this key, otherwise (None, None) and a new run has to be started. Joining starts no
+        work, so it needs no admission.
+        """
+        if not self.enabled:
+            return None, None
+        stream = self._streams.get(key)
+        if stream is not None and stream.fingerprint == fingerprint:
+            stream_id, after = parse_last_event_id(last_event_id)
+            if stream_id == stream.stream_id and stream.can_serve(after):
+                self.counters["resumed"] += 1
+                return stream.follow(after), "resumed"
+            if (
+                stream_id is None
+                and stream.can_serve(-1)
+                and not (stream.done and stream.failed)
+            ):
+                self.counters["attached"] += 1
+                return stream.follow(), "attached"
+        if last_event_id:
+            # The run is gone or cannot be continued from that event, the client gets a new one
+            self.counters["not_resumable"] += 1
+        return None, None
+
+    def start(self, key: str, fingerprint: str, make_stream, lease):
+        """
+        Starts a new run of make_stream(), the get_llm_stream generator, and returns (frames, status).
+        With status started the run is tracked and keeps lease until it ends, also when its clients
+        have gone. With status None the run is not tracked (resumable streams are off or too many
+        are running) and the caller still has to release lease when the response is over.
+        """
+        if not self.enabled:
+            return make_stream(), None
+        if not self._make_room():
+            self.counters["untracked"] += 1
+            return make_stream(), None
+        stream = ReplayableStream(fingerprint, self.max_events, self.orphan_seconds)
+        self._streams[key] = stream
+        self._streams.move_to_end(key)
+        stream.start(
+            make_stream(), lambda finished: self._finished(key, finished), lease
+        )
+        self.counters["started"] += 1
+        return stream.follow(), "started"
+
+    def _make_room(self) -> bool:
+        if len(self._streams) < self.max_streams:
+            return True
+        for key, stream in self._streams.items():
+            if stream.done:
+                del self._streams[key]
+                return True
+        return False
+
+    def _finished(self, key: str, stream: ReplayableStream):
+        if stream.failed:
+            self._discard(key, stream)
+        else:
+            asyncio.get_running_loop().call_later(
+                self.retain_seconds, self._discard, key, stream
+            )
+
+    def _discard(self, key: str, stream: ReplayableStream):
+        if self._streams.get(key) is stream:
+            del self._streams[key]
+
+    def stats(self) -> dict:
+        running = sum(1 for stream in self._streams.values() if not stream.done)
+        return dict(
+            self.counters,
+            running=running,
+            retained=len(self._streams) - running,
+            buffered_frames=sum(
+                len(stream.frames) for stream in self._streams.values()
+            ),
+        )
+
+
+stream_replay = StreamReplay()
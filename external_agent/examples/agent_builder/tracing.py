@@ -0,0 +1,119 @@
+import os
+import logging
+
+logger = logging.getLogger()
+
+try:
+    from opentelemetry import trace, propagate
+    from opentelemetry.trace import SpanKind, Status, StatusCode
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import (
+        SimpleSpanProcessor,
+        BatchSpanProcessor,
+        ConsoleSpanExporter,
+    )
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import (
+        InMemorySpanExporter,
+    )
+except ImportError:
+    trace = None
+
+
+# tracing is off unless set to console, memory (kept in process, for tests) or otlp
+OTEL_TRACES_EXPORTER = os.getenv("OTEL_TRACES_EXPORTER", "none").lower()
+OTEL_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "agent-builder-external-agent")
+
+tracer = None
+# holds the finished spans when OTEL_TRACES_EXPORTER=memory
+memory_exporter = None
+
+
+def setup_tracing():
+    global tracer, memory_exporter
+    if OTEL_TRACES_EXPORTER in ("", "none"):
+        return
+    if trace is None:
+        logger.warning(
+            "OTEL_TRACES_EXPORTER is set but opentelemetry-sdk is not installed, tracing is disabled"
+        )
+        return
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": OTEL_SERVICE_NAME})
+    )
+    if OTEL_TRACES_EXPORTER == "console":
+        provider.add_span_processor(SimpleSpanProcessor(ConsoleSpanExporter()))
+    elif OTEL_TRACES_EXPORTER == "memory":
+        memory_exporter = InMemorySpanExporter()
+        provider.add_span_processor(SimpleSpanProcessor(memory_exporter))
+    elif OTEL_TRACES_EXPORTER == "otlp":
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+                OTLPSpanExporter,
+            )
+        except ImportError:
+            logger.warning(
+                "OTEL_TRACES_EXPORTER=otlp requires opentelemetry-exporter-otlp-proto-http, tracing is disabled"
+            )
+            return
+        # endpoint and headers come from the standard OTEL_EXPORTER_OTLP_* variables
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    else:
+        logger.warning(
+            f"Unknown OTEL_TRACES_EXPORTER {OTEL_TRACES_EXPORTER}, tracing is disabled"
+        )
+        return
+    trace.set_tracer_provider(provider)
+    tracer = provider.get_tracer("external-agent")
+    logger.info(f"Tracing enabled with the {OTEL_TRACES_EXPORTER} exporter")
+
+
+def _attributes(thread_id: str, attributes: dict) -> dict:
+    attributes = {key: value for key, value in attributes.items() if value is not None}
+    attributes["thread_id"] = thread_id
+    return attributes
+
+
+def start_request_span(headers, thread_id: str, **attributes):
+    """
+
+    starts the span for one /chat/completions request as a child of the trace context in
+    the incoming headers (W3C traceparent by default). returns None when tracing is disabled.
+
+    """
+    if tracer is None:
+        return None
+    parent = propagate.extract(headers) if headers else None
+    return tracer.start_span(
+        "chat.completions",
+        context=parent,
+        kind=SpanKind.SERVER,
+        attributes=_attributes(thread_id, attributes),
+    )
+
+
+def start_span(name: str, parent, thread_id: str, **attributes):
+    """
+
+    starts a child span of parent, or returns None when parent is None (tracing disabled).
+
+    """
+    if parent is None:
+        return None
+    return tracer.start_span(
+        name,
+        context=trace.set_span_in_context(parent),
+        attributes=_attributes(thread_id, attributes),
+    )
+
+
+def end_span(span, error: BaseException = None):
+    if span is None:
+        return
+    if error is not None:
+        span.record_exception(error)
+        span.set_status(Status(StatusCode.ERROR, str(error)))
+    span.end()
+
+
+setup_tracing()
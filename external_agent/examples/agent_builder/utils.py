@@ -1,18 +1,22 @@
-import time
 import json
-import uuid
 import os
 import traceback
 import logging
-import requests
+import threading
 from typing import List
 from ibm_watsonx_ai import APIClient
 
 from models import Message
+from token_utils import get_access_token, aget_access_token
+from stream_bridge import iterate_in_thread
+from sse import SSEEncoder
+from coalesce import TextDelta, coalesce_deltas
+from metrics import StreamMetrics, CLIENT_CONSTRUCTION, ERRORS
+from tracing import start_request_span, start_span, end_span
+from log_utils import Preview, sample_stream
 
 
 logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)
 
 
 WATSONX_DEPLOYMENT_ID = os.getenv("WATSONX_DEPLOYMENT_ID")
@@ -21,42 +25,36 @@ WATSONX_URL = os.getenv("WATSONX_URL", "https://us-south.ml.cloud.ibm.com")
 
 
 def _get_access_token():
-    api_key = WATSONX_API_KEY
-    file_path = "./current_token.txt"
-    url = "https://iam.cloud.ibm.com/identity/token"
-    headers = {
-        "content-type": "application/x-www-form-urlencoded",
-        "accept": "application/json",
-    }
-    data = {"grant_type": "urn:ibm:params:oauth:grant-type:apikey", "apikey": api_key}
+    return get_access_token(WATSONX_API_KEY)
 
-    if os.path.isfile(file_path):
-        file_time = os.path.getmtime(file_path)
-        if time.time() - file_time < 3600:
-            logger.info("Retrieved cached token")
-            with open(file_path, "r") as file:
-                return file.read()
 
-    response = requests.post(url, headers=headers, data=data)
+_wxai_client = None
+_wxai_client_lock = threading.Lock()
 
-    if response.status_code == 200:
-        token_data = json.loads(response.text)
-        token = token_data["access_token"]
 
-        with open(file_path, "w") as file:
-            file.write(token)
-        logger.info("Retrieved new token")
-        return token
-    else:
-        raise Exception("Failed to get access token")
-
-
-def _get_wxai_client():
-    credentials = {"url": WATSONX_URL, "token": _get_access_token()}
-    return APIClient(credentials)
+def _get_wxai_client(token=None):
+    """
 
+    returns a shared APIClient so that its HTTP connection pool is reused across requests.
+    when the IAM token rotates the client is updated in place instead of being rebuilt.
 
-def get_llm_sync(messages: List[Message]) -> list[Message]:
+    """
+    global _wxai_client
+    token = token or _get_access_token()
+    with _wxai_client_lock:
+        if _wxai_client is None:
+            credentials = {"url": WATSONX_URL, "token": token}
+            with CLIENT_CONSTRUCTION.labels("watsonx_api_client").time():
+                _wxai_client = APIClient(credentials)
+        elif _wxai_client.credentials.token != token:
+            logger.info("IAM token rotated, updating shared wx.ai client")
+            _wxai_client.set_token(token)
+    return _wxai_client
+
+
+def get_llm_sync(
+    messages: List[Message], thread_id: str = "", trace_headers=None
+) -> list[Message]:
 
     """
 
@@ -64,19 +62,36 @@ def get_llm_sync(messages: List[Message]) -> list[Message]:
 
     """
     logger.info("wx.ai deployment Synchronous call")
-    client = _get_wxai_client()
-    payload = {"messages": [m.model_dump() for m in messages if m.role != "system"]}
-    logger.info(f"Calling AI service with payload: {payload}")
-    result = client.deployments.run_ai_service(WATSONX_DEPLOYMENT_ID, payload)
-    if "error" in result:
-        raise RuntimeError(f"Got an error from wx.ai AI service: {result['error']}")
-
-    logger.info(f"Response: {result}")
-    return [Message(**c["message"]) for c in result["choices"]]
-
+    span = start_request_span(trace_headers, thread_id, stream=False)
+    try:
+        client = _get_wxai_client()
+        payload = {
+            "messages": [m.model_dump() for m in messages if m.role != "system"]
+        }
+        logger.debug("Calling AI service with payload: %s", Preview(payload))
+        deployment_span = start_span(
+            "deployment run_ai_service",
+            span,
+            thread_id,
+            deployment_id=WATSONX_DEPLOYMENT_ID,
+        )
+        try:
+            result = client.deployments.run_ai_service(WATSONX_DEPLOYMENT_ID, payload)
+        except Exception as e:
+            end_span(deployment_span, e)
+            raise
+        end_span(deployment_span)
+        if "error" in result:
+            raise RuntimeError(
+                f"Got an error from wx.ai AI service: {result['error']}"
+            )
+    except Exception as e:
+        end_span(span, e)
+        raise
+    end_span(span)
 
-def format_resp(struct):
-    return "data: " + json.dumps(struct) + "\n\n"
+    logger.info("Response: %s", Preview(result))
+    return [Message(**c["message"]) for c in result["choices"]]
 
 
 def _json_loads_no_fail(json_string: str):
@@ -86,7 +101,34 @@ def _json_loads_no_fail(json_string: str):
         return {}
 
 
-async def get_llm_stream(messages: List[Message], thread_id: str):
+async def get_llm_stream(messages: List[Message], thread_id: str, trace_headers=None):
+    encoder = SSEEncoder(thread_id, "wx.ai AI service")
+
+    def encode_content(content):
+        return encoder.event(
+            "thread.run.step.delta", {"role": "assistant", "content": content}
+        )
+
+    stream_metrics = StreamMetrics()
+    span = start_request_span(trace_headers, thread_id, stream=True)
+    try:
+        async for frame in coalesce_deltas(
+            _stream_events(messages, thread_id, encoder, stream_metrics, span),
+            encode_content,
+        ):
+            yield frame
+    finally:
+        stream_metrics.finish()
+        end_span(span)
+
+
+async def _stream_events(
+    messages: List[Message],
+    thread_id: str,
+    encoder: SSEEncoder,
+    stream_metrics: StreamMetrics,
+    span,
+):
     """
 
     wrapper around run_ai_service_stream(streaming version)
@@ -97,18 +139,31 @@ async def get_llm_stream(messages: List[Message], thread_id: str):
     these are not returned to orchestrate
     """
     logger.info("wx.ai deployment streaming call start")
-    client = _get_wxai_client()
+    client = _get_wxai_client(await aget_access_token(WATSONX_API_KEY))
     for m in messages:
         if m.role == "system":
             m.role = "assistant"
     payload = {"messages": [m.model_dump(exclude_defaults=True, exclude_unset=True) for m in messages]
         }
-    logger.info(f"wx.ai deployment streaming call payload {payload}")
+    logger.debug("wx.ai deployment streaming call payload %s", Preview(payload))
+    # per-chunk logs are decided once per stream, disabled streams pay one bool check per chunk
+    log_chunks = sample_stream(logger)
+    deployment_span = start_span(
+        "deployment run_ai_service_stream",
+        span,
+        thread_id,
+        deployment_id=WATSONX_DEPLOYMENT_ID,
+    )
+    # tool calls are only visible as deltas, a span runs from the call to its response
+    tool_spans = {}
     try:
-        for chunk in client.deployments.run_ai_service_stream(
-            WATSONX_DEPLOYMENT_ID, payload
+        async for chunk in iterate_in_thread(
+            lambda: client.deployments.run_ai_service_stream(
+                WATSONX_DEPLOYMENT_ID, payload
+            )
         ):
-            logger.info(f"Received chunk from AI service: {chunk}")
+            if log_chunks:
+                logger.debug("Received chunk from AI service: %s", Preview(chunk))
             try:
                 delta = json.loads(chunk)["choices"][0]["delta"]
             except:
@@ -116,51 +171,65 @@ async def get_llm_stream(messages: List[Message], thread_id: str):
                 logger.warning(warning_msg)
                 raise RuntimeError(warning_msg)
 
-            current_timestamp = int(time.time())
-            delta_id = str(uuid.uuid4())
-            struct = {
-                "id": delta_id,
-                "object": "thread.run.step.delta",
-                "created": current_timestamp,
-                "thread_id": thread_id,
-                "model": "wx.ai AI service"
-            }
             if delta["role"] == "assistant" and "tool_calls" in delta:
-                struct["choices"] = [{
-                        "delta": {
-                            "role": "assistant",
-                            "step_details": {
-                                "type": "tool_calls",
-                                "tool_calls": [
-                                    {
-                                        "name": tool_call["function"]["name"],
-                                        "args": _json_loads_no_fail(tool_call["function"]["arguments"]),
-                                        "id": tool_call["id"]
-                                     }
-                                    for tool_call in delta["tool_calls"]
-                                ]
+                for tool_call in delta["tool_calls"]:
+                    stream_metrics.tool_start(tool_call["id"])
+                    tool_spans[tool_call["id"]] = start_span(
+                        f"tool {tool_call['function']['name']}",
+                        deployment_span,
+                        thread_id,
+                        **{"tool.name": tool_call["function"]["name"]},
+                    )
+                event_content = encoder.step_delta(
+                    {
+                        "type": "tool_calls",
+                        "tool_calls": [
+                            {
+                                "name": tool_call["function"]["name"],
+                                "args": _json_loads_no_fail(
+                                    tool_call["function"]["arguments"]
+                                ),
+                                "id": tool_call["id"],
                             }
-                        }
-                    }]
+                            for tool_call in delta["tool_calls"]
+                        ],
+                    }
+                )
             elif delta["role"] == "tool":
-                struct["choices"] = [{"delta": {
-                    "role": "assistant",
-                    "step_details": {
+                stream_metrics.tool_end(delta["tool_call_id"], delta["name"])
+                end_span(tool_spans.pop(delta["tool_call_id"], None))
+                event_content = encoder.step_delta(
+                    {
                         "type": "tool_response",
                         "name": delta["name"],
                         "tool_call_id": delta["tool_call_id"],
                         "content": delta["content"],
-                        }
-                }}]
+                    }
+                )
             elif delta["role"] == "assistant" and "content" in delta:
-                struct["choices"] = [{"delta": delta}]
+                if delta.keys() <= {"role", "content"} and isinstance(
+                    delta["content"], str
+                ):
+                    # plain text, may be merged with neighbouring deltas
+                    stream_metrics.token()
+                    yield TextDelta(delta["content"])
+                    continue
+                event_content = encoder.event("thread.run.step.delta", delta)
             else:
                 # should not happen
-                logger.warning("Enable to parse delta: " + delta)
-            event_content = format_resp(struct)
-            logger.info("Sending event content: " + event_content)
+                logger.warning("Unable to parse delta: %s", Preview(delta))
+                continue
+            if log_chunks:
+                logger.debug("Sending event content: %s", Preview(event_content))
             yield event_content
     except Exception as e:
+        ERRORS.labels("stream").inc()
         logger.error(f"Exception {str(e)}")
         traceback.print_exc()
+        end_span(deployment_span, e)
+        deployment_span = None
         yield f"Error: {str(e)}\n"
+    finally:
+        for tool_span in tool_spans.values():
+            end_span(tool_span)
+        end_span(deployment_span)
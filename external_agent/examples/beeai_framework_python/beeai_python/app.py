@@ -20,6 +20,7 @@ from beeai_framework.adapters.watsonx import WatsonxChatModel
 
 
 from beeai_python.settings import AppSettings
+from beeai_python.stats_api import StatsAPI
 from beeai_python.tools import search_web_tool
 
 warnings.filterwarnings("ignore")
@@ -69,7 +70,7 @@ def main() -> None:
     config = WatsonxOrchestrateServerConfig(
         port=8080, host="0.0.0.0", api_key=AppSettings.api_key
     )
-    server = WatsonxOrchestrateServer(config=config)
+    server = WatsonxOrchestrateServer(config=config, api_cls=StatsAPI)
     server.register(agent)
 
     server.serve()
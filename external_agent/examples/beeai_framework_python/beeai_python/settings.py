@@ -18,6 +18,14 @@ class Settings(BaseSettings):
     tavily_api_key: str
     log_intermediate_steps: bool = Field(default=False)
     watsonx_default_model: str = "ibm/granite-3-3-8b-instruct"
+    tool_cache_ttl_seconds: float = Field(default=300)
+    tool_cache_max_entries: int = Field(default=1024)
+    tool_timeout_seconds: float = Field(default=20)
+    tool_hedge_enabled: bool = Field(default=True)
+    tool_hedge_min_seconds: float = Field(default=1)
+    tool_breaker_failures: int = Field(default=5)
+    tool_breaker_reset_seconds: float = Field(default=30)
+    tool_threads: int = Field(default=16)
 
 
 AppSettings = Settings()
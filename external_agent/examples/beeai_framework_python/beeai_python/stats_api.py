@@ -0,0 +1,34 @@
+from functools import cached_property
+from typing import Any
+
+from beeai_framework.adapters.watsonx_orchestrate.serve.api import WatsonxOrchestrateAPI
+from fastapi import FastAPI, Header, HTTPException, status
+
+from beeai_python.tool_cache import tool_cache_stats
+from beeai_python.tools import resilience_stats
+
+
+class StatsAPI(WatsonxOrchestrateAPI):
+    """
+    The watsonx Orchestrate API of the BeeAI server plus GET /stats, which returns the
+    tool cache and tool resilience counters as JSON. It asks for the same X-API-Key as /chat/completions.
+    """
+
+    @cached_property
+    def app(self) -> FastAPI:
+        app = super().app
+        app.add_api_route("/stats", self.stats, methods=["GET"])
+        return app
+
+    async def stats(
+        self, api_key: str | None = Header(None, alias="X-API-Key")
+    ) -> dict[str, Any]:
+        if self._api_key is not None and api_key != self._api_key:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Missing or invalid API key",
+            )
+        return {
+            "tool_cache": tool_cache_stats(),
+            "tool_resilience": resilience_stats(),
+        }
@@ -1,22 +1,64 @@
+from functools import lru_cache, partial
+
 from beeai_framework.tools import tool
 from tavily import TavilyClient
 
+from beeai_python.resilience import ResilientTool
 from beeai_python.settings import AppSettings
+from beeai_python.tool_cache import cached_tool
+
+
+class DegradedSearchResult(dict):
+    """Returned instead of search results when Tavily is unavailable. It is never cached."""
+
+    cacheable = False
+
+
+def degraded_search_result(name: str, reason: str) -> DegradedSearchResult:
+    return DegradedSearchResult(
+        results=[], error=f"The {name} tool is temporarily unavailable ({reason})."
+    )
+
+
+search_web_resilience = ResilientTool(
+    "search_web_tool",
+    AppSettings.tool_timeout_seconds,
+    hedge=AppSettings.tool_hedge_enabled,
+    hedge_min_seconds=AppSettings.tool_hedge_min_seconds,
+    failure_threshold=AppSettings.tool_breaker_failures,
+    reset_seconds=AppSettings.tool_breaker_reset_seconds,
+    max_threads=AppSettings.tool_threads,
+    degraded_result=degraded_search_result,
+)
+
+
+def resilience_stats() -> dict[str, dict]:
+    return {search_web_resilience.name: search_web_resilience.stats()}
+
+
+@lru_cache(maxsize=1)
+def get_tavily_client() -> TavilyClient:
+    return TavilyClient(api_key=AppSettings.tavily_api_key)
 
 
 @tool
-def search_web_tool(query: str) -> dict[str, str] | None:
+@cached_tool(
+    "search_web_tool",
+    AppSettings.tool_cache_ttl_seconds,
+    AppSettings.tool_cache_max_entries,
+)
+async def search_web_tool(query: str) -> dict[str, str] | None:
     """
 
     Searches the web for the given query and returns the most relevant results.
     """
 
-    client = TavilyClient(api_key=AppSettings.tavily_api_key)
-    results = client.search(
+    search = partial(
+        get_tavily_client().search,
         query,
         search_depth="advanced",
         max_results=10,
         include_images=False,
         include_answer=False,
     )
-    return results
+    return await search_web_resilience.call(search)
@@ -2,44 +2,114 @@ import logging
 import uuid
 import time
 from typing import Optional, Dict, Any
-from fastapi import FastAPI, Header, Depends
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi import FastAPI, Header, Depends, Request
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 from models import ChatCompletionRequest, ChatCompletionResponse, Choice, MessageResponse, DEFAULT_MODEL
 from security import get_current_user
+from auth import credential_verifier
 from tools import web_search_duckduckgo, news_search_duckduckgo
-from llm_utils import get_llm_sync, get_llm_stream
+from llm_utils import aget_llm_sync, get_llm_stream
+from concurrency import sync_limiter
+from graph_cache import graph_cache
+from tool_cache import tool_cache_stats
+from tool_executor import resilience_stats
+from resilience import ResilientTool
+from metrics import REQUEST_LATENCY, ERRORS, ADMISSION_REJECTIONS
+from stats_metrics import register_stats
+from admission import admission, admission_key, LeasedStreamingResponse, AdmissionRejected
+from response_cache import response_cache, cache_scope
+from stream_replay import stream_replay, replay_key, request_fingerprint
+from log_utils import configure_logging, Preview
 
+configure_logging()
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.DEBUG)
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-console_handler.setFormatter(formatter)
-logger.addHandler(console_handler)
 
 app = FastAPI()
 
+register_stats('sync_limiter', lambda: {'active': sync_limiter.active, 'queue_depth': sync_limiter.queue_depth, 'limit': sync_limiter.limit})
+register_stats('graph_cache', graph_cache.stats, counters=('hits', 'misses'))
+register_stats('tool_cache', tool_cache_stats, label='tool', counters=('hits', 'misses', 'evictions'))
+register_stats('tool_resilience', resilience_stats, label='tool', counters=ResilientTool.COUNTERS)
+register_stats('admission', admission.stats, counters=('rate', 'key_concurrency', 'queue_timeout'))
+register_stats('auth', credential_verifier.stats, counters=credential_verifier.counters)
+register_stats('response_cache', response_cache.stats, counters=response_cache.counters)
+register_stats('stream_replay', stream_replay.stats, counters=stream_replay.counters)
+
+@app.get("/metrics")
+async def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 @app.post("/chat/completions")
 async def chat_completions(
     request: ChatCompletionRequest,
+    raw_request: Request,
     X_IBM_THREAD_ID: Optional[str] = Header(None, alias="X-IBM-THREAD-ID", description="Optional header to specify the thread ID"),
     current_user: Dict[str, Any] = Depends(get_current_user),
 ):
-    logger.info(f"Received POST /chat/completions ChatCompletionRequest: {request.json()}")
+    logger.info("Received POST /chat/completions with %d messages, model %s, stream %s",
+                len(request.messages), request.model, request.stream)
+    logger.debug("ChatCompletionRequest: %s", Preview(request.model_dump_json))
     thread_id = ''
     if  X_IBM_THREAD_ID:
         thread_id =  X_IBM_THREAD_ID
     if request.extra_body and request.extra_body.thread_id:
         thread_id = request.extra_body.thread_id
-    logger.info("thread_id: " + thread_id)
+    logger.info("thread_id: %s", thread_id)
     model = DEFAULT_MODEL
     if request.model:
         model = request.model
     selected_tools = [web_search_duckduckgo, news_search_duckduckgo]
+    # Identifies the credential or subject, threads and cached answers are kept per caller
+    caller = admission_key(current_user, '')
+    if request.stream and thread_id:
+        # A reconnect continues the run of this thread instead of starting it again. That starts
+        # no work, so it does not go through admission control.
+        fingerprint = request_fingerprint(model, request.messages)
+        stream, replay_status = stream_replay.join(replay_key(caller, thread_id), fingerprint,
+                                                   raw_request.headers.get('last-event-id'))
+        if stream is not None:
+            logger.info("Stream replay %s for thread %s", replay_status, thread_id)
+            return StreamingResponse(stream, media_type="text/event-stream", headers={'X-Stream-Replay': replay_status})
+    try:
+        lease = await admission.acquire(admission_key(current_user, thread_id))
+    except AdmissionRejected as e:
+        logger.warning("Rejected request for thread %s: %s", thread_id, e)
+        ADMISSION_REJECTIONS.labels(e.reason).inc()
+        return JSONResponse(status_code=429, content={"error": {"message": str(e), "type": e.reason}},
+                            headers={"Retry-After": e.retry_after_header})
     if request.stream:
-        return StreamingResponse(get_llm_stream(request.messages, model, thread_id, selected_tools), media_type="text/event-stream")
+        def make_stream():
+            return get_llm_stream(request.messages, model, thread_id, selected_tools, raw_request.headers, caller)
+
+        if thread_id:
+            # A tracked run keeps the lease until it ends, even after its clients disconnected, so
+            # reconnecting with other messages cannot start more runs than admission allows
+            stream, replay_status = stream_replay.start(replay_key(caller, thread_id), fingerprint, make_stream, lease)
+        else:
+            stream, replay_status = make_stream(), None
+        if replay_status:
+            logger.info("Stream replay %s for thread %s", replay_status, thread_id)
+        headers = {'X-Stream-Replay': replay_status} if replay_status else None
+        # Otherwise the response releases the lease, also when it is cancelled before streaming
+        return LeasedStreamingResponse(stream, None if replay_status else lease, media_type="text/event-stream",
+                                       headers=headers)
     else:
-        last_message, all_messages = get_llm_sync(request.messages, model, thread_id, selected_tools)
+        async def run():
+            async with sync_limiter:
+                last_message, all_messages = await aget_llm_sync(request.messages, model, thread_id, selected_tools, raw_request.headers, caller)
+            return last_message
+
+        with REQUEST_LATENCY.labels('sync').time():
+            try:
+                last_message, cache_status = await response_cache.get_or_compute(
+                    cache_scope(caller), model, [tool.name for tool in selected_tools],
+                    request.messages, run, raw_request.headers.get('cache-control'), lease=lease)
+            except Exception:
+                ERRORS.labels('sync').inc()
+                raise
+        if cache_status:
+            logger.info("Response cache %s for thread %s", cache_status, thread_id)
         id = str(uuid.uuid4())
         response = ChatCompletionResponse(
             id=id,
@@ -57,7 +127,8 @@ async def chat_completions(
                 )
             ]
         )
-        return JSONResponse(content=response.dict())
+        headers = {'X-Response-Cache': cache_status} if cache_status else None
+        return JSONResponse(content=response.dict(), headers=headers)
 
 if __name__ == '__main__':
     import uvicorn
@@ -0,0 +1,293 @@
+# Kept identical in every example that uses it, see SHARED_MODULES in external_agent/examples/shared_modules.py
+import os
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Optional
+import requests
+
+try:
+    import jwt
+except ImportError:
+    jwt = None
+
+logger = logging.getLogger()
+
+# none accepts any credential (the default of this example), jwt verifies bearer tokens against the keys at
+# AUTH_JWKS_URL, introspection asks AUTH_INTROSPECTION_URL (RFC 7662) about each new token
+AUTH_MODE = os.getenv("AUTH_MODE", "none").lower()
+AUTH_JWKS_URL = os.getenv("AUTH_JWKS_URL", None)
+AUTH_ISSUER = os.getenv("AUTH_ISSUER", None)
+AUTH_AUDIENCE = os.getenv("AUTH_AUDIENCE", None)
+AUTH_ALGORITHMS = os.getenv("AUTH_ALGORITHMS", "RS256").split(",")
+AUTH_LEEWAY_SECONDS = int(os.getenv("AUTH_LEEWAY_SECONDS", "30"))
+AUTH_JWKS_TTL_SECONDS = int(os.getenv("AUTH_JWKS_TTL_SECONDS", "3600"))
+AUTH_INTROSPECTION_URL = os.getenv("AUTH_INTROSPECTION_URL", None)
+AUTH_INTROSPECTION_CLIENT_ID = os.getenv("AUTH_INTROSPECTION_CLIENT_ID", None)
+AUTH_INTROSPECTION_CLIENT_SECRET = os.getenv("AUTH_INTROSPECTION_CLIENT_SECRET", None)
+# Comma separated API keys accepted in X-API-Key when AUTH_MODE is not none. Only their hashes are kept.
+AUTH_API_KEYS = [
+    key.strip() for key in os.getenv("AUTH_API_KEYS", "").split(",") if key.strip()
+]
+# Verified tokens are trusted until they expire, but for no longer than this
+AUTH_CACHE_TTL_SECONDS = int(os.getenv("AUTH_CACHE_TTL_SECONDS", "300"))
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
+# Rejected tokens are answered from memory for this long
+AUTH_NEGATIVE_CACHE_SECONDS = int(os.getenv("AUTH_NEGATIVE_CACHE_SECONDS", "30"))
+# A token with an unknown key id triggers at most one JWKS refetch per this many seconds
+JWKS_MIN_REFRESH_SECONDS = 60
+# After a failed JWKS fetch the next attempt waits this long, so an outage does not send every request to the endpoint
+JWKS_RETRY_SECONDS = 5
+
+
+class InvalidCredentials(Exception):
+    """The credential was checked and is not valid. Such results are cached."""
+
+
+class CredentialsUnavailable(Exception):
+    """The credential could not be checked, for example because the introspection endpoint is down. Not cached."""
+
+
+def _digest(credential: str) -> str:
+    return hashlib.sha256(credential.encode("utf-8")).hexdigest()
+
+
+class ExpiringCache:
+    """Size-bounded LRU where every entry has its own expiry time (epoch seconds)."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def get(self, key, now: float):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= now:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value, expires_at: float):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class JwksCache:
+    """
+    Signing keys from a JWKS endpoint by key id.
+
+    The key set is fetched again after ttl_seconds, and when a token names an unknown key id
+    (key rotation), but then at most once per JWKS_MIN_REFRESH_SECONDS, so tokens with made-up
+    key ids cannot flood the endpoint. If a fetch fails the previous keys stay in use and the
+    fetch is tried again after retry_seconds. A token whose key id is not among them meanwhile
+    raises CredentialsUnavailable, not InvalidCredentials, since it was never checked.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        ttl_seconds: int = AUTH_JWKS_TTL_SECONDS,
+        retry_seconds: float = JWKS_RETRY_SECONDS,
+    ):
+        self.url = url
+        self.ttl_seconds = ttl_seconds
+        self.retry_seconds = retry_seconds
+        self._keys = {}
+        self._fetched_at = float("-inf")
+        self._failed_at = float("-inf")
+        self._lock = asyncio.Lock()
+        self._session = requests.Session()
+
+    def _stale(self, kid) -> bool:
+        now = time.monotonic()
+        if now - self._failed_at < self.retry_seconds:
+            return False
+        age = now - self._fetched_at
+        return age > self.ttl_seconds or (
+            kid not in self._keys and age > JWKS_MIN_REFRESH_SECONDS
+        )
+
+    async def get_key(self, kid: Optional[str]):
+        if self._stale(kid):
+            async with self._lock:
+                if self._stale(kid):
+                    await self._refresh()
+        key = self._keys.get(kid)
+        if key is None and kid is None and len(self._keys) == 1:
+            key = next(iter(self._keys.values()))
+        if key is None:
+            if self._failed_at > self._fetched_at:
+                raise CredentialsUnavailable(
+                    f"Signing keys could not be fetched from {self.url}"
+                )
+            raise InvalidCredentials(f"Unknown signing key {kid}")
+        return key
+
+    async def _refresh(self):
+        try:
+            response = await asyncio.to_thread(self._session.get, self.url, timeout=10)
+            response.raise_for_status()
+            keys = {}
+            for jwk in response.json().get("keys", []):
+                try:
+                    keys[jwk.get("kid")] = jwt.PyJWK(jwk).key
+                except jwt.PyJWTError as e:
+                    logger.warning(
+                        f"Skipping unusable JWKS key {jwk.get('kid')}: {str(e)}"
+                    )
+            self._keys = keys
+            self._fetched_at = time.monotonic()
+            logger.info(f"Fetched {len(keys)} signing keys from {self.url}")
+        except (requests.RequestException, ValueError) as e:
+            self._failed_at = time.monotonic()
+            logger.error(f"Could not fetch JWKS from {self.url}: {str(e)}")
+
+
+class CredentialVerifier:
+    """
+    Checks the API key or bearer token of a request without a network call in the common case.
+
+    Verified tokens are cached by hash until their exp claim (at most AUTH_CACHE_TTL_SECONDS),
+    rejected ones for AUTH_NEGATIVE_CACHE_SECONDS, and concurrent requests with the same new
+    token share one verification. JWT signatures are checked against cached JWKS keys.
+    """
+
+    def __init__(self, mode: str = AUTH_MODE):
+        self.mode = mode
+        if mode == "jwt":
+            if jwt is None:
+                raise RuntimeError(
+                    "AUTH_MODE=jwt requires PyJWT, install it with pip install 'pyjwt[crypto]'"
+                )
+            if not AUTH_JWKS_URL:
+                raise RuntimeError("AUTH_MODE=jwt requires AUTH_JWKS_URL")
+        if mode == "introspection" and not AUTH_INTROSPECTION_URL:
+            raise RuntimeError(
+                "AUTH_MODE=introspection requires AUTH_INTROSPECTION_URL"
+            )
+        self._jwks = JwksCache(AUTH_JWKS_URL) if mode == "jwt" else None
+        self._session = requests.Session()
+        self._api_key_digests = frozenset(_digest(key) for key in AUTH_API_KEYS)
+        self._verified = ExpiringCache(AUTH_CACHE_MAX_ENTRIES)
+        self._rejected = ExpiringCache(AUTH_CACHE_MAX_ENTRIES)
+        self._in_flight = {}
+        self.counters = {
+            "cache_hits": 0,
+            "negative_cache_hits": 0,
+            "verifications": 0,
+            "rejections": 0,
+        }
+
+    async def verify(self, api_key: Optional[str], token: Optional[str]) -> dict:
+        """Returns the claims of the credential, or raises InvalidCredentials or CredentialsUnavailable."""
+        if self.mode == "none":
+            return {}
+        if token:
+            return await self._verify_token(token)
+        if api_key:
+            if _digest(api_key) in self._api_key_digests:
+                return {"sub": "api-key:" + _digest(api_key)[:16]}
+            self.counters["rejections"] += 1
+            raise InvalidCredentials("Invalid API key")
+        raise InvalidCredentials("Missing credentials")
+
+    async def _verify_token(self, token: str) -> dict:
+        digest = _digest(token)
+        now = time.time()
+        claims = self._verified.get(digest, now)
+        if claims is not None:
+            self.counters["cache_hits"] += 1
+            return claims
+        reason = self._rejected.get(digest, now)
+        if reason is not None:
+            self.counters["negative_cache_hits"] += 1
+            raise InvalidCredentials(reason)
+        task = self._in_flight.get(digest)
+        if task is None:
+            task = self._in_flight[digest] = asyncio.ensure_future(
+                self._verify_and_cache(token, digest)
+            )
+            task.add_done_callback(lambda _: self._in_flight.pop(digest, None))
+        # Shielded, so a client that disconnects does not cancel the check for the others
+        return await asyncio.shield(task)
+
+    async def _verify_and_cache(self, token: str, digest: str) -> dict:
+        self.counters["verifications"] += 1
+        try:
+            claims = await (
+                self._decode_jwt(token)
+                if self.mode == "jwt"
+                else self._introspect(token)
+            )
+        except InvalidCredentials as e:
+            self.counters["rejections"] += 1
+            self._rejected.put(
+                digest, str(e), time.time() + AUTH_NEGATIVE_CACHE_SECONDS
+            )
+            raise
+        expires_at = time.time() + AUTH_CACHE_TTL_SECONDS
+        if claims.get("exp"):
+            expires_at = min(expires_at, float(claims["exp"]))
+        self._verified.put(digest, claims, expires_at)
+        return claims
+
+    async def _decode_jwt(self, token: str) -> dict:
+        try:
+            header = jwt.get_unverified_header(token)
+        except jwt.PyJWTError as e:
+            raise InvalidCredentials(f"Malformed token: {str(e)}")
+        key = await self._jwks.get_key(header.get("kid"))
+        try:
+            return jwt.decode(
+                token,
+                key,
+                algorithms=AUTH_ALGORITHMS,
+                audience=AUTH_AUDIENCE,
+                issuer=AUTH_ISSUER,
+                leeway=AUTH_LEEWAY_SECONDS,
+                options={"verify_aud": bool(AUTH_AUDIENCE)},
+            )
+        except jwt.PyJWTError as e:
+            raise InvalidCredentials(f"Invalid token: {str(e)}")
+
+    async def _introspect(self, token: str) -> dict:
+        auth = (
+            (AUTH_INTROSPECTION_CLIENT_ID, AUTH_INTROSPECTION_CLIENT_SECRET)
+            if AUTH_INTROSPECTION_CLIENT_ID
+            else None
+        )
+        try:
+            response = await asyncio.to_thread(
+                self._session.post,
+                AUTH_INTROSPECTION_URL,
+                timeout=10,
+                auth=auth,
+                data={"token": token, "token_type_hint": "access_token"},
+            )
+            response.raise_for_status()
+            claims = response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise CredentialsUnavailable(f"Token introspection failed: {str(e)}")
+        if not claims.get("active"):
+            raise InvalidCredentials("Token is not active")
+        return claims
+
+    def stats(self) -> dict:
+        return dict(
+            self.counters,
+            verified_entries=len(self._verified),
+            rejected_entries=len(self._rejected),
+        )
+
+
+credential_verifier = CredentialVerifier()
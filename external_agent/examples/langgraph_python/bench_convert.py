@@ -0,0 +1,101 @@
+"""
+Benchmark for converting request messages to LangChain messages over long histories.
+
+Compares the previous convert_messages_to_langgraph_format + validate_chat_history passes
+with the single-pass converter, and with prepare_inputs when the thread store already holds
+the history and only the last turn is new. Run with: python bench_convert.py [messages] [rounds]
+"""
+import sys
+import time
+import asyncio
+from typing import List
+from langchain_core.messages import HumanMessage, AIMessage, ToolMessage, SystemMessage, BaseMessage, ToolCall
+from models import Message, AIToolCall, Function
+from thread_store import InMemoryThreadStore, thread_key
+import llm_utils
+
+def legacy_convert(messages: List[Message]):
+    conv_messages = []
+    max_message_length = 50000
+    for msg in messages:
+        if msg.content and len(msg.content) > max_message_length:
+            msg.content = msg.content[:max_message_length]
+        role = msg.role
+        if role.lower() == 'user' or role.lower() == 'human':
+            new_message = HumanMessage(content=msg.content)
+        if role.lower() == 'system':
+            new_message = SystemMessage(content=msg.content)
+        if role.lower() == 'assistant':
+            content = msg.content or ''
+            if msg.tool_calls:
+                langchain_tool_calls = []
+                for tool_call in msg.tool_calls:
+                    langchain_tool_calls.append(ToolCall(name=tool_call.function.name, args=tool_call.function.arguments, id=tool_call.id, type='tool'))
+                new_message = AIMessage(content=content, tool_calls=langchain_tool_calls, additional_kwargs={})
+            else:
+                new_message = AIMessage(content=content, additional_kwargs={})
+        if role.lower() == 'tool':
+            new_message = ToolMessage(content=msg.content, name=None, tool_call_id=msg.tool_call_id)
+        conv_messages.append(new_message)
+    return {"messages": conv_messages}
+
+def legacy_validate(messages: List[BaseMessage]):
+    tool_call_ids = set()
+    for msg in messages:
+        if isinstance(msg, AIMessage) and msg.tool_calls:
+            for tool_call in msg.tool_calls:
+                tool_call_ids.add(tool_call.get('id'))
+    for msg in messages:
+        if isinstance(msg, ToolMessage):
+            if msg.tool_call_id in tool_call_ids:
+                tool_call_ids.remove(msg.tool_call_id)
+    for tool_call_id in tool_call_ids:
+        messages.append(ToolMessage(content="Tool call failed or no response received.", tool_call_id=tool_call_id, name="unknown"))
+
+def legacy(messages):
+    inputs = legacy_convert(messages)
+    legacy_validate(inputs["messages"])
+    return inputs
+
+def build_history(size: int) -> List[Message]:
+    history = [Message(role='system', content='You are a helpful assistant.')]
+    turn = 0
+    while len(history) < size:
+        call_id = f"call-{turn}"
+        history.append(Message(role='user', content=f"What is the news about topic {turn}?"))
+        history.append(Message(role='assistant', content='', tool_calls=[
+            AIToolCall(id=call_id, type='function', function=Function(name='news_search_duckduckgo', arguments={'search_phrase': f'topic {turn}'}))]))
+        history.append(Message(role='tool', content='snippet: ' + 'result text ' * 40, tool_call_id=call_id))
+        history.append(Message(role='assistant', content='Here is a summary of the news. ' * 10))
+        turn += 1
+    return history[:size]
+
+def run(name, func, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    elapsed = (time.perf_counter() - start) / rounds
+    print(f"{name:<44} {elapsed * 1000:>10.3f} ms/request")
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    history = build_history(size)
+    assert [type(m) for m in legacy(history)["messages"]] == [type(m) for m in llm_utils.convert_messages_to_langgraph_format(history)["messages"]]
+    print(f"{size} message history, {rounds} rounds")
+    run("legacy convert + validate_chat_history", lambda: legacy(history), rounds)
+    run("single-pass convert", lambda: llm_utils.convert_messages_to_langgraph_format(history), rounds)
+    # Every round is a new last message on a thread whose previous turn is already in the store
+    store = InMemoryThreadStore()
+    llm_utils.thread_store = store
+    # One event loop for all rounds, so its setup is not part of the measurement
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(llm_utils.prepare_inputs(history[:-1], 'bench-thread'))
+    previous = store.get(thread_key('', 'bench-thread'))
+    def next_turn():
+        store.save(thread_key('', 'bench-thread'), previous, 0)
+        loop.run_until_complete(llm_utils.prepare_inputs(history, 'bench-thread'))
+    run("prepare_inputs with history in thread store", next_turn, rounds)
+
+if __name__ == '__main__':
+    main()
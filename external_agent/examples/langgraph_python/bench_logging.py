@@ -0,0 +1,122 @@
+"""
+Micro-benchmark for logging on the streaming hot path.
+
+Replays the astream_events of one streamed answer (history of MESSAGES messages, TOKENS content
+deltas and a tool call) through the f-string logging get_llm_stream used before and through the
+lazy, sampled logging it uses now. Records go to a handler that counts bytes instead of writing
+them. Run with: python bench_logging.py [streams]
+"""
+import sys
+import time
+import uuid
+import logging
+import log_utils
+from log_utils import Preview, sample_stream
+from langchain_core.messages import AIMessageChunk, HumanMessage, AIMessage, ToolMessage
+from sse import SSEEncoder
+
+MESSAGES = 50
+TOKENS = 300
+
+class CountingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+        self.bytes = 0
+
+    def emit(self, record):
+        self.bytes += len(self.format(record)) + 1
+
+def build_events():
+    history = []
+    for i in range(MESSAGES // 2):
+        history.append(HumanMessage(content=f"Question {i} about the quarterly results " * 5))
+        history.append(AIMessage(content=f"Answer {i} with a longer explanation of the numbers " * 10))
+    state = {"messages": history}
+    metadata = {"langgraph_step": 1, "langgraph_node": "agent", "thread_id": "t", "ls_provider": "ibm"}
+
+    def event(kind, name, data):
+        return {"event": kind, "name": name, "run_id": str(uuid.uuid4()), "tags": [], "metadata": metadata,
+                "data": data, "parent_ids": [str(uuid.uuid4())]}
+
+    events = [event("on_chain_start", "LangGraph", {"input": state}), event("on_chain_start", "agent", {"input": state}),
+              event("on_chat_model_start", "ChatWatsonx", {"input": state})]
+    events.append(event("on_tool_start", "web_search", {"input": {"search_phrase": "nasdaq today"}}))
+    events.append(event("on_tool_end", "web_search", {"output": ToolMessage(content="result snippet " * 200, tool_call_id="1")}))
+    events += [event("on_chat_model_stream", "ChatWatsonx", {"chunk": AIMessageChunk(content=" token")}) for _ in range(TOKENS)]
+    events += [event("on_chain_end", "agent", {"output": state}), event("on_chain_end", "LangGraph", {"output": state})]
+    return events
+
+def legacy_stream(logger, events, encoder):
+    accumulated_contents = ""
+    for event in events:
+        kind = event["event"]
+        logger.debug(f"event = {event}")
+        if kind == "on_chat_model_stream":
+            content = event["data"]["chunk"].content
+            logger.debug("Sending content delta: " + content)
+            accumulated_contents += content
+        elif kind == "on_tool_start":
+            printmsg = f"Starting tool: {event['name']} with inputs: {event['data'].get('input')} run_id: {event['run_id']}"
+            logger.debug(printmsg)
+            logger.info("Sending tool call event content: " + encoder.step_delta({"name": event['name']}))
+        elif kind == "on_tool_end":
+            content = event["data"]["output"].content
+            logger.info(f"Tool output for run {event['run_id']} was: {content}")
+            logger.info("Sending tool response event content: " + encoder.step_delta({"content": content}))
+        else:
+            logger.debug("Received event type: " + kind)
+    logger.info("Final streamed content:\n" + accumulated_contents)
+
+def lazy_stream(logger, events, encoder):
+    log_events = sample_stream(logger)
+    accumulated_contents = []
+    for event in events:
+        kind = event["event"]
+        if log_events:
+            logger.debug("event = %s", Preview(event))
+        if kind == "on_chat_model_stream":
+            content = event["data"]["chunk"].content
+            if log_events:
+                logger.debug("Sending content delta: %s", content)
+            accumulated_contents.append(content)
+        elif kind == "on_tool_start":
+            logger.info("Starting tool %s run_id: %s", event['name'], event['run_id'])
+            event_content = encoder.step_delta({"name": event['name']})
+            if log_events:
+                logger.debug("Sending tool call event content: %s", Preview(event_content))
+        elif kind == "on_tool_end":
+            content = event["data"]["output"].content
+            logger.info("Tool output for run %s was: %s", event['run_id'], Preview(content))
+            event_content = encoder.step_delta({"content": content})
+            if log_events:
+                logger.debug("Sending tool response event content: %s", Preview(event_content))
+        elif log_events:
+            logger.debug("Received event type: %s", kind)
+    logger.info("Final streamed content:\n%s", Preview(lambda: ''.join(accumulated_contents)))
+
+def run(name, func, level, streams, events, sample_rate=1.0):
+    logger = logging.getLogger(f"bench.{name}")
+    logger.propagate = False
+    logger.handlers = [handler := CountingHandler()]
+    logger.setLevel(level)
+    log_utils.LOG_SAMPLE_RATE = sample_rate
+    encoder = SSEEncoder("thread", "model")
+    start = time.perf_counter()
+    for _ in range(streams):
+        func(logger, events, encoder)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<34} {elapsed / streams * 1000:>9.3f} ms/stream {handler.bytes / streams / 1024:>10.1f} KiB/stream")
+
+def main():
+    streams = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    events = build_events()
+    print(f"{len(events)} events per stream, {MESSAGES} messages of history")
+    run("f-string, INFO", legacy_stream, logging.INFO, streams, events)
+    run("lazy, INFO", lazy_stream, logging.INFO, streams, events)
+    run("f-string, DEBUG", legacy_stream, logging.DEBUG, streams, events)
+    run("lazy, DEBUG, all streams", lazy_stream, logging.DEBUG, streams, events)
+    run("lazy, DEBUG, 1% of streams", lazy_stream, logging.DEBUG, streams, events, sample_rate=0.01)
+
+if __name__ == '__main__':
+    main()
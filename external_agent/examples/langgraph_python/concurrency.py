@@ -0,0 +1,38 @@
+import os
+import asyncio
+import logging
+
+logger = logging.getLogger()
+
+MAX_CONCURRENT_SYNC_REQUESTS = int(os.getenv('MAX_CONCURRENT_SYNC_REQUESTS', '16'))
+
+class ConcurrencyLimiter:
+    """
+    Bounds how many non-streaming runs execute at once on this worker.
+
+    Requests over the limit wait in FIFO order. active and queue_depth can be read at
+    any time for monitoring.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self.queue_depth = 0
+        self._semaphore = asyncio.Semaphore(limit)
+
+    async def __aenter__(self):
+        if self._semaphore.locked():
+            logger.info(f"Concurrency limit of {self.limit} reached, {self.queue_depth + 1} request(s) waiting")
+        self.queue_depth += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.queue_depth -= 1
+        self.active += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.active -= 1
+        self._semaphore.release()
+
+sync_limiter = ConcurrencyLimiter(MAX_CONCURRENT_SYNC_REQUESTS)
@@ -5,3 +5,15 @@ WATSONX_PROJECT_ID = os.getenv('WATSONX_PROJECT_ID', None)
 WATSONX_API_KEY = os.getenv('WATSONX_API_KEY', None)
 WATSONX_URL = os.getenv('WATSONX_URL','https://us-south.ml.cloud.ibm.com')
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', None)
+TOOL_CACHE_TTL_SECONDS = float(os.getenv('TOOL_CACHE_TTL_SECONDS', '300'))
+TOOL_CACHE_MAX_ENTRIES = int(os.getenv('TOOL_CACHE_MAX_ENTRIES', '1024'))
+TOOL_CONCURRENCY = int(os.getenv('TOOL_CONCURRENCY', '8'))
+TOOL_TIMEOUT_SECONDS = float(os.getenv('TOOL_TIMEOUT_SECONDS', '20'))
+TOOL_HEDGE_ENABLED = os.getenv('TOOL_HEDGE_ENABLED', 'true').lower() == 'true'
+TOOL_HEDGE_MIN_SECONDS = float(os.getenv('TOOL_HEDGE_MIN_SECONDS', '1'))
+TOOL_BREAKER_FAILURES = int(os.getenv('TOOL_BREAKER_FAILURES', '5'))
+TOOL_BREAKER_RESET_SECONDS = float(os.getenv('TOOL_BREAKER_RESET_SECONDS', '30'))
+TOOL_THREADS = int(os.getenv('TOOL_THREADS', '16'))
+# Tracing is off unless set to console, memory (kept in process, for tests) or otlp
+OTEL_TRACES_EXPORTER = os.getenv('OTEL_TRACES_EXPORTER', 'none').lower()
+OTEL_SERVICE_NAME = os.getenv('OTEL_SERVICE_NAME', 'langgraph-external-agent')
@@ -0,0 +1,58 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+from langgraph.prebuilt import create_react_agent
+
+logger = logging.getLogger()
+
+GRAPH_CACHE_SIZE = int(os.getenv('GRAPH_CACHE_SIZE', '32'))
+
+class GraphCache:
+    """
+    LRU cache of compiled create_react_agent graphs keyed by model id and tool set.
+
+    The key also includes the identity of the model instance, so the streaming and
+    non-streaming clients get their own graphs and a graph is recompiled if the model
+    client registry hands out a new instance. Entries hold a reference to their model
+    instance, so its id cannot be reused while the entry is cached.
+    """
+
+    def __init__(self, max_size: int = GRAPH_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._graphs = OrderedDict()
+
+    def get_graph(self, model_instance, model: str, tools):
+        key = (model, id(model_instance), tuple(sorted(tool.name for tool in tools)))
+        with self._lock:
+            entry = self._graphs.get(key)
+            if entry is not None and entry[0] is model_instance:
+                self._graphs.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        logger.info(f"Compiling agent graph for model {model} and tools {key[2]}")
+        graph = create_react_agent(model_instance, tools=tools)
+        with self._lock:
+            self._graphs[key] = (model_instance, graph)
+            self._graphs.move_to_end(key)
+            while len(self._graphs) > self.max_size:
+                self._graphs.popitem(last=False)
+        return graph
+
+    def invalidate(self, model: str = None):
+        with self._lock:
+            if model is None:
+                self._graphs.clear()
+            else:
+                for key in [key for key in self._graphs if key[0] == model]:
+                    del self._graphs[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'size': len(self._graphs), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses}
+
+graph_cache = GraphCache()
@@ -1,66 +1,79 @@
-import time
 import json
-import uuid
 import traceback
 import logging
 from typing import List, Dict, Any, Optional
-from langchain_openai import ChatOpenAI
 from langchain_core.messages import HumanMessage, AIMessage, ToolMessage, SystemMessage, BaseMessage, ToolCall
-from langgraph.prebuilt import create_react_agent
-from ibm_watsonx_ai import APIClient, Credentials
-from langchain_ibm import ChatWatsonx
 from models import Message, AIToolCall, Function, ChatCompletionResponse, Choice, MessageResponse
-from config import OPENAI_API_KEY, WATSONX_SPACE_ID, WATSONX_API_KEY, WATSONX_URL, WATSONX_PROJECT_ID
-from token_utils import get_access_token
+from config import OPENAI_API_KEY, WATSONX_API_KEY
+from token_utils import aget_access_token
+from model_clients import model_clients
+from graph_cache import graph_cache
+from sse import SSEEncoder
+from coalesce import TextDelta, coalesce_deltas
+from thread_store import thread_store, thread_key, ThreadState, prefix_hashes
+from metrics import StreamMetrics, ERRORS
+from tracing import start_request_span, end_span, tracing_config
+from log_utils import Preview, sample_stream
 
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
 
-def init_openai(model: str, parm_overrides: dict = {}):
-    defaults = {
-        'temperature': 0,
-        'streaming': False
-    }
-    defaults.update(parm_overrides)
-    return ChatOpenAI(model=model, **defaults)
+MAX_MESSAGE_LENGTH = 50000
 
-def convert_messages_to_langgraph_format(messages: List[Message]) -> Dict[str, Any]:
+def _truncate(content: Optional[str]) -> Optional[str]:
+    if content and len(content) > MAX_MESSAGE_LENGTH:
+        return content[:MAX_MESSAGE_LENGTH]
+    return content
+
+def _convert_user_message(msg: Message, pending: Dict[str, None]) -> BaseMessage:
+    return HumanMessage(content=_truncate(msg.content))
+
+def _convert_system_message(msg: Message, pending: Dict[str, None]) -> BaseMessage:
+    return SystemMessage(content=_truncate(msg.content))
+
+def _convert_assistant_message(msg: Message, pending: Dict[str, None]) -> BaseMessage:
+    content = _truncate(msg.content) or ''
+    if msg.tool_calls:
+        # Convert list of AIToolCall messages to langchain ToolCall message
+        langchain_tool_calls = []
+        for tool_call in msg.tool_calls:
+            langchain_tool_calls.append(ToolCall(name=tool_call.function.name, args=tool_call.function.arguments, id=tool_call.id, type='tool'))
+            pending[tool_call.id] = None
+        return AIMessage(content=content, tool_calls=langchain_tool_calls)
+    return AIMessage(content=content)
+
+def _convert_tool_message(msg: Message, pending: Dict[str, None]) -> BaseMessage:
+    pending.pop(msg.tool_call_id, None)
+    return ToolMessage(content=_truncate(msg.content), name=None, tool_call_id=msg.tool_call_id)
+
+_ROLE_CONVERTERS = {
+    'user': _convert_user_message,
+    'human': _convert_user_message,
+    'system': _convert_system_message,
+    'assistant': _convert_assistant_message,
+    'tool': _convert_tool_message,
+}
+
+def convert_messages(messages: List[Message], pending: Dict[str, None]) -> List[BaseMessage]:
+    """
+    Converts request messages to LangChain messages in a single pass without modifying them.
+
+    Tool call ids requested by assistant messages are added to pending and removed again
+    when their tool response is seen, so pending ends up holding the unanswered calls.
+    """
     conv_messages = []
-    max_message_length = 50000
+    append = conv_messages.append
     for msg in messages:
-        if msg.content and len(msg.content) > max_message_length:
-            msg.content = msg.content[:max_message_length]
-        role = msg.role
-        logger.debug(f"Converting input message of type {role}")
-        if role.lower() == 'user' or role.lower() == 'human':
-            new_message = HumanMessage(content=msg.content)
-        if role.lower() == 'system':
-            new_message = SystemMessage(content=msg.content)
-        if role.lower() == 'assistant':
-            content = ''
-            additional_kwargs = {}
-            if msg.content:
-                content = msg.content
-            if msg.tool_calls:
-                # Convert list of AIToolCall messages to langchain ToolCall message
-                langchain_tool_calls = []
-                for index, tool_call in enumerate(msg.tool_calls):
-                    name = tool_call.function.name
-                    args = tool_call.function.arguments
-                    id = tool_call.id
-                    langchain_tool_calls.append(ToolCall(name=name, args=args, id=id, type='tool'))
+        converter = _ROLE_CONVERTERS.get(msg.role) or _ROLE_CONVERTERS.get(msg.role.lower())
+        if converter is None:
+            raise ValueError(f"Unsupported message role {msg.role}")
+        append(converter(msg, pending))
+    return conv_messages
 
-                new_message = AIMessage(content=content, tool_calls=langchain_tool_calls, additional_kwargs=additional_kwargs)
-            else:
-                new_message = AIMessage(content=content, additional_kwargs=additional_kwargs)
-        if role.lower() == 'tool':
-            tool_call_id = msg.tool_call_id
-            content = msg.content
-            name = None
-            new_message = ToolMessage(content=content, name=name, tool_call_id=tool_call_id)
-        conv_messages.append(new_message)
+def convert_messages_to_langgraph_format(messages: List[Message]) -> Dict[str, Any]:
+    pending = {}
+    conv_messages = convert_messages(messages, pending)
     return {
-        "messages": conv_messages
+        "messages": conv_messages + placeholder_tool_messages(pending)
     }
 
 def convert_response_to_messages(response: dict) -> List[Message]:
@@ -69,7 +82,7 @@ def convert_response_to_messages(response: dict) -> List[Message]:
         role = 'not found'
         if msg.type:
             role = msg.type
-        logger.info(f"Processing role {role}")
+        logger.debug("Processing role %s", role)
         tool_calls = None
         if 'tool_calls' in msg:
             tool_calls = msg['tool_calls']
@@ -124,35 +137,36 @@ def convert_response_to_messages(response: dict) -> List[Message]:
         messages.append(message)
     return messages
 
-def get_llm_sync(messages: List[Message], model: str, thread_id: str, tools):
-    logger.info(f"LLM Synchronous call using model {model} and tools {tools}")
+async def aget_llm_sync(messages: List[Message], model: str, thread_id: str, tools, trace_headers=None, caller: str = ''):
+    span = start_request_span(trace_headers, thread_id, model=model, stream=False)
+    try:
+        result = await _run_sync(messages, model, thread_id, tools, tracing_config(span, thread_id), caller)
+    except Exception as e:
+        end_span(span, e)
+        raise
+    end_span(span)
+    return result
+
+async def _run_sync(messages: List[Message], model: str, thread_id: str, tools, config: Dict[str, Any], caller: str):
+    logger.info("LLM synchronous call using model %s and tools %s", model, [tool.name for tool in tools or []])
     model_instance = None
     if 'gpt' in model:
         if not OPENAI_API_KEY:
             return "API key not set\n"
-        model_instance = init_openai(model, {})
+        model_instance = model_clients.get_chat_model(model)
     else:
-        client_model_instance = None
-        if WATSONX_SPACE_ID:
-           client_model_instance = APIClient(credentials=Credentials(url=WATSONX_URL, token=get_access_token(WATSONX_API_KEY)),
-                       space_id=WATSONX_SPACE_ID)
-        elif WATSONX_PROJECT_ID:
-            client_model_instance = APIClient(credentials=Credentials(url=WATSONX_URL, token=get_access_token(WATSONX_API_KEY)),
-                       project_id=WATSONX_PROJECT_ID)
-        else:
-            logger.error("You must either set WATSONX_SPACE_ID or WATSONX_PROJECT_ID")
-        model_instance = ChatWatsonx(model_id=model, watsonx_client=client_model_instance)
-    logger.info(f"Starting with input messages: {messages}")
-    inputs = convert_messages_to_langgraph_format(messages)
-    validate_chat_history(inputs["messages"])
-    logger.info(f"Calling langgraph with input: {inputs}")
+        token = await aget_access_token(WATSONX_API_KEY)
+        model_instance = model_clients.get_chat_model(model, token=token)
+    logger.debug("Starting with input messages: %s", Preview(messages))
+    inputs = await prepare_inputs(messages, thread_id, caller)
+    logger.debug("Calling langgraph with input: %s", Preview(inputs))
     if tools:
-       graph = create_react_agent(model_instance, tools=tools)
-       response = graph.invoke(inputs)
+       graph = graph_cache.get_graph(model_instance, model, tools)
+       response = await graph.ainvoke(inputs, config=config)
     else:
         graph = model_instance
-        response = graph.invoke(inputs['messages'])
-    logger.info(f"Response: {response}")
+        response = await graph.ainvoke(inputs['messages'], config=config)
+    logger.info("Response: %s", Preview(response))
     if hasattr(response, 'content'):
         results = response.content
         message = Message(
@@ -164,109 +178,135 @@ def get_llm_sync(messages: List[Message], model: str, thread_id: str, tools):
         results = response["messages"][-1].content
     return results, messages
 
-def format_resp(struct):
-    return "data: " + json.dumps(struct) + "\n\n"
+THINKING_STEP_DETAILS = {
+    "type": "thinking",
+    "content": "The user's question will require an internet search using a search tool."
+}
 
-def validate_chat_history(messages: List[BaseMessage]):
-    tool_call_ids = set()
-    for msg in messages:
-        if isinstance(msg, AIMessage) and msg.tool_calls:
-            for tool_call in msg.tool_calls:
-                if isinstance(tool_call, dict):
-                    tool_call_ids.add(tool_call.get('id'))
-                else:
-                    tool_call_ids.add(tool_call.id)
-
-    for msg in messages:
-        if isinstance(msg, ToolMessage):
-            if msg.tool_call_id in tool_call_ids:
-                tool_call_ids.remove(msg.tool_call_id)
-
-    for tool_call_id in tool_call_ids:
-        logger.info(f"Fixing input that had no tool response for tool_call_id {tool_call_id}")
-        placeholder_message = ToolMessage(
+def placeholder_tool_messages(pending: Dict[str, None]) -> List[ToolMessage]:
+    placeholders = []
+    for tool_call_id in pending:
+        logger.info("Fixing input that had no tool response for tool_call_id %s", tool_call_id)
+        placeholders.append(ToolMessage(
             content="Tool call failed or no response received.",
             tool_call_id=tool_call_id,
             name="unknown"
-        )
-        messages.append(placeholder_message)
+        ))
+    return placeholders
+
+def pending_tool_calls(conv_messages: List[BaseMessage]) -> Dict[str, None]:
+    """The tool call ids of converted messages that have no tool response among them."""
+    pending = {}
+    for message in conv_messages:
+        if isinstance(message, AIMessage):
+            for tool_call in message.tool_calls:
+                pending[tool_call['id']] = None
+        elif isinstance(message, ToolMessage):
+            pending.pop(message.tool_call_id, None)
+    return pending
 
-async def get_llm_stream(messages: List[Message], model: str, thread_id: str, tools):
+async def prepare_inputs(messages: List[Message], thread_id: str, caller: str = '') -> Dict[str, Any]:
+    """
+    Converts the request messages for the graph and answers unmatched tool calls with placeholders.
+
+    The conversion is kept in the thread store under the caller and thread_id, so on the next
+    turn only the messages appended since then are converted and validated. When an earlier
+    turn was edited or regenerated, the messages from that turn on are converted again.
+    """
+    store = thread_store if thread_id and messages else None
+    key = thread_key(caller, thread_id)
+    state = await store.aget(key) if store else None
+    hashes = prefix_hashes(messages) if store else []
+    start = state.common_prefix(hashes) if state is not None else 0
+    if state is None or start == 0:
+        if state is not None:
+            logger.info("History of thread %s changed, converting all messages", thread_id)
+        conv_messages, pending = [], {}
+    elif start == len(state.messages):
+        conv_messages, pending = list(state.messages), dict.fromkeys(state.pending_tool_call_ids)
+    else:
+        logger.info("History of thread %s changed after message %d, converting from there", thread_id, start)
+        conv_messages = list(state.messages[:start])
+        pending = pending_tool_calls(conv_messages)
+    logger.debug("Converting %d of %d messages for thread %s", len(messages) - start, len(messages), thread_id)
+    conv_messages.extend(convert_messages(messages[start:], pending))
+    if store and (state is None or start < len(messages) or start < len(state.messages)):
+        await store.asave(key, ThreadState(conv_messages, tuple(pending), tuple(hashes)), start)
+    return {
+        "messages": conv_messages + placeholder_tool_messages(pending)
+    }
+
+async def get_llm_stream(messages: List[Message], model: str, thread_id: str, tools, trace_headers=None, caller: str = ''):
+    if not thread_id:
+        logger.warn("Warning no thread_id specified in input")
+        thread_id = ""
+    encoder = SSEEncoder(thread_id, model)
+    stream_metrics = StreamMetrics()
+    span = start_request_span(trace_headers, thread_id, model=model, stream=True)
+    config = tracing_config(span, thread_id)
+    try:
+        async for frame in coalesce_deltas(_stream_events(messages, model, thread_id, tools, encoder, stream_metrics, config, caller), encoder.message_delta):
+            yield frame
+    finally:
+        stream_metrics.finish()
+        end_span(span)
+
+async def _stream_events(messages: List[Message], model: str, thread_id: str, tools, encoder: SSEEncoder,
+                         stream_metrics: StreamMetrics, config: Dict[str, Any], caller: str):
+    """Yields TextDelta items for assistant text and encoded SSE frames for everything else."""
     if tools:
         use_tools = True
     else:
         use_tools = False
     send_tool_events = True
-    logger.info(f"LLM Stream with tools {tools}")
+    logger.info("LLM stream using model %s and tools %s", model, [tool.name for tool in tools or []])
+    # Per-event logs are decided once per stream, so disabled streams pay a single bool check per event
+    log_events = sample_stream(logger)
     model_init_overrides = {'temperature': 0, 'streaming': True}
-    if not thread_id:
-        logger.warn("Warning no thread_id specified in input")
-        thread_id = ""
     if 'gpt' in model:
         if not OPENAI_API_KEY:
             yield "API key not set\n"
-        model_instance = init_openai(model, model_init_overrides)
+        model_instance = model_clients.get_chat_model(model, parm_overrides=model_init_overrides)
     else:
-        client_model_instance = None
-        if WATSONX_SPACE_ID:
-           client_model_instance = APIClient(credentials=Credentials(url=WATSONX_URL, token=get_access_token(WATSONX_API_KEY)),
-                       space_id=WATSONX_SPACE_ID)
-        elif WATSONX_PROJECT_ID:
-            client_model_instance = APIClient(credentials=Credentials(url=WATSONX_URL, token=get_access_token(WATSONX_API_KEY)),
-                       project_id=WATSONX_PROJECT_ID)
-        else:
-            logger.error("You must either set WATSONX_SPACE_ID or WATSONX_PROJECT_ID")
-        model_instance = ChatWatsonx(model_id=model, watsonx_client=client_model_instance)
+        token = await aget_access_token(WATSONX_API_KEY)
+        model_instance = model_clients.get_chat_model(model, token=token)
     if use_tools:
-        graph = create_react_agent(model_instance, tools=tools)
+        graph = graph_cache.get_graph(model_instance, model, tools)
     else:
-        graph = create_react_agent(model_instance, tools=[])
+        graph = graph_cache.get_graph(model_instance, model, [])
     inputs = ""
-    accumulated_contents = ""
+    accumulated_contents = []
     try:
-        inputs = convert_messages_to_langgraph_format(messages)
-        validate_chat_history(inputs["messages"])
-        async for event in graph.astream_events(inputs, version="v2"):
+        inputs = await prepare_inputs(messages, thread_id, caller)
+        async for event in graph.astream_events(inputs, version="v2", config=config):
             kind = event["event"]
-            logger.debug(f"event = {event}")
+            if log_events:
+                logger.debug("event = %s", Preview(event))
             if kind == "on_chat_model_stream":
                 content = event["data"]["chunk"].content
                 if content:
                     if isinstance(content, str):
-                        current_timestamp = int(time.time())
-                        struct = {
-                            "id": str(uuid.uuid4()),
-                            "object": "thread.message.delta",
-                            "created": current_timestamp,
-                            "thread_id": thread_id,
-                            "model": model,
-                            "choices": [
-                                {
-                                    "delta": {
-                                        "content": content,
-                                        "role": "assistant",
-                                    }
-                                }
-                            ],
-                        }
-                        event_content = format_resp(struct)
-                        logger.debug("Sending event content: " + event_content)
-                        accumulated_contents += content
-                        yield event_content
+                        if log_events:
+                            logger.debug("Sending content delta: %s", content)
+                        accumulated_contents.append(content)
+                        stream_metrics.token()
+                        yield TextDelta(content)
                     elif isinstance(content, list):
                         for item in content:
                             if 'type' in item:
                                 if item['type'] == 'text':
+                                    stream_metrics.token()
                                     yield item['text']
                                 elif item['type'] == 'tool_use':
-                                    logger.debug("tool_use")
-                                    logger.debug(f"{str(item)}")
-                                else:
-                                    logger.debug("Received item of type " + item['type'])
+                                    if log_events:
+                                        logger.debug("tool_use %s", Preview(item))
+                                elif log_events:
+                                    logger.debug("Received item of type %s", item['type'])
             elif kind == "on_tool_start":
-                printmsg =  f"Starting tool: {event['name']} with inputs: {event['data'].get('input')} run_id: {event['run_id']}"
-                logger.debug(printmsg)
-                current_timestamp = int(time.time())
+                logger.info("Starting tool %s run_id: %s", event['name'], event['run_id'])
+                if log_events:
+                    logger.debug("Tool %s inputs: %s", event['name'], Preview(event['data'].get('input')))
+                stream_metrics.tool_start(event['run_id'])
                 step_details = {
                     "type": "tool_calls",
                     "tool_calls": [
@@ -277,100 +317,47 @@ async def get_llm_stream(messages: List[Message], model: str, thread_id: str, to
                         }
                     ]
                 }
-                struct = {
-                            "id": str(uuid.uuid4()),
-                            "object": "thread.run.step.delta",
-                            "thread_id": thread_id,
-                            "model": model,
-                            "created": current_timestamp,
-                            "choices": [
-                                {
-                                    "delta": {
-                                        "role": "assistant",
-                                        "step_details": step_details
-                                    }
-                                }
-                            ],
-                         }
-                thinking_step_details = {
-                    "type": "thinking",
-                    "content": "The user's question will require an internet search using a search tool."
-                }
-                thinking_struct = {
-                    "id": str(uuid.uuid4()),
-                    "object": "thread.run.step.delta",
-                    "thread_id": thread_id,
-                    "model": model,
-                    "created": current_timestamp,
-                    "choices": [
-                        {
-                            "delta": {
-                                "role": "assistant",
-                                "step_details": thinking_step_details
-                            }
-                        }
-                    ]
-                }
-                thinking_event_content = format_resp(thinking_struct)
-                logger.info("Sending thinking event content: " + thinking_event_content)
+                thinking_event_content = encoder.step_delta(THINKING_STEP_DETAILS)
+                if log_events:
+                    logger.debug("Sending thinking event content: %s", thinking_event_content)
                 if send_tool_events:
                     yield thinking_event_content
-                event_content = format_resp(struct)
-                logger.info("Sending tool call event content: " + event_content)
+                event_content = encoder.step_delta(step_details)
+                if log_events:
+                    logger.debug("Sending tool call event content: %s", Preview(event_content))
                 if send_tool_events:
                     yield event_content
             elif kind == "on_tool_end": 
                 tool_name = event.get('name', '')
-                logger.info(f"Event on_tool_end for tool: {tool_name}")
+                logger.info("Event on_tool_end for tool: %s", tool_name)
+                stream_metrics.tool_end(event['run_id'], tool_name)
                 output = event.get('data', {}).get('output', {})
                 content = ''
                 if output and output.content:
                     content = output.content
                 run_id = event['run_id']      
-                logger.info(f"Tool output for run {run_id} was: {content}")
-                tool_call_id = ''
-                if output and output.tool_call_id:
-                    tool_call_id = output.tool_call_id
+                logger.info("Tool output for run %s was: %s", run_id, Preview(content))
                 tool_call_id = run_id #Better matches tool response with tool request
-                current_timestamp = int(time.time())
                 step_details = {
                     "type": "tool_response",
                     "name": event['name'],
                     "tool_call_id": tool_call_id,
                     "content": content
                 }
-                struct = {
-                            "id": str(uuid.uuid4()),
-                            "object": "thread.run.step.delta",
-                            "thread_id": thread_id,
-                            "model": model,
-                            "created": current_timestamp,
-                            "choices": [
-                                {
-                                    "delta": {
-                                        "role": "assistant",
-                                        "step_details": step_details
-                                    }
-                                }
-                            ],
-                         }
-                event_content = format_resp(struct)
-                logger.info("Sending tool response event content: " + event_content)
+                event_content = encoder.step_delta(step_details)
+                if log_events:
+                    logger.debug("Sending tool response event content: %s", Preview(event_content))
                 if send_tool_events:
                     yield event_content
-            elif kind == "on_chat_model_start": 
-                logger.debug(f"Received event type: on_chat_model_start")
-            elif kind == "on_chat_model_end": 
-                logger.debug(f"Received event type: on_chat_model_end")
-            else:
-                logger.debug("Received event type: " + kind)
-            yield ""
+            elif log_events:
+                logger.debug("Received event type: %s", kind)
 
         if accumulated_contents:
-            logger.info("Final streamed content:\n" + accumulated_contents)
+            logger.info("Final streamed content:\n%s", Preview(lambda: ''.join(accumulated_contents)))
 
     except Exception as e:
+        ERRORS.labels('stream').inc()
         logger.error(f"Exception {str(e)}")
         traceback.print_exc()
-        logger.error(f"Exception was with inputs {str(inputs)}")
+        logger.error("Exception was with inputs %s", Preview(inputs))
         yield f"Error: {str(e)}\n"
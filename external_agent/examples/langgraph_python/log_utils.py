@@ -0,0 +1,65 @@
+import os
+import time
+import random
+import logging
+from sse import dumps
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# text (the original human readable lines) or json (one JSON object per line)
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()
+# Payloads such as requests, events and tool outputs are cut to this many characters in the logs
+LOG_PAYLOAD_MAX_CHARS = int(os.getenv('LOG_PAYLOAD_MAX_CHARS', '500'))
+# Fraction of streams whose individual events and frames are logged when the level is DEBUG
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '1.0'))
+
+class Preview:
+    """
+    Size-capped log argument that is only rendered if the record is emitted.
+
+    value may be a callable, which is then not even called for disabled levels. Use it as a
+    %s argument: logger.debug("event = %s", Preview(event)).
+    """
+    __slots__ = ('value', 'limit')
+
+    def __init__(self, value, limit: int = None):
+        self.value = value
+        self.limit = LOG_PAYLOAD_MAX_CHARS if limit is None else limit
+
+    def __str__(self):
+        value = self.value() if callable(self.value) else self.value
+        text = value if isinstance(value, str) else repr(value)
+        if len(text) > self.limit:
+            return f"{text[:self.limit]}... ({len(text)} chars)"
+        return text
+
+def sample_stream(logger: logging.Logger) -> bool:
+    """Decides once per stream whether its per-event debug logs are written."""
+    return logger.isEnabledFor(logging.DEBUG) and (LOG_SAMPLE_RATE >= 1 or random.random() < LOG_SAMPLE_RATE)
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as single-line JSON with time, level, logger, message and any extra= fields."""
+    RESERVED = frozenset(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {'message', 'asctime'}
+
+    def format(self, record):
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in self.RESERVED:
+                entry[key] = value if isinstance(value, (str, int, float, bool, type(None))) else str(value)
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return dumps(entry)
+
+def configure_logging():
+    logger = logging.getLogger()
+    logger.setLevel(LOG_LEVEL)
+    console_handler = logging.StreamHandler()
+    if LOG_FORMAT == 'json':
+        console_handler.setFormatter(JsonFormatter())
+    else:
+        console_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    logger.addHandler(console_handler)
@@ -0,0 +1,50 @@
+import time
+from prometheus_client import Counter, Gauge, Histogram
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+REQUEST_LATENCY = Histogram('chat_request_latency_seconds', 'Duration of /chat/completions requests',
+                            ['mode'], buckets=LATENCY_BUCKETS)
+TIME_TO_FIRST_TOKEN = Histogram('chat_time_to_first_token_seconds', 'Time from request start to the first streamed content delta',
+                                buckets=LATENCY_BUCKETS)
+TOKENS_PER_SECOND = Histogram('chat_stream_tokens_per_second', 'Streamed content deltas per second after the first one',
+                              buckets=(1, 5, 10, 20, 50, 100, 200, 500, 1000))
+TOOL_LATENCY = Histogram('chat_tool_latency_seconds', 'Duration of tool calls from on_tool_start to on_tool_end',
+                         ['tool'], buckets=LATENCY_BUCKETS)
+IAM_TOKEN_FETCH = Histogram('iam_token_fetch_seconds', 'Duration of IAM token requests', buckets=LATENCY_BUCKETS)
+CLIENT_CONSTRUCTION = Histogram('model_client_construction_seconds', 'Time spent constructing model clients',
+                                ['provider'], buckets=LATENCY_BUCKETS)
+ACTIVE_STREAMS = Gauge('chat_active_streams', 'Streaming responses currently in progress')
+ERRORS = Counter('chat_errors_total', 'Errors while serving /chat/completions', ['stage'])
+ADMISSION_REJECTIONS = Counter('admission_rejections_total', 'Requests rejected with 429 by admission control', ['reason'])
+
+class StreamMetrics:
+    """Records the latency, time to first token and token rate of one streamed response."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.first_token_at = None
+        self.tokens = 0
+        self._tools = {}
+        ACTIVE_STREAMS.inc()
+
+    def token(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+            TIME_TO_FIRST_TOKEN.observe(self.first_token_at - self.start)
+        self.tokens += 1
+
+    def tool_start(self, run_id):
+        self._tools[run_id] = time.perf_counter()
+
+    def tool_end(self, run_id, name: str):
+        started = self._tools.pop(run_id, None)
+        if started is not None:
+            TOOL_LATENCY.labels(name).observe(time.perf_counter() - started)
+
+    def finish(self):
+        end = time.perf_counter()
+        ACTIVE_STREAMS.dec()
+        REQUEST_LATENCY.labels('stream').observe(end - self.start)
+        if self.tokens > 1 and end > self.first_token_at:
+            TOKENS_PER_SECOND.observe((self.tokens - 1) / (end - self.first_token_at))
@@ -0,0 +1,80 @@
+import logging
+import threading
+from langchain_openai import ChatOpenAI
+from ibm_watsonx_ai import APIClient, Credentials
+from langchain_ibm import ChatWatsonx
+from config import WATSONX_SPACE_ID, WATSONX_URL, WATSONX_PROJECT_ID
+from metrics import CLIENT_CONSTRUCTION
+
+logger = logging.getLogger()
+
+def init_openai(model: str, parm_overrides: dict = {}):
+    defaults = {
+        'temperature': 0,
+        'streaming': False
+    }
+    defaults.update(parm_overrides)
+    return ChatOpenAI(model=model, **defaults)
+
+class ModelClientRegistry:
+    """
+    Shares chat model instances, and the watsonx APIClient behind them, across requests so
+    that HTTP sessions and connection pools are reused instead of rebuilt per request.
+
+    Models are keyed by (provider, model, space_id, project_id, params). When the IAM token
+    rotates the shared APIClient gets the new token in place, which keeps its connection pool.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._api_clients = {}
+        self._models = {}
+
+    def get_api_client(self, token: str) -> APIClient:
+        key = (WATSONX_URL, WATSONX_SPACE_ID, WATSONX_PROJECT_ID)
+        with self._lock:
+            client = self._api_clients.get(key)
+            if client is None:
+                credentials = Credentials(url=WATSONX_URL, token=token)
+                if not WATSONX_SPACE_ID and not WATSONX_PROJECT_ID:
+                    logger.error("You must either set WATSONX_SPACE_ID or WATSONX_PROJECT_ID")
+                    return None
+                with CLIENT_CONSTRUCTION.labels('watsonx_api_client').time():
+                    if WATSONX_SPACE_ID:
+                        client = APIClient(credentials=credentials, space_id=WATSONX_SPACE_ID)
+                    else:
+                        client = APIClient(credentials=credentials, project_id=WATSONX_PROJECT_ID)
+                self._api_clients[key] = client
+            elif client.credentials.token != token:
+                logger.info("IAM token rotated, updating shared watsonx client")
+                client.set_token(token)
+            return client
+
+    def get_chat_model(self, model: str, token: str = None, parm_overrides: dict = {}):
+        if 'gpt' in model:
+            key = ('openai', model, None, None, tuple(sorted(parm_overrides.items())))
+        else:
+            # ChatWatsonx ignores the OpenAI streaming overrides, one instance serves both paths
+            key = ('watsonx', model, WATSONX_SPACE_ID, WATSONX_PROJECT_ID, ())
+            api_client = self.get_api_client(token)
+        model_instance = self._models.get(key)
+        if model_instance is not None:
+            return model_instance
+        with self._lock:
+            model_instance = self._models.get(key)
+            if model_instance is None:
+                logger.info(f"Creating model client for {key}")
+                with CLIENT_CONSTRUCTION.labels(key[0]).time():
+                    if key[0] == 'openai':
+                        model_instance = init_openai(model, parm_overrides)
+                    else:
+                        model_instance = ChatWatsonx(model_id=model, watsonx_client=api_client)
+                self._models[key] = model_instance
+        return model_instance
+
+    def invalidate(self):
+        with self._lock:
+            self._api_clients.clear()
+            self._models.clear()
+
+model_clients = ModelClientRegistry()
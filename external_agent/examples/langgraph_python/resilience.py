@@ -0,0 +1,233 @@
+# Kept identical in every example that uses it, see SHARED_MODULES in external_agent/examples/shared_modules.py
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger()
+
+
+class DegradedResult(str):
+    """Result returned instead of calling an unavailable tool. It is never stored in the tool cache."""
+
+    cacheable = False
+
+
+def default_degraded_result(name: str, reason: str):
+    return DegradedResult(
+        f"The {name} tool is temporarily unavailable ({reason}). Answer without it."
+    )
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures and rejects calls for reset_seconds.
+    After that a single trial call is let through (half open). It closes the breaker on
+    success and opens it again on failure.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if (
+                self.state == self.OPEN
+                and time.monotonic() - self._opened_at >= self.reset_seconds
+            ):
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def release_trial(self):
+        """Lets the next call be the trial when the trial call ended without an outcome, e.g. it was cancelled."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if (
+                self.state == self.HALF_OPEN
+                or self.consecutive_failures >= self.failure_threshold
+            ):
+                if self.state != self.OPEN:
+                    logger.warning(
+                        f"Circuit breaker opened after {self.consecutive_failures} consecutive failures"
+                    )
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class ResilientTool:
+    """
+    Wraps calls to one external tool with a deadline, hedging and a circuit breaker.
+
+    Once enough latencies have been observed, a second identical request is started if the
+    first one has not finished by the p95 latency (but never earlier than hedge_min_seconds).
+    The first successful response wins. Calls that fail or miss the deadline count against
+    the circuit breaker. While it is open, calls return a degraded result at once.
+
+    Attempts run on max_threads threads owned by this tool. A thread stays busy until its
+    attempt returns, also when the call already gave up on it, so a hanging upstream cannot
+    take threads from other tools. When all threads are busy, calls return a degraded result
+    and hedges are skipped.
+    """
+
+    MIN_SAMPLES = 20
+    COUNTERS = (
+        "calls",
+        "successes",
+        "failures",
+        "timeouts",
+        "hedges",
+        "hedge_wins",
+        "rejected",
+        "pool_full",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        timeout: float,
+        hedge: bool = True,
+        hedge_min_seconds: float = 1.0,
+        failure_threshold: int = 5,
+        reset_seconds: float = 30.0,
+        max_threads: int = 16,
+        degraded_result=default_degraded_result,
+    ):
+        self.name = name
+        self.timeout = timeout
+        self.hedge = hedge
+        self.hedge_min_seconds = hedge_min_seconds
+        self.max_threads = max_threads
+        self.degraded_result = degraded_result
+        self.breaker = CircuitBreaker(failure_threshold, reset_seconds)
+        self.latencies = deque(maxlen=200)
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_threads, thread_name_prefix=f"tool-{name}"
+        )
+        self._running = 0
+        self._running_lock = threading.Lock()
+
+    def p95(self):
+        if len(self.latencies) < self.MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+    def _start(self, func, *args):
+        """Starts func(*args) on a thread of this tool, or returns None when they are all busy."""
+        with self._running_lock:
+            if self._running >= self.max_threads:
+                return None
+            self._running += 1
+        future = self._executor.submit(contextvars.copy_context().run, func, *args)
+        future.add_done_callback(self._finished)
+        return asyncio.wrap_future(future)
+
+    def _finished(self, future):
+        with self._running_lock:
+            self._running -= 1
+
+    async def call(self, func, *args):
+        """Runs the blocking func(*args) on the threads of this tool. Abandoned attempts finish in the background."""
+        self.counters["calls"] += 1
+        if not self.breaker.allow():
+            self.counters["rejected"] += 1
+            return self.degraded_result(self.name, "circuit open")
+        trial = self.breaker.state == CircuitBreaker.HALF_OPEN
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        deadline = start + self.timeout
+        p95 = self.p95() if self.hedge else None
+        hedge_at = start + max(p95, self.hedge_min_seconds) if p95 is not None else None
+        first = self._start(func, *args)
+        if first is None:
+            if trial:
+                self.breaker.release_trial()
+            self.counters["pool_full"] += 1
+            logger.warning(f"Tool {self.name} has all {self.max_threads} threads busy")
+            return self.degraded_result(self.name, "too many calls in progress")
+        pending = {first}
+        error = None
+        try:
+            while pending:
+                now = loop.time()
+                if now >= deadline:
+                    break
+                wake_at = min(deadline, hedge_at) if hedge_at is not None else deadline
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=max(0, wake_at - now),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for task in done:
+                    if task.exception() is None:
+                        self.latencies.append(loop.time() - start)
+                        self.breaker.record_success()
+                        self.counters["successes"] += 1
+                        if task is not first:
+                            self.counters["hedge_wins"] += 1
+                        return task.result()
+                    error = task.exception()
+                if hedge_at is not None and loop.time() >= hedge_at and pending:
+                    hedged = self._start(func, *args)
+                    if hedged is not None:
+                        logger.info(
+                            f"Hedging {self.name} call after {hedge_at - start:.2f} seconds"
+                        )
+                        self.counters["hedges"] += 1
+                        pending.add(hedged)
+                    hedge_at = None
+        except asyncio.CancelledError:
+            # The caller went away, which says nothing about the tool, so the breaker state is kept
+            if trial:
+                self.breaker.release_trial()
+            raise
+        finally:
+            for task in pending:
+                task.cancel()
+        self.breaker.record_failure()
+        if error is not None and not pending:
+            self.counters["failures"] += 1
+            logger.warning(f"Tool {self.name} failed: {str(error)}")
+            return self.degraded_result(self.name, "request failed")
+        self.counters["timeouts"] += 1
+        logger.warning(f"Tool {self.name} timed out after {self.timeout} seconds")
+        return self.degraded_result(
+            self.name, f"no response within {self.timeout} seconds"
+        )
+
+    def stats(self) -> dict:
+        return dict(
+            self.counters,
+            state=self.breaker.state,
+            p95_seconds=self.p95(),
+            threads_busy=self._running,
+        )
@@ -0,0 +1,244 @@
+# Kept identical in every example that uses it, see SHARED_MODULES in external_agent/examples/shared_modules.py
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import importlib
+from collections import OrderedDict
+from typing import Optional
+import pydantic_core
+
+logger = logging.getLogger()
+
+# Non-streaming answers are cached for this many seconds. 0 (the default) disables the cache.
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "0"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+RESPONSE_CACHE_MAX_BYTES = int(
+    os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024))
+)
+# user keeps the answers of each verified subject or credential apart, global shares them between all callers
+RESPONSE_CACHE_SCOPE = os.getenv("RESPONSE_CACHE_SCOPE", "user")
+# module:Class of a SimilarityTier consulted after an exact miss, empty for exact matches only
+RESPONSE_CACHE_SIMILARITY = os.getenv("RESPONSE_CACHE_SIMILARITY", "")
+
+
+def _digest(value) -> str:
+    canonical = json.dumps(
+        value, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def request_key(namespace: str, messages) -> str:
+    # pydantic_core serializes the messages in field order without building dicts first, which keeps a hit cheap
+    digest = hashlib.sha256(namespace.encode("utf-8"))
+    digest.update(pydantic_core.to_json(messages, exclude_none=True))
+    return digest.hexdigest()
+
+
+def cache_directives(cache_control: Optional[str]) -> set:
+    """The directive names of a Cache-Control request header, e.g. {'no-cache'}."""
+    if not cache_control:
+        return set()
+    return {
+        directive.split("=", 1)[0].strip().lower()
+        for directive in cache_control.split(",")
+    }
+
+
+class SimilarityTier:
+    """
+    Finds the cached answer of an earlier request that is close to, but not the same as, this one.
+
+    Select an implementation with RESPONSE_CACHE_SIMILARITY=module:Class, it is constructed without
+    arguments. A typical one embeds the last user message, keeps a vector index per namespace
+    (scope, model and tools) and returns the key of the nearest earlier request above a similarity
+    threshold. It is only asked after an exact miss, and a returned key that has expired counts as a miss.
+    """
+
+    async def lookup(self, namespace: str, messages: list) -> Optional[str]:
+        return None
+
+    async def add(self, namespace: str, messages: list, key: str):
+        pass
+
+
+class ResponseCache:
+    """
+    Answers of non-streaming requests by a canonical hash of (scope, model, tools, messages).
+
+    Entries expire ttl_seconds after they were stored and the least recently used ones are dropped
+    beyond max_entries or max_bytes. Identical requests that arrive while the first one is still
+    running wait for its answer instead of starting another run. Failed runs are not cached.
+    A Cache-Control: no-cache request header skips the lookup but stores the new answer, no-store
+    skips the cache entirely. All state is only touched from the event loop.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float = RESPONSE_CACHE_TTL_SECONDS,
+        max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+        max_bytes: int = RESPONSE_CACHE_MAX_BYTES,
+        similarity: Optional[SimilarityTier] = None,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.similarity = similarity
+        self.bytes = 0
+        # key -> (expires_at, content, size)
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self.counters = {
+            "hits": 0,
+            "similar_hits": 0,
+            "coalesced": 0,
+            "misses": 0,
+            "refreshes": 0,
+            "bypasses": 0,
+            "evictions": 0,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0
+
+    def _get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, content, size = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.bytes -= size
+            return None
+        self._entries.move_to_end(key)
+        return content
+
+    def _put(self, key: str, content: str):
+        size = len(content.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.bytes -= previous[2]
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, content, size)
+        self.bytes += size
+        while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+            _, (_, _, evicted_size) = self._entries.popitem(last=False)
+            self.bytes -= evicted_size
+            self.counters["evictions"] += 1
+
+    async def get_or_compute(
+        self,
+        scope: str,
+        model: str,
+        tools,
+        messages,
+        compute,
+        cache_control: Optional[str] = None,
+        lease=None,
+    ):
+        """
+        Returns (content, status) where status is hit, similar, coalesced, miss, refresh or bypass,
+        or None when the cache is disabled. compute is an async function returning the answer text.
+
+        lease, the admission lease of the request, is released when this call returns, except on a
+        miss: then the computation keeps it until it finishes, because it goes on for the requests
+        coalesced onto it when this one is cancelled.
+        """
+        try:
+            if not self.enabled:
+                return await compute(), None
+            directives = cache_directives(cache_control)
+            if "no-store" in directives:
+                self.counters["bypasses"] += 1
+                return await compute(), "bypass"
+            namespace = _digest(
+                {"scope": scope, "model": model, "tools": sorted(tools)}
+            )
+            key = request_key(namespace, messages)
+            payload = (
+                [message.model_dump(exclude_none=True) for message in messages]
+                if self.similarity
+                else None
+            )
+            if "no-cache" in directives:
+                self.counters["refreshes"] += 1
+                return (
+                    await self._compute_and_store(compute, key, namespace, payload),
+                    "refresh",
+                )
+            content = self._get(key)
+            if content is not None:
+                self.counters["hits"] += 1
+                return content, "hit"
+            if key not in self._in_flight and self.similarity is not None:
+                content = await self._similar(namespace, payload)
+                if content is not None:
+                    self.counters["similar_hits"] += 1
+                    return content, "similar"
+            task = self._in_flight.get(key)
+            if task is not None:
+                self.counters["coalesced"] += 1
+                return await asyncio.shield(task), "coalesced"
+            self.counters["misses"] += 1
+            task = self._in_flight[key] = asyncio.ensure_future(
+                self._compute_and_store(compute, key, namespace, payload)
+            )
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+            if lease is not None:
+                held, lease = lease, None
+                task.add_done_callback(lambda _: held.release())
+            # Shielded, so the requests waiting for this answer still get it if the first client goes away
+            return await asyncio.shield(task), "miss"
+        finally:
+            if lease is not None:
+                lease.release()
+
+    async def _similar(self, namespace: str, payload: list) -> Optional[str]:
+        try:
+            key = await self.similarity.lookup(namespace, payload)
+        except Exception as e:
+            logger.warning(f"Response cache similarity lookup failed: {str(e)}")
+            return None
+        return self._get(key) if key else None
+
+    async def _compute_and_store(
+        self, compute, key: str, namespace: str, payload: list
+    ) -> str:
+        content = await compute()
+        if isinstance(content, str) and content:
+            self._put(key, content)
+            if self.similarity is not None:
+                try:
+                    await self.similarity.add(namespace, payload, key)
+                except Exception as e:
+                    logger.warning(f"Response cache similarity add failed: {str(e)}")
+        return content
+
+    def stats(self) -> dict:
+        return dict(
+            self.counters,
+            size=len(self._entries),
+            bytes=self.bytes,
+            in_flight=len(self._in_flight),
+        )
+
+
+def cache_scope(admission_key: str) -> str:
+    """The partition of the cache a caller (identified like for admission control) may read from."""
+    return "global" if RESPONSE_CACHE_SCOPE == "global" else admission_key
+
+
+def create_response_cache() -> ResponseCache:
+    similarity = None
+    if RESPONSE_CACHE_SIMILARITY:
+        module_name, class_name = RESPONSE_CACHE_SIMILARITY.split(":", 1)
+        similarity = getattr(importlib.import_module(module_name), class_name)()
+    return ResponseCache(similarity=similarity)
+
+
+response_cache = create_response_cache()
@@ -1,8 +1,9 @@
-from fastapi import Depends
+from fastapi import Depends, HTTPException
 from typing import Optional, Dict, Any
 from fastapi.security import APIKeyHeader, HTTPBearer, HTTPAuthorizationCredentials
+from auth import credential_verifier, InvalidCredentials, CredentialsUnavailable
 
-#This example allows any bearer or api keys to be valid
+#This example allows any bearer or api keys to be valid unless AUTH_MODE is set, see auth.py
 api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
 http_bearer = HTTPBearer(auto_error=False)
 
@@ -16,4 +17,10 @@ async def get_current_user(
     api_key: Optional[str] = Depends(get_api_key),
     token: Optional[str] = Depends(get_bearer_token)
 ) -> Dict[str, Any]:
-    return {"api_key": api_key, "token": token}
+    try:
+        claims = await credential_verifier.verify(api_key, token)
+    except InvalidCredentials as e:
+        raise HTTPException(status_code=401, detail=str(e), headers={"WWW-Authenticate": "Bearer"})
+    except CredentialsUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"api_key": api_key, "token": token, "claims": claims}
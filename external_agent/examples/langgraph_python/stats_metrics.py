@@ -0,0 +1,58 @@
+# Kept identical in every example that uses it, see SHARED_MODULES in external_agent/examples/shared_modules.py
+from prometheus_client import REGISTRY
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+
+class StatsCollector:
+    """
+    Exposes the stats() dicts of in-process components (caches, limiters, breakers) as Prometheus metrics.
+
+    stats_fn returns {name: number} or, when label is set, {label_value: {name: number}}.
+    The names listed in counters only ever grow and are exported as counters ({prefix}_{name}_total),
+    everything else is a gauge. String values such as a breaker state become a gauge of 1 with the
+    value as a label.
+    """
+
+    def __init__(self, prefix: str, stats_fn, label: str = None, counters=()):
+        self.prefix = prefix
+        self.stats_fn = stats_fn
+        self.label = label
+        self.counters = frozenset(counters)
+
+    def describe(self):
+        # Metric names depend on the stats at collection time, so they are not declared up front
+        return []
+
+    def collect(self):
+        stats = self.stats_fn()
+        groups = stats.items() if self.label else [(None, stats)]
+        families = {}
+        for label_value, values in groups:
+            for key, value in values.items():
+                if value is None:
+                    continue
+                labels = [self.label] if self.label else []
+                label_values = [label_value] if self.label else []
+                if isinstance(value, str):
+                    labels, label_values, value = (
+                        labels + [key],
+                        label_values + [value],
+                        1,
+                    )
+                name = f"{self.prefix}_{key}"
+                family = families.get(name)
+                if family is None:
+                    metric_family = (
+                        CounterMetricFamily
+                        if key in self.counters
+                        else GaugeMetricFamily
+                    )
+                    family = families[name] = metric_family(
+                        name, f"{self.prefix} {key}", labels=labels
+                    )
+                family.add_metric(label_values, value)
+        return list(families.values())
+
+
+def register_stats(prefix: str, stats_fn, label: str = None, counters=()):
+    REGISTRY.register(StatsCollector(prefix, stats_fn, label, counters))
@@ -0,0 +1,50 @@
+"""
+Checks of CredentialVerifier with AUTH_MODE=jwt against a JWKS endpoint that is down at first:
+
+    python3 -m pytest test_auth.py
+"""
+import json
+import asyncio
+import jwt
+import requests
+from cryptography.hazmat.primitives.asymmetric import rsa
+import auth
+from auth import CredentialVerifier, CredentialsUnavailable
+
+class FlakyJwks:
+    """Stands in for the requests session of JwksCache, the first fetch fails."""
+
+    def __init__(self, jwks: dict):
+        self.jwks = jwks
+        self.calls = 0
+
+    def get(self, url, timeout=None):
+        self.calls += 1
+        if self.calls == 1:
+            raise requests.ConnectionError("JWKS endpoint unreachable")
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps(self.jwks).encode('utf-8')
+        return response
+
+def test_token_is_accepted_once_the_jwks_fetch_recovers(monkeypatch):
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    public_jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key()))
+    token = jwt.encode({'sub': 'alice'}, private_key, algorithm='RS256', headers={'kid': 'key-1'})
+    monkeypatch.setattr(auth, 'AUTH_JWKS_URL', 'https://issuer.example/jwks')
+    verifier = CredentialVerifier('jwt')
+    verifier._jwks.retry_seconds = 0
+    verifier._jwks._session = FlakyJwks({'keys': [dict(public_jwk, kid='key-1')]})
+
+    async def scenario():
+        try:
+            await verifier.verify(None, token)
+            raise AssertionError("the token was accepted without signing keys")
+        except CredentialsUnavailable:
+            pass
+        # Not negative cached, the same token is checked again and the keys are fetched now
+        claims = await verifier.verify(None, token)
+        assert claims['sub'] == 'alice'
+
+    asyncio.run(scenario())
+    assert verifier.counters['rejections'] == 0
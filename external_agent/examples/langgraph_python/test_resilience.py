@@ -0,0 +1,54 @@
+"""
+Checks of the circuit breaker and thread pool of ResilientTool that need no upstream service:
+
+    python3 -m pytest test_resilience.py
+"""
+import time
+import asyncio
+import threading
+from resilience import CircuitBreaker, ResilientTool, DegradedResult
+
+def failing():
+    raise RuntimeError("upstream down")
+
+def test_cancelled_trial_lets_the_next_call_through():
+    async def scenario():
+        tool = ResilientTool('search', timeout=5, hedge=False, failure_threshold=1, reset_seconds=0)
+        assert isinstance(await tool.call(failing), DegradedResult)
+        assert tool.breaker.state == CircuitBreaker.OPEN
+        release = threading.Event()
+        trial = asyncio.ensure_future(tool.call(release.wait))
+        await asyncio.sleep(0.05)
+        assert tool.breaker.state == CircuitBreaker.HALF_OPEN
+        trial.cancel()
+        try:
+            await trial
+        except asyncio.CancelledError:
+            pass
+        release.set()
+        assert await tool.call(lambda: 'ok') == 'ok'
+        assert tool.breaker.state == CircuitBreaker.CLOSED
+
+    asyncio.run(scenario())
+
+def test_abandoned_attempts_keep_their_thread_until_done():
+    async def scenario():
+        tool = ResilientTool('search', timeout=0.05, hedge=False, failure_threshold=10, max_threads=2)
+        release = threading.Event()
+        for _ in range(2):
+            assert isinstance(await tool.call(release.wait), DegradedResult)
+        assert tool.stats()['threads_busy'] == 2
+        assert isinstance(await tool.call(lambda: 'ok'), DegradedResult)
+        assert tool.counters['pool_full'] == 1
+        release.set()
+        deadline = time.monotonic() + 5
+        while tool.stats()['threads_busy'] and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        assert await tool.call(lambda: 'ok') == 'ok'
+
+    asyncio.run(scenario())
+
+if __name__ == '__main__':
+    test_cancelled_trial_lets_the_next_call_through()
+    test_abandoned_attempts_keep_their_thread_until_done()
+    print("ok")
@@ -0,0 +1,181 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional, Tuple
+from langchain_core.messages import BaseMessage, messages_from_dict, messages_to_dict
+from models import Message
+
+logger = logging.getLogger()
+
+# memory keeps threads in a per-worker LRU, sqlite persists them to THREAD_STORE_PATH, none disables the store
+THREAD_STORE = os.getenv('THREAD_STORE', 'memory')
+THREAD_STORE_PATH = os.getenv('THREAD_STORE_PATH', './thread_store.sqlite')
+THREAD_STORE_MAX_THREADS = int(os.getenv('THREAD_STORE_MAX_THREADS', '1000'))
+THREAD_STORE_TTL_SECONDS = int(os.getenv('THREAD_STORE_TTL_SECONDS', '3600'))
+
+def thread_key(caller: str, thread_id: str) -> str:
+    """Threads are stored per caller, so two callers that reuse a thread_id never share history."""
+    return caller + '|' + thread_id
+
+def prefix_hashes(messages: List[Message]) -> List[str]:
+    """
+    Rolling hashes of the messages, each one over the message and all messages before it, so
+    two histories with the same hash at some position agree on every message up to there.
+    """
+    hashes = []
+    running = hashlib.blake2b(digest_size=16)
+    for message in messages:
+        running.update(message.model_dump_json().encode('utf-8'))
+        hashes.append(running.copy().hexdigest())
+    return hashes
+
+class ThreadState(NamedTuple):
+    """
+    The converted LangChain messages for a thread, one per request message, along with the
+    tool call ids that have no tool response yet and the rolling hash of every request
+    message they were converted from (see prefix_hashes).
+    """
+    messages: List[BaseMessage]
+    pending_tool_call_ids: Tuple[str, ...]
+    hashes: Tuple[str, ...]
+
+    def common_prefix(self, hashes: List[str]) -> int:
+        """
+        Returns how many leading request messages, given their prefix_hashes, are unchanged
+        since this state was built. Every message of that prefix is compared, so an edited or
+        regenerated turn anywhere in the history is detected. Because the hashes are rolling,
+        the first difference is found with a binary search.
+        """
+        low, high = 0, min(len(self.hashes), len(hashes))
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.hashes[middle - 1] == hashes[middle - 1]:
+                low = middle
+            else:
+                high = middle - 1
+        return low
+
+class InMemoryThreadStore:
+    """
+    LRU of thread states with a TTL, local to this worker. Every store has get and save plus
+    aget and asave for the event loop, which here do the same without leaving it.
+    """
+
+    def __init__(self, max_threads: int = THREAD_STORE_MAX_THREADS, ttl_seconds: int = THREAD_STORE_TTL_SECONDS):
+        self.max_threads = max_threads
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._threads = OrderedDict()
+
+    def get(self, thread_id: str) -> Optional[ThreadState]:
+        with self._lock:
+            entry = self._threads.get(thread_id)
+            if entry is None:
+                return None
+            expires_at, state = entry
+            if expires_at < time.monotonic():
+                del self._threads[thread_id]
+                return None
+            self._threads.move_to_end(thread_id)
+            return state
+
+    def save(self, thread_id: str, state: ThreadState, start: int):
+        with self._lock:
+            self._threads[thread_id] = (time.monotonic() + self.ttl_seconds, state)
+            self._threads.move_to_end(thread_id)
+            while len(self._threads) > self.max_threads:
+                self._threads.popitem(last=False)
+
+    async def aget(self, thread_id: str) -> Optional[ThreadState]:
+        return self.get(thread_id)
+
+    async def asave(self, thread_id: str, state: ThreadState, start: int):
+        self.save(thread_id, state, start)
+
+    def delete(self, thread_id: str):
+        with self._lock:
+            self._threads.pop(thread_id, None)
+
+class SQLiteThreadStore:
+    """
+    Thread states persisted to a SQLite file so they survive restarts and can be shared by
+    workers on the same host. Converted messages are stored one row each, so a new turn
+    only appends the rows for its new messages. aget and asave run on a worker thread, so a
+    slow disk does not hold up the event loop.
+    """
+
+    def __init__(self, path: str = THREAD_STORE_PATH, ttl_seconds: int = THREAD_STORE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        columns = [row[1] for row in self._conn.execute('PRAGMA table_info(thread_messages)')]
+        if columns and 'hash' not in columns:
+            # Written by a version that only kept the first and last fingerprint, the states are rebuilt on demand
+            self._conn.execute('DROP TABLE thread_messages')
+            self._conn.execute('DROP TABLE IF EXISTS threads')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS threads (thread_id TEXT PRIMARY KEY, updated_at REAL, pending TEXT)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS thread_messages (thread_id TEXT, seq INTEGER, message TEXT, '
+                           'hash TEXT, PRIMARY KEY (thread_id, seq))')
+
+    def get(self, thread_id: str) -> Optional[ThreadState]:
+        with self._lock:
+            row = self._conn.execute('SELECT updated_at, pending FROM threads WHERE thread_id = ?',
+                                     (thread_id,)).fetchone()
+            if row is None:
+                return None
+            if row[0] + self.ttl_seconds < time.time():
+                self._delete(thread_id)
+                return None
+            rows = self._conn.execute('SELECT message, hash FROM thread_messages WHERE thread_id = ? ORDER BY seq',
+                                      (thread_id,)).fetchall()
+        messages = messages_from_dict([json.loads(message) for message, _ in rows])
+        return ThreadState(messages, tuple(json.loads(row[1])), tuple(hash for _, hash in rows))
+
+    def save(self, thread_id: str, state: ThreadState, start: int):
+        new_rows = [(thread_id, seq, json.dumps(message), state.hashes[seq])
+                    for seq, message in enumerate(messages_to_dict(state.messages[start:]), start)]
+        now = time.time()
+        with self._lock:
+            self._conn.execute('BEGIN')
+            try:
+                # Rows from start on belong to turns that were edited or regenerated
+                self._conn.execute('DELETE FROM thread_messages WHERE thread_id = ? AND seq >= ?', (thread_id, start))
+                self._conn.executemany('INSERT INTO thread_messages VALUES (?, ?, ?, ?)', new_rows)
+                self._conn.execute('INSERT OR REPLACE INTO threads VALUES (?, ?, ?)',
+                                   (thread_id, now, json.dumps(list(state.pending_tool_call_ids))))
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    async def aget(self, thread_id: str) -> Optional[ThreadState]:
+        return await asyncio.to_thread(self.get, thread_id)
+
+    async def asave(self, thread_id: str, state: ThreadState, start: int):
+        await asyncio.to_thread(self.save, thread_id, state, start)
+
+    def delete(self, thread_id: str):
+        with self._lock:
+            self._delete(thread_id)
+
+    def _delete(self, thread_id: str):
+        self._conn.execute('DELETE FROM thread_messages WHERE thread_id = ?', (thread_id,))
+        self._conn.execute('DELETE FROM threads WHERE thread_id = ?', (thread_id,))
+
+def create_thread_store(kind: str = THREAD_STORE):
+    if kind == 'memory':
+        return InMemoryThreadStore()
+    if kind == 'sqlite':
+        return SQLiteThreadStore()
+    if kind != 'none':
+        logger.error(f"Unknown THREAD_STORE {kind}, thread store disabled")
+    return None
+
+thread_store = create_thread_store()
@@ -1,33 +1,212 @@
+# Kept identical in every example that uses it, see SHARED_MODULES in external_agent/examples/shared_modules.py
 import os
+import json
 import time
+import asyncio
+import hashlib
+import logging
+import tempfile
+import threading
 import requests
-import json
+from concurrent.futures import Future
+from metrics import IAM_TOKEN_FETCH
+
+logger = logging.getLogger()
+
+IAM_URL = os.getenv("IAM_URL", "https://iam.cloud.ibm.com/identity/token")
+# Optional file used to persist tokens across restarts. Tokens are kept in memory only when unset.
+TOKEN_CACHE_FILE = os.getenv("WATSONX_TOKEN_CACHE_FILE", None)
+# Tokens are refreshed in the background once they are this close (in seconds) to expiring
+TOKEN_REFRESH_MARGIN = int(os.getenv("WATSONX_TOKEN_REFRESH_MARGIN", "300"))
+# Below this remaining lifetime (in seconds) a token is no longer handed out and callers wait for a new one
+TOKEN_MIN_VALIDITY = 60
+# Connect and read timeout of IAM calls. Callers waiting for a token are blocked for at most this long per attempt
+IAM_TIMEOUT_SECONDS = float(os.getenv("IAM_TIMEOUT_SECONDS", "10"))
+
+
+class TokenManager:
+    """
+    Keeps the IAM access token for one API key in memory.
+
+    Callers get the cached token without any I/O while it is fresh. Once it enters the
+    refresh margin a single background thread fetches a new one while callers keep using
+    the current token. Concurrent refreshes are collapsed into one IAM call, and callers
+    that wait for it share its outcome: when IAM fails or times out they all get that error
+    at once instead of each trying again in turn.
+    """
+
+    def __init__(
+        self,
+        api_key,
+        iam_url=IAM_URL,
+        cache_file=TOKEN_CACHE_FILE,
+        refresh_margin=TOKEN_REFRESH_MARGIN,
+    ):
+        self.api_key = api_key
+        self.iam_url = iam_url
+        self.cache_file = cache_file
+        self.refresh_margin = refresh_margin
+        self._session = requests.Session()
+        self._state_lock = threading.Lock()
+        self._refreshing = False
+        # Future of the IAM call in progress, if any
+        self._in_flight = None
+        # (token, expires_at) is swapped as a single tuple so readers never see a torn update
+        self._state = (None, 0.0)
+        if self.cache_file:
+            self._state = self._load_from_file()
+
+    def get_token(self) -> str:
+        token, expires_at = self._state
+        now = time.time()
+        if token and now < expires_at - self.refresh_margin:
+            return token
+        if token and now < expires_at - TOKEN_MIN_VALIDITY:
+            self._refresh_in_background()
+            return token
+        return self._refresh()
+
+    async def aget_token(self) -> str:
+        token, expires_at = self._state
+        now = time.time()
+        if token and now < expires_at - self.refresh_margin:
+            return token
+        if token and now < expires_at - TOKEN_MIN_VALIDITY:
+            self._refresh_in_background()
+            return token
+        return await asyncio.to_thread(self._refresh)
+
+    def _refresh(self) -> str:
+        with self._state_lock:
+            # Another caller may have completed the refresh in the meantime
+            token, expires_at = self._state
+            if token and time.time() < expires_at - self.refresh_margin:
+                return token
+            future = self._in_flight
+            if future is not None:
+                owner = False
+            else:
+                owner, future = True, Future()
+                self._in_flight = future
+        if not owner:
+            return future.result()
+        try:
+            token, expires_at = self._request_token()
+            self._state = (token, expires_at)
+            if self.cache_file:
+                self._save_to_file(token, expires_at)
+            future.set_result(token)
+            return token
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._state_lock:
+                self._in_flight = None
+
+    def _refresh_in_background(self):
+        with self._state_lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self._refresh()
+            except Exception as e:
+                logger.error(f"Background IAM token refresh failed: {str(e)}")
+            finally:
+                with self._state_lock:
+                    self._refreshing = False
 
-def get_access_token(WATSONX_API_KEY):
-    api_key = WATSONX_API_KEY  
-    file_path = './current_token.txt'
-    url = "https://iam.cloud.ibm.com/identity/token"
-    headers = {'content-type': 'application/x-www-form-urlencoded',
-               'accept': 'application/json'}
-    data = {'grant_type': 'urn:ibm:params:oauth:grant-type:apikey',
-            'apikey': api_key}
-
-    if os.path.isfile(file_path):
-        file_time = os.path.getmtime(file_path)
-        if time.time() - file_time < 3600:
-            print("Retrieved cached token ")
-            with open(file_path, "r") as file:
-                return file.read()
-
-    response = requests.post(url, headers=headers, data=data) 
-
-    if response.status_code == 200:
+        threading.Thread(target=run, name="iam-token-refresh", daemon=True).start()
+
+    def _request_token(self):
+        headers = {
+            "content-type": "application/x-www-form-urlencoded",
+            "accept": "application/json",
+        }
+        data = {
+            "grant_type": "urn:ibm:params:oauth:grant-type:apikey",
+            "apikey": self.api_key,
+        }
+        with IAM_TOKEN_FETCH.time():
+            try:
+                response = self._session.post(
+                    self.iam_url,
+                    headers=headers,
+                    data=data,
+                    timeout=IAM_TIMEOUT_SECONDS,
+                )
+            except requests.RequestException as e:
+                raise Exception(f"Failed to get access token: {str(e)}") from e
+        if response.status_code != 200:
+            raise Exception(f"Failed to get access token: HTTP {response.status_code}")
         token_data = json.loads(response.text)
-        token = token_data["access_token"]
-
-        with open(file_path, "w") as file:
-            file.write(token)
-        print("Retrieved new token for ")
-        return token
-    else:
-        raise Exception("Failed to get access token")
+        now = time.time()
+        if "expires_in" in token_data:
+            expires_at = now + int(token_data["expires_in"])
+        elif "expiration" in token_data:
+            expires_at = float(token_data["expiration"])
+        else:
+            expires_at = now + 3600
+        logger.info("Retrieved new IAM token")
+        return token_data["access_token"], expires_at
+
+    def _file_key(self):
+        return hashlib.sha256(self.api_key.encode("utf-8")).hexdigest()
+
+    def _read_file(self):
+        try:
+            with open(self.cache_file, "r") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def _load_from_file(self):
+        entry = self._read_file().get(self._file_key())
+        if entry and entry.get("expires_at", 0) - TOKEN_MIN_VALIDITY > time.time():
+            logger.info("Retrieved cached token from file")
+            return entry["access_token"], float(entry["expires_at"])
+        return None, 0.0
+
+    def _save_to_file(self, token, expires_at):
+        entries = self._read_file()
+        entries[self._file_key()] = {"access_token": token, "expires_at": expires_at}
+        # Write to a temporary file in the same directory and swap it in, so that concurrent
+        # readers never observe a partially written file
+        directory = os.path.dirname(os.path.abspath(self.cache_file))
+        try:
+            fd, tmp_path = tempfile.mkstemp(
+                dir=directory, prefix=".token-", suffix=".tmp"
+            )
+            with os.fdopen(fd, "w") as file:
+                json.dump(entries, file)
+            os.replace(tmp_path, self.cache_file)
+        except OSError as e:
+            logger.warning(
+                f"Could not persist IAM token to {self.cache_file}: {str(e)}"
+            )
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_token_manager(api_key) -> TokenManager:
+    manager = _managers.get(api_key)
+    if manager is None:
+        with _managers_lock:
+            manager = _managers.get(api_key)
+            if manager is None:
+                manager = TokenManager(api_key)
+                _managers[api_key] = manager
+    return manager
+
+
+def get_access_token(WATSONX_API_KEY) -> str:
+    return get_token_manager(WATSONX_API_KEY).get_token()
+
+
+async def aget_access_token(WATSONX_API_KEY) -> str:
+    return await get_token_manager(WATSONX_API_KEY).aget_token()
@@ -0,0 +1,129 @@
+# Kept identical in every example that uses it, see SHARED_MODULES in external_agent/examples/shared_modules.py
+import time
+import asyncio
+import logging
+import functools
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger()
+
+
+def normalize_query(value):
+    """Case and whitespace differences between otherwise identical search queries map to the same key."""
+    if isinstance(value, str):
+        return " ".join(value.lower().split())
+    return value
+
+
+class ToolResultCache:
+    """Size-bounded LRU of tool results where every entry expires ttl_seconds after it was stored."""
+
+    def __init__(self, name: str, ttl_seconds: float, max_entries: int):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """Returns (True, value) on a hit and (False, None) on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+tool_caches = {}
+
+
+def cached_tool(name: str, ttl_seconds: float, max_entries: int):
+    """
+    Caches the results of a tool function by its normalized arguments.
+
+    Apply it under the framework's @tool decorator (LangChain or BeeAI). functools.wraps keeps
+    the signature and docstring the decorator builds the tool schema from. Works for both
+    sync and async functions. Exceptions and results with cacheable = False are not cached.
+    Cached results are shared between callers and must not be modified.
+    """
+    cache = tool_caches.get(name)
+    if cache is None:
+        cache = tool_caches[name] = ToolResultCache(name, ttl_seconds, max_entries)
+
+    def make_key(args, kwargs):
+        return (
+            tuple(normalize_query(arg) for arg in args),
+            tuple(
+                sorted((key, normalize_query(value)) for key, value in kwargs.items())
+            ),
+        )
+
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                key = make_key(args, kwargs)
+                found, value = cache.get(key)
+                if found:
+                    logger.debug(f"Tool cache hit for {name}")
+                    return value
+                value = await func(*args, **kwargs)
+                if getattr(value, "cacheable", True):
+                    cache.put(key, value)
+                return value
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = make_key(args, kwargs)
+            found, value = cache.get(key)
+            if found:
+                logger.debug(f"Tool cache hit for {name}")
+                return value
+            value = func(*args, **kwargs)
+            if getattr(value, "cacheable", True):
+                cache.put(key, value)
+            return value
+
+        return wrapper
+
+    return decorator
+
+
+def tool_cache_stats() -> dict:
+    return {name: cache.stats() for name, cache in tool_caches.items()}
@@ -0,0 +1,36 @@
+import asyncio
+import logging
+from config import (TOOL_CONCURRENCY, TOOL_TIMEOUT_SECONDS, TOOL_HEDGE_ENABLED, TOOL_HEDGE_MIN_SECONDS,
+                    TOOL_BREAKER_FAILURES, TOOL_BREAKER_RESET_SECONDS, TOOL_THREADS)
+from resilience import ResilientTool
+
+logger = logging.getLogger()
+
+# Shared by every run on this worker, so a burst of parallel tool calls cannot exhaust the tool threads
+_tool_semaphore = asyncio.Semaphore(TOOL_CONCURRENCY)
+_resilient_tools = {}
+
+def get_resilient_tool(name: str) -> ResilientTool:
+    resilient_tool = _resilient_tools.get(name)
+    if resilient_tool is None:
+        resilient_tool = _resilient_tools[name] = ResilientTool(
+            name, TOOL_TIMEOUT_SECONDS, hedge=TOOL_HEDGE_ENABLED, hedge_min_seconds=TOOL_HEDGE_MIN_SECONDS,
+            failure_threshold=TOOL_BREAKER_FAILURES, reset_seconds=TOOL_BREAKER_RESET_SECONDS,
+            max_threads=TOOL_THREADS)
+    return resilient_tool
+
+async def run_tool(name: str, func, *args):
+    """
+    Runs a blocking tool function on one of the threads of that tool.
+
+    When the model requests several tools in one step, LangGraph awaits their coroutines
+    together, so independent calls overlap. At most TOOL_CONCURRENCY tools run at once per
+    worker. Each tool has its own deadline, hedging and circuit breaker (see ResilientTool).
+    A slow or failing upstream returns a degraded result to the model instead of holding
+    up the run.
+    """
+    async with _tool_semaphore:
+        return await get_resilient_tool(name).call(func, *args)
+
+def resilience_stats() -> dict:
+    return {name: resilient_tool.stats() for name, resilient_tool in _resilient_tools.items()}
@@ -1,20 +1,45 @@
-from langchain_core.tools import tool
+import functools
+from langchain_core.tools import StructuredTool
 from langchain_community.tools import DuckDuckGoSearchResults
+from config import TOOL_CACHE_TTL_SECONDS, TOOL_CACHE_MAX_ENTRIES
+from tool_cache import cached_tool
+from tool_executor import run_tool
 
-@tool
-def web_search_duckduckgo(search_phrase: str):
+@functools.lru_cache(maxsize=None)
+def get_search(backend: str = None) -> DuckDuckGoSearchResults:
+    # The search wrappers hold no per-query state, so one instance per backend is shared by all calls
+    if backend:
+        return DuckDuckGoSearchResults(backend=backend)
+    return DuckDuckGoSearchResults()
+
+# Each tool has a sync function and an async variant that share one result cache. LangGraph
+# uses the async variant when the agent runs with ainvoke/astream_events.
+
+@cached_tool('web_search_duckduckgo', TOOL_CACHE_TTL_SECONDS, TOOL_CACHE_MAX_ENTRIES)
+def _web_search(search_phrase: str):
     """Search the web using duckduckgo."""
-    search = DuckDuckGoSearchResults()
-    results = search.run(search_phrase) 
+    results = get_search().run(search_phrase) 
     return results
 
-@tool
-def news_search_duckduckgo(search_phrase: str):
+@cached_tool('web_search_duckduckgo', TOOL_CACHE_TTL_SECONDS, TOOL_CACHE_MAX_ENTRIES)
+async def _aweb_search(search_phrase: str):
+    """Search the web using duckduckgo."""
+    return await run_tool('web_search_duckduckgo', get_search().run, search_phrase)
+
+@cached_tool('news_search_duckduckgo', TOOL_CACHE_TTL_SECONDS, TOOL_CACHE_MAX_ENTRIES)
+def _news_search(search_phrase: str):
     """Search news using duckduckgo."""
-    search = DuckDuckGoSearchResults(backend="news")
-    results = search.run(search_phrase) 
+    results = get_search("news").run(search_phrase) 
     return results
 
+@cached_tool('news_search_duckduckgo', TOOL_CACHE_TTL_SECONDS, TOOL_CACHE_MAX_ENTRIES)
+async def _anews_search(search_phrase: str):
+    """Search news using duckduckgo."""
+    return await run_tool('news_search_duckduckgo', get_search("news").run, search_phrase)
+
+web_search_duckduckgo = StructuredTool.from_function(func=_web_search, coroutine=_aweb_search, name="web_search_duckduckgo")
+news_search_duckduckgo = StructuredTool.from_function(func=_news_search, coroutine=_anews_search, name="news_search_duckduckgo")
+
 tool_choices = {
     "web_search_duckduckgo": web_search_duckduckgo,
     "news_search_duckduckgo": news_search_duckduckgo,
@@ -0,0 +1,152 @@
+import logging
+from langchain_core.callbacks import BaseCallbackHandler
+from config import OTEL_TRACES_EXPORTER, OTEL_SERVICE_NAME
+
+logger = logging.getLogger()
+
+try:
+    from opentelemetry import trace, propagate
+    from opentelemetry.trace import SpanKind, Status, StatusCode
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import SimpleSpanProcessor, BatchSpanProcessor, ConsoleSpanExporter
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+except ImportError:
+    trace = None
+
+tracer = None
+# Holds the finished spans when OTEL_TRACES_EXPORTER=memory
+memory_exporter = None
+
+def setup_tracing():
+    global tracer, memory_exporter
+    if OTEL_TRACES_EXPORTER in ('', 'none'):
+        return
+    if trace is None:
+        logger.warning("OTEL_TRACES_EXPORTER is set but opentelemetry-sdk is not installed, tracing is disabled")
+        return
+    provider = TracerProvider(resource=Resource.create({'service.name': OTEL_SERVICE_NAME}))
+    if OTEL_TRACES_EXPORTER == 'console':
+        provider.add_span_processor(SimpleSpanProcessor(ConsoleSpanExporter()))
+    elif OTEL_TRACES_EXPORTER == 'memory':
+        memory_exporter = InMemorySpanExporter()
+        provider.add_span_processor(SimpleSpanProcessor(memory_exporter))
+    elif OTEL_TRACES_EXPORTER == 'otlp':
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        except ImportError:
+            logger.warning("OTEL_TRACES_EXPORTER=otlp requires opentelemetry-exporter-otlp-proto-http, tracing is disabled")
+            return
+        # Endpoint and headers come from the standard OTEL_EXPORTER_OTLP_* variables
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    else:
+        logger.warning(f"Unknown OTEL_TRACES_EXPORTER {OTEL_TRACES_EXPORTER}, tracing is disabled")
+        return
+    trace.set_tracer_provider(provider)
+    tracer = provider.get_tracer('external-agent')
+    logger.info(f"Tracing enabled with the {OTEL_TRACES_EXPORTER} exporter")
+
+def _attributes(thread_id: str, attributes: dict) -> dict:
+    attributes = {key: value for key, value in attributes.items() if value is not None}
+    attributes['thread_id'] = thread_id
+    return attributes
+
+def start_request_span(headers, thread_id: str, **attributes):
+    """
+    Starts the span for one /chat/completions request as a child of the trace context in
+    the incoming headers (W3C traceparent by default). Returns None when tracing is disabled.
+    """
+    if tracer is None:
+        return None
+    parent = propagate.extract(headers) if headers else None
+    return tracer.start_span('chat.completions', context=parent, kind=SpanKind.SERVER,
+                             attributes=_attributes(thread_id, attributes))
+
+def end_span(span, error: BaseException = None):
+    if span is None:
+        return
+    if error is not None:
+        span.record_exception(error)
+        span.set_status(Status(StatusCode.ERROR, str(error)))
+    span.end()
+
+def tracing_config(request_span, thread_id: str) -> dict:
+    """RunnableConfig that reports the graph run, its nodes, LLM calls and tool calls as children of request_span."""
+    if request_span is None:
+        return {}
+    return {'callbacks': [TracingCallbackHandler(request_span, thread_id)]}
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """
+    Turns LangChain callbacks into spans: one for the graph run and one per LangGraph node,
+    LLM call and tool call. Internal runnables such as routers and channel writes get no span
+    of their own, their children are attached to the closest traced ancestor.
+    """
+    # Starting and ending spans is cheap, so callbacks run on the event loop instead of a thread pool
+    run_inline = True
+
+    def __init__(self, request_span, thread_id: str):
+        self.request_span = request_span
+        self.thread_id = thread_id
+        self._spans = {}
+        self._untraced = {}
+
+    def _parent(self, parent_run_id):
+        if parent_run_id is None:
+            return self.request_span
+        return self._spans.get(parent_run_id) or self._untraced.get(parent_run_id) or self.request_span
+
+    def _start(self, run_id, parent_run_id, name: str, **attributes):
+        context = trace.set_span_in_context(self._parent(parent_run_id))
+        self._spans[run_id] = tracer.start_span(name, context=context, attributes=_attributes(self.thread_id, attributes))
+
+    def _end(self, run_id, error: BaseException = None):
+        self._untraced.pop(run_id, None)
+        end_span(self._spans.pop(run_id, None), error)
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        name = kwargs.get('name') or (serialized or {}).get('name') or 'chain'
+        node = (metadata or {}).get('langgraph_node')
+        if parent_run_id is None:
+            self._start(run_id, None, f"graph {name}")
+        elif node and name == node:
+            self._start(run_id, parent_run_id, f"node {node}", **{'langgraph.node': node, 'langgraph.step': metadata.get('langgraph_step')})
+        else:
+            self._untraced[run_id] = self._parent(parent_run_id)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, parent_run_id=None, **kwargs):
+        if parent_run_id is None:
+            self.request_span.set_status(Status(StatusCode.ERROR, str(error)))
+        self._end(run_id, error)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        metadata = metadata or {}
+        model = metadata.get('ls_model_name') or kwargs.get('name') or 'chat_model'
+        self._start(run_id, parent_run_id, f"llm {model}", **{'gen_ai.request.model': model, 'gen_ai.system': metadata.get('ls_provider')})
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        span = self._spans.get(run_id)
+        if span is not None and response.generations and response.generations[0]:
+            usage = getattr(getattr(response.generations[0][0], 'message', None), 'usage_metadata', None)
+            if usage:
+                span.set_attribute('gen_ai.usage.input_tokens', usage.get('input_tokens', 0))
+                span.set_attribute('gen_ai.usage.output_tokens', usage.get('output_tokens', 0))
+        self._end(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, parent_run_id=None, **kwargs):
+        name = kwargs.get('name') or (serialized or {}).get('name') or 'tool'
+        self._start(run_id, parent_run_id, f"tool {name}", **{'tool.name': name})
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+setup_tracing()
@@ -0,0 +1,215 @@
+"""
+Drives concurrent /chat/completions traffic against an external agent and reports throughput
+and latency.
+
+Each of --concurrency workers sends requests back to back for --duration seconds. A request is
+streaming with probability --stream-ratio. For streaming requests the time to first token (first
+SSE frame with text content) and the inter-token latency (gap between text frames) are recorded.
+Results can be written as JSON and compared with a baseline, which fails the run on regressions.
+Run with: python loadgen.py --url http://127.0.0.1:8081 --concurrency 16 --duration 30
+"""
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import httpx
+
+class ModeStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.latencies = []
+        self.ttfts = []
+        self.itls = []
+
+    def summary(self, elapsed: float) -> dict:
+        summary = {
+            'requests': self.requests,
+            'errors': self.errors,
+            'rps': (self.requests - self.errors) / elapsed if elapsed else 0.0,
+            'latency': percentiles(self.latencies),
+        }
+        if self.ttfts or self.itls:
+            summary['ttft'] = percentiles(self.ttfts)
+            summary['itl'] = percentiles(self.itls)
+        return summary
+
+def percentiles(values) -> dict:
+    if not values:
+        return {'p50': None, 'p90': None, 'p99': None, 'max': None}
+    ordered = sorted(values)
+
+    def rank(p):
+        return ordered[min(len(ordered) - 1, max(0, int(round(p * len(ordered))) - 1))]
+    return {'p50': rank(0.50), 'p90': rank(0.90), 'p99': rank(0.99), 'max': ordered[-1]}
+
+def build_body(request_number: int, stream: bool, args) -> dict:
+    messages = []
+    for i in range(args.history):
+        messages.append({'role': 'user', 'content': f"Earlier question {i} about the quarterly report"})
+        messages.append({'role': 'assistant', 'content': f"Earlier answer {i} with some detail about the numbers"})
+    # A distinct question per request, so tool result caches do not hide the tool latency
+    messages.append({'role': 'user', 'content': f"What happened on the markets today? (request {request_number})"})
+    body = {'messages': messages, 'stream': stream}
+    if args.model:
+        body['model'] = args.model
+    return body
+
+def text_content(data: str):
+    """Returns the text of an SSE data payload that carries assistant text, otherwise None."""
+    try:
+        event = json.loads(data)
+        delta = event['choices'][0]['delta']
+    except (ValueError, KeyError, IndexError, TypeError):
+        return None
+    content = delta.get('content')
+    return content if isinstance(content, str) and content else None
+
+async def streaming_request(client: httpx.AsyncClient, url: str, body: dict, stats: ModeStats):
+    start = time.perf_counter()
+    last_token_at = None
+    failed = False
+    async with client.stream('POST', url, json=body) as response:
+        if response.status_code != 200:
+            await response.aread()
+            failed = True
+        else:
+            async for line in response.aiter_lines():
+                if line.startswith('Error:'):
+                    failed = True
+                if not line.startswith('data: ') or text_content(line[6:]) is None:
+                    continue
+                now = time.perf_counter()
+                if last_token_at is None:
+                    stats.ttfts.append(now - start)
+                else:
+                    stats.itls.append(now - last_token_at)
+                last_token_at = now
+    if last_token_at is None:
+        failed = True
+    return failed, time.perf_counter() - start
+
+async def sync_request(client: httpx.AsyncClient, url: str, body: dict, stats: ModeStats):
+    start = time.perf_counter()
+    response = await client.post(url, json=body)
+    failed = response.status_code != 200 or not response.json().get('choices')
+    return failed, time.perf_counter() - start
+
+async def worker(client, url, args, deadline, counter, results, rng):
+    while time.perf_counter() < deadline:
+        counter[0] += 1
+        stream = rng.random() < args.stream_ratio
+        stats = results['stream' if stream else 'sync']
+        body = build_body(counter[0], stream, args)
+        try:
+            failed, latency = await (streaming_request if stream else sync_request)(client, url, body, stats)
+        except httpx.HTTPError as e:
+            failed, latency = True, None
+            if stats.errors < 3:
+                print(f"Request failed: {e!r}", file=sys.stderr)
+        stats.requests += 1
+        if failed:
+            stats.errors += 1
+        elif latency is not None:
+            stats.latencies.append(latency)
+
+async def run_load(args) -> dict:
+    url = args.url.rstrip('/') + '/chat/completions'
+    headers = {'Authorization': 'Bearer loadtest'}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    results = {'stream': ModeStats(), 'sync': ModeStats()}
+    counter = [0]
+    rng = random.Random(args.seed)
+    async with httpx.AsyncClient(headers=headers, limits=limits, timeout=args.timeout) as client:
+        if args.warmup:
+            warmup = {'stream': ModeStats(), 'sync': ModeStats()}
+            deadline = time.perf_counter() + args.warmup
+            await asyncio.gather(*(worker(client, url, args, deadline, [0], warmup, random.Random(i))
+                                   for i in range(min(args.concurrency, 4))))
+        start = time.perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(*(worker(client, url, args, deadline, counter, results, rng) for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+    report = {mode: stats.summary(elapsed) for mode, stats in results.items() if stats.requests}
+    report['total_rps'] = sum(mode['rps'] for mode in report.values())
+    report['config'] = {'concurrency': args.concurrency, 'duration': args.duration, 'stream_ratio': args.stream_ratio,
+                        'history': args.history, 'elapsed': elapsed}
+    return report
+
+def format_seconds(value) -> str:
+    return f"{value * 1000:10.1f}" if value is not None else f"{'-':>10}"
+
+def print_report(report: dict, title: str = None):
+    if title:
+        print(f"\n== {title} ==")
+    config = report['config']
+    print(f"concurrency {config['concurrency']}, {config['elapsed']:.1f}s, stream ratio {config['stream_ratio']}, "
+          f"history {config['history']} turns, total {report['total_rps']:.1f} req/s")
+    print(f"{'':<20}{'requests':>9}{'errors':>8}{'req/s':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for mode in ('stream', 'sync'):
+        summary = report.get(mode)
+        if not summary:
+            continue
+        rows = [('latency', summary['latency'])]
+        if 'ttft' in summary:
+            rows += [('ttft', summary['ttft']), ('inter-token', summary['itl'])]
+        for i, (name, values) in enumerate(rows):
+            label = f"{mode} {name}"
+            counts = f"{summary['requests']:>9}{summary['errors']:>8}{summary['rps']:>8.1f}" if i == 0 else " " * 25
+            print(f"{label:<20}{counts}" + "".join(format_seconds(values[p]) for p in ('p50', 'p90', 'p99', 'max')))
+
+def compare(report: dict, baseline: dict, max_regression: float) -> list:
+    """Returns a description of every metric that is more than max_regression worse than the baseline."""
+    regressions = []
+    for mode in ('stream', 'sync'):
+        current, previous = report.get(mode), baseline.get(mode)
+        if not current or not previous:
+            continue
+        if previous['rps'] and current['rps'] < previous['rps'] * (1 - max_regression):
+            regressions.append(f"{mode} req/s {current['rps']:.1f} < baseline {previous['rps']:.1f}")
+        for metric in ('latency', 'ttft', 'itl'):
+            now, before = current.get(metric, {}).get('p99'), previous.get(metric, {}).get('p99')
+            if now is not None and before and now > before * (1 + max_regression):
+                regressions.append(f"{mode} {metric} p99 {now * 1000:.1f} ms > baseline {before * 1000:.1f} ms")
+    return regressions
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--concurrency', type=int, default=16, help="concurrent clients (default 16)")
+    parser.add_argument('--duration', type=float, default=30, help="seconds of measured load (default 30)")
+    parser.add_argument('--warmup', type=float, default=3, help="seconds of unmeasured load first (default 3)")
+    parser.add_argument('--stream-ratio', type=float, default=0.8, help="fraction of streaming requests (default 0.8)")
+    parser.add_argument('--history', type=int, default=5, help="earlier user/assistant turns per request (default 5)")
+    parser.add_argument('--model', default=None, help="model field of the requests")
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', dest='json_path', help="write the results to this file")
+    parser.add_argument('--baseline', help="results file of an earlier run to compare with")
+    parser.add_argument('--max-regression', type=float, default=0.15,
+                        help="allowed relative drop of req/s or rise of p99 against the baseline (default 0.15)")
+
+def finish(report: dict, args, title: str = None) -> int:
+    print_report(report, title)
+    if args.json_path:
+        with open(args.json_path, 'w') as file:
+            json.dump(report, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(report, json.load(file), args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            return 1
+        print(f"No regressions beyond {args.max_regression:.0%} against {args.baseline}")
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument('--url', default='http://127.0.0.1:8081', help="base URL of the agent")
+    add_arguments(parser)
+    args = parser.parse_args()
+    sys.exit(finish(asyncio.run(run_load(args)), args))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+Local stand-in for the services the example agents call, for load tests.
+
+- POST /v1/chat/completions: OpenAI compatible chat completions, streaming and non-streaming.
+  When the request offers tools and the last message is from the user, the model first asks
+  for the first tool, with the user message as its argument.
+- POST /ml/v4/deployments/{id}/ai_service and /ai_service_stream: watsonx.ai AI service
+  deployments, returning the delta/choices schema the agent builder example expects.
+- POST /identity/token: IBM Cloud IAM tokens.
+
+Responses are paced: the first token after --ttft-ms, then --tokens tokens at --token-rate
+tokens per second. Run with: python mock_llm.py --port 8090
+"""
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI()
+settings = argparse.Namespace(ttft_ms=200, token_rate=50.0, tokens=60, tool_calls=True, tool_latency_ms=300)
+
+def _tokens():
+    return [f" token{i}" for i in range(settings.tokens)]
+
+async def _paced(tokens):
+    """Yields the tokens with the configured time to first token and token rate."""
+    await asyncio.sleep(settings.ttft_ms / 1000)
+    interval = 1 / settings.token_rate if settings.token_rate > 0 else 0
+    for i, token in enumerate(tokens):
+        if i and interval:
+            await asyncio.sleep(interval)
+        yield token
+
+def _sse(data) -> str:
+    return "data: " + json.dumps(data, separators=(',', ':')) + "\n\n"
+
+def _requested_tool_call(body: dict):
+    """Returns (name, arguments) when the model should call a tool before answering."""
+    tools = body.get('tools')
+    messages = body.get('messages') or []
+    if not settings.tool_calls or not tools or not messages or messages[-1].get('role') != 'user':
+        return None
+    function = tools[0]['function']
+    properties = list(function.get('parameters', {}).get('properties', {}))
+    content = messages[-1].get('content') or ''
+    arguments = {properties[0]: content[:200]} if properties else {}
+    return function['name'], json.dumps(arguments)
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+@app.post("/identity/token")
+async def identity_token():
+    return {"access_token": "mock-" + uuid.uuid4().hex, "expires_in": 3600, "token_type": "Bearer"}
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    completion_id = "chatcmpl-" + uuid.uuid4().hex
+    created = int(time.time())
+    model = body.get('model', 'mock')
+    tool_call = _requested_tool_call(body)
+
+    def chunk(delta, finish_reason=None):
+        return _sse({"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]})
+
+    if body.get('stream'):
+        async def stream():
+            if tool_call:
+                await asyncio.sleep(settings.ttft_ms / 1000)
+                name, arguments = tool_call
+                yield chunk({"role": "assistant", "content": None, "tool_calls": [
+                    {"index": 0, "id": "call_" + uuid.uuid4().hex[:12], "type": "function",
+                     "function": {"name": name, "arguments": arguments}}]})
+                yield chunk({}, "tool_calls")
+            else:
+                yield chunk({"role": "assistant", "content": ""})
+                async for token in _paced(_tokens()):
+                    yield chunk({"content": token})
+                yield chunk({}, "stop")
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    if tool_call:
+        await asyncio.sleep(settings.ttft_ms / 1000)
+        name, arguments = tool_call
+        message = {"role": "assistant", "content": None, "tool_calls": [
+            {"id": "call_" + uuid.uuid4().hex[:12], "type": "function", "function": {"name": name, "arguments": arguments}}]}
+        finish_reason = "tool_calls"
+    else:
+        content = "".join([token async for token in _paced(_tokens())])
+        message = {"role": "assistant", "content": content}
+        finish_reason = "stop"
+    return JSONResponse({"id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                         "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+                         "usage": {"prompt_tokens": 10, "completion_tokens": settings.tokens, "total_tokens": 10 + settings.tokens}})
+
+@app.post("/ml/v4/deployments/{deployment_id}/ai_service")
+async def ai_service(deployment_id: str):
+    content = "".join([token async for token in _paced(_tokens())])
+    return {"choices": [{"index": 0, "message": {"role": "assistant", "content": content}}]}
+
+@app.post("/ml/v4/deployments/{deployment_id}/ai_service_stream")
+async def ai_service_stream(deployment_id: str, request: Request):
+    body = await request.json()
+    messages = body.get('messages') or []
+    query = (messages[-1].get('content') or '')[:200] if messages else ''
+
+    async def stream():
+        if settings.tool_calls:
+            await asyncio.sleep(settings.ttft_ms / 1000)
+            call_id = "call_" + uuid.uuid4().hex[:12]
+            yield _sse({"choices": [{"index": 0, "delta": {"role": "assistant", "tool_calls": [
+                {"id": call_id, "type": "function", "function": {"name": "search", "arguments": json.dumps({"query": query})}}]}}]})
+            await asyncio.sleep(settings.tool_latency_ms / 1000)
+            yield _sse({"choices": [{"index": 0, "delta": {"role": "tool", "name": "search", "tool_call_id": call_id,
+                                                           "content": f"Results for {query}"}}]})
+        async for token in _paced(_tokens()):
+            yield _sse({"choices": [{"index": 0, "delta": {"role": "assistant", "content": token}}]})
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--ttft-ms', type=float, default=200, help="delay before the first token (default 200)")
+    parser.add_argument('--token-rate', type=float, default=50, help="tokens per second after the first one (default 50)")
+    parser.add_argument('--tokens', type=int, default=60, help="tokens per answer (default 60)")
+    parser.add_argument('--tool-latency-ms', type=float, default=300,
+                        help="time the AI service deployment spends in its tool (default 300)")
+    parser.add_argument('--no-tool-calls', dest='tool_calls', action='store_false',
+                        help="answer directly instead of asking for a tool first")
+
+def main():
+    import uvicorn
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    add_arguments(parser)
+    args = parser.parse_args()
+    for key in vars(settings):
+        setattr(settings, key, getattr(args, key))
+    print(f"Mock LLM on http://{args.host}:{args.port} with {vars(settings)}", file=sys.stderr)
+    uvicorn.run(app, host=args.host, port=args.port, log_level='warning')
+
+if __name__ == '__main__':
+    main()
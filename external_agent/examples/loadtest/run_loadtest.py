@@ -0,0 +1,105 @@
+"""
+Runs the load test end to end: starts the mock server and an example agent on free local ports,
+drives traffic with loadgen, prints the report and stops both servers.
+
+Server output goes to <app>-server.log and mock.log in --log-dir. Everything after the app
+name is passed on, see --help. Examples:
+
+    python run_loadtest.py langgraph --concurrency 32 --duration 60
+    python run_loadtest.py agent_builder --json current.json --baseline baseline.json
+    python run_loadtest.py all --token-rate 100 --no-tool-calls
+"""
+import os
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import httpx
+import loadgen
+import mock_llm
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APPS = ('langgraph', 'agent_builder')
+# The LangGraph example only talks to OpenAI compatible endpoints through ChatOpenAI for gpt-* models
+DEFAULT_MODELS = {'langgraph': 'gpt-4o-mini', 'agent_builder': None}
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_ready(url: str, process: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server for {url} exited with code {process.returncode}, see its log")
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Server for {url} did not become ready within {timeout} seconds")
+
+def start(command, log_path: str) -> subprocess.Popen:
+    log = open(log_path, 'w')
+    return subprocess.Popen([sys.executable, *command], cwd=HERE, stdout=log, stderr=subprocess.STDOUT)
+
+def stop(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+def run_app(app: str, args) -> dict:
+    mock_port, app_port = free_port(), free_port()
+    mock_url = f"http://127.0.0.1:{mock_port}"
+    mock_args = ['--ttft-ms', str(args.ttft_ms), '--token-rate', str(args.token_rate), '--tokens', str(args.tokens),
+                 '--tool-latency-ms', str(args.tool_latency_ms)] + ([] if args.tool_calls else ['--no-tool-calls'])
+    mock = start(['mock_llm.py', '--port', str(mock_port), *mock_args], os.path.join(args.log_dir, f"{app}-mock.log"))
+    server = None
+    try:
+        wait_ready(mock_url + '/health', mock)
+        server = start(['serve_agent.py', app, '--port', str(app_port), '--mock-url', mock_url,
+                        '--search-latency-ms', str(args.tool_latency_ms)],
+                       os.path.join(args.log_dir, f"{app}-server.log"))
+        app_url = f"http://127.0.0.1:{app_port}"
+        wait_ready(app_url + '/docs', server)
+        load_args = argparse.Namespace(**vars(args))
+        load_args.url = app_url
+        load_args.model = args.model or DEFAULT_MODELS[app]
+        return asyncio.run(loadgen.run_load(load_args))
+    finally:
+        if server is not None:
+            stop(server)
+        stop(mock)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0], formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     epilog=__doc__.split("Examples:")[1])
+    parser.add_argument('app', choices=APPS + ('all',))
+    parser.add_argument('--log-dir', default=None, help="directory for server logs (default: a new temporary directory)")
+    loadgen.add_arguments(parser)
+    mock_llm.add_arguments(parser)
+    args = parser.parse_args()
+    args.log_dir = args.log_dir or tempfile.mkdtemp(prefix='loadtest-')
+    os.makedirs(args.log_dir, exist_ok=True)
+    apps = APPS if args.app == 'all' else (args.app,)
+    json_path, baseline = args.json_path, args.baseline
+    status = 0
+    for app in apps:
+        report = run_app(app, args)
+        # With several apps, results and baselines are per app: current.json -> current-langgraph.json
+        if len(apps) > 1:
+            args.json_path = json_path and json_path.replace('.json', f"-{app}.json")
+            args.baseline = baseline and baseline.replace('.json', f"-{app}.json")
+        status |= loadgen.finish(report, args, title=app)
+    print(f"\nServer logs in {args.log_dir}")
+    sys.exit(status)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Starts one of the example agents against the mock server (see mock_llm.py) for load tests.
+
+- langgraph: langgraph_python/app.py with an OpenAI model whose requests go to the mock through
+  OPENAI_BASE_URL. The DuckDuckGo searches are replaced by a fake with a fixed latency, so the
+  tool cache, tool executor and graph still run.
+- agent_builder: agent_builder/app.py with IAM tokens from the mock and a wx.ai client whose
+  deployment calls stream from the mock over HTTP, like the real client does.
+
+Everything else (routing, conversion, encoding, logging, metrics) is the code under test.
+Run with: python serve_agent.py langgraph --port 8081 --mock-url http://127.0.0.1:8090
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP_DIRS = {
+    'langgraph': os.path.join(HERE, '..', 'langgraph_python'),
+    'agent_builder': os.path.join(HERE, '..', 'agent_builder'),
+}
+
+class FakeSearch:
+    """Replaces DuckDuckGoSearchResults: blocks for the configured latency like a network call."""
+
+    def __init__(self, backend, latency_seconds: float):
+        self.backend = backend or 'text'
+        self.latency_seconds = latency_seconds
+
+    def run(self, query: str) -> str:
+        time.sleep(self.latency_seconds)
+        return f"snippet: Mock {self.backend} result for {query}, title: Mock result, link: https://example.com/{abs(hash(query))}"
+
+class FakeDeployments:
+    """Implements the two deployment calls the agent builder example uses, against the mock server."""
+
+    def __init__(self, mock_url: str):
+        self.mock_url = mock_url
+        self._local = threading.local()
+
+    def _session(self):
+        import requests
+        # One session per worker thread, the stream bridge and run_blocking call from a thread pool
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def run_ai_service(self, deployment_id, payload):
+        response = self._session().post(f"{self.mock_url}/ml/v4/deployments/{deployment_id}/ai_service", json=payload)
+        response.raise_for_status()
+        return response.json()
+
+    def run_ai_service_stream(self, deployment_id, payload):
+        with self._session().post(f"{self.mock_url}/ml/v4/deployments/{deployment_id}/ai_service_stream",
+                                  json=payload, stream=True) as response:
+            response.raise_for_status()
+            for line in response.iter_lines(decode_unicode=True):
+                if line and line.startswith('data: '):
+                    yield line[6:]
+
+class FakeWxaiClient:
+    def __init__(self, mock_url: str):
+        self.deployments = FakeDeployments(mock_url)
+
+def load_langgraph(args):
+    os.environ['OPENAI_BASE_URL'] = args.mock_url + '/v1'
+    os.environ.setdefault('OPENAI_API_KEY', 'mock')
+    import tools
+    tools.get_search = lambda backend=None: FakeSearch(backend, args.search_latency_ms / 1000)
+    import app
+    return app.app
+
+def load_agent_builder(args):
+    os.environ['IAM_URL'] = args.mock_url + '/identity/token'
+    os.environ.setdefault('WATSONX_API_KEY', 'mock')
+    os.environ.setdefault('WATSONX_DEPLOYMENT_ID', 'mock-deployment')
+    import utils
+    client = FakeWxaiClient(args.mock_url)
+
+    def get_wxai_client(token=None):
+        # Still fetch the token, so the token manager is part of the measured path
+        token or utils._get_access_token()
+        return client
+
+    utils._get_wxai_client = get_wxai_client
+    import app
+    return app.app
+
+def main():
+    import uvicorn
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument('app', choices=sorted(APP_DIRS))
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--mock-url', default='http://127.0.0.1:8090')
+    parser.add_argument('--search-latency-ms', type=float, default=300, help="latency of the fake searches (default 300)")
+    args = parser.parse_args()
+    app_dir = os.path.abspath(APP_DIRS[args.app])
+    sys.path.insert(0, app_dir)
+    os.chdir(app_dir)
+    app = load_langgraph(args) if args.app == 'langgraph' else load_agent_builder(args)
+    uvicorn.run(app, host=args.host, port=args.port, log_level='warning')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Keeps the modules that several examples use unchanged in sync.
+
+Every example is deployed on its own: its Dockerfile builds an image from the example's
+directory only, so a module outside that directory would not be in the image, and the README
+of each example walks through copying just that directory. The examples therefore keep their own
+copy of the modules below instead of importing a common package. The copy in the first listed
+example is the one to edit. This script copies it over the others, or with --check exits with
+an error when a copy has drifted:
+
+    python3 shared_modules.py [--check]
+"""
+import os
+import sys
+import argparse
+
+EXAMPLES_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# module -> directories that hold a copy, the first one is the source
+SHARED_MODULES = {
+    "sse.py": ["langgraph_python", "agent_builder"],
+    "bench_sse.py": ["langgraph_python", "agent_builder"],
+    "coalesce.py": ["langgraph_python", "agent_builder"],
+    "admission.py": ["langgraph_python", "agent_builder"],
+    "auth.py": ["langgraph_python", "agent_builder"],
+    "token_utils.py": ["langgraph_python", "agent_builder"],
+    "response_cache.py": ["langgraph_python", "agent_builder"],
+    "stream_replay.py": ["langgraph_python", "agent_builder"],
+    "stats_metrics.py": ["langgraph_python", "agent_builder"],
+    "tool_cache.py": ["langgraph_python", "beeai_framework_python/beeai_python"],
+    "resilience.py": ["langgraph_python", "beeai_framework_python/beeai_python"],
+}
+
+
+def copies():
+    for module, directories in SHARED_MODULES.items():
+        source = os.path.join(EXAMPLES_DIR, directories[0], module)
+        for directory in directories[1:]:
+            yield source, os.path.join(EXAMPLES_DIR, directory, module)
+
+
+def read(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy the shared modules from their source example to the others")
+    parser.add_argument("--check", action="store_true", help="only report copies that differ from their source")
+    args = parser.parse_args()
+    drifted = []
+    for source, target in copies():
+        content = read(source)
+        if read(target) == content:
+            continue
+        drifted.append(os.path.relpath(target, EXAMPLES_DIR))
+        if not args.check:
+            with open(target, "wb") as f:
+                f.write(content)
+    for path in drifted:
+        print(f"{'differs' if args.check else 'updated'}: {path}")
+    if args.check and drifted:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()